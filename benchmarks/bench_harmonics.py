@@ -0,0 +1,22 @@
+'''
+Nearest-harmonic search of `harmonics.py`.
+'''
+
+import numpy as np
+
+from common import measure
+from iimrp.harmonics import find_nearest_harmonics, freq_to_harmonics_and_gains
+
+def run(quick:bool=False) -> list[dict]:
+    n = 2000 if quick else 20000
+    freqs = np.random.default_rng(0).uniform(27.5, 4000, n).tolist()
+    def nearest():
+        for f in freqs:
+            find_nearest_harmonics(f, 8)
+    def harmonics_and_gains():
+        for f in freqs:
+            freq_to_harmonics_and_gains(f, 8)
+    return [
+        {'name': 'harmonics.find_nearest_harmonics', 'group': 'harmonics', **measure(nearest, n)},
+        {'name': 'harmonics.freq_to_harmonics_and_gains', 'group': 'harmonics', **measure(harmonics_and_gains, n)},
+    ]
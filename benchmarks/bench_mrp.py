@@ -0,0 +1,62 @@
+'''
+`MRP` client throughput, sending real OSC packets to a local sink.
+'''
+
+import copy
+
+from common import measure, OSCSink, SinkOSC
+from iimrp.iimrp import MRP
+
+def make_mrp(sink:OSCSink, **settings) -> MRP:
+    mrp = MRP(SinkOSC(sink))
+    mrp.settings = copy.deepcopy(mrp.default_settings) | settings
+    return mrp
+
+def run(quick:bool=False) -> list[dict]:
+    scale = 10 if quick else 1
+    sink = OSCSink()
+    results = []
+    try:
+        mrp = make_mrp(sink)
+        notes = list(range(36, 84))
+
+        n = 20000 // scale
+        def note_on_off():
+            for i in range(n // 2):
+                note = notes[i % len(notes)]
+                mrp.note_on(note)
+                mrp.note_off(note)
+        results.append({'name': 'mrp.note_on_off', **measure(note_on_off, n, setup=mrp.all_notes_off)})
+        mrp.metrics_on()
+        results.append({'name': 'mrp.note_on_off.metrics', **measure(note_on_off, n, setup=mrp.all_notes_off)})
+        mrp.metrics_off()
+
+        # qualities are only sent to notes that are on
+        sounding = notes[:16]
+        for note in sounding:
+            mrp.note_on(note)
+        n = 20000 // scale
+        def quality_scalar():
+            for i in range(n):
+                mrp.set_note_quality(sounding[i % len(sounding)], 'brightness', (i % 100) / 100)
+        results.append({'name': 'mrp.set_note_quality.scalar', **measure(quality_scalar, n)})
+
+        n = 10000 // scale
+        harmonics = [1.0, 0.5, 0.33, 0.25, 0.2, 0.16, 0.14, 0.12]
+        def quality_harmonics_raw():
+            for i in range(n):
+                mrp.set_note_quality(sounding[i % len(sounding)], 'harmonics_raw', harmonics)
+        results.append({'name': 'mrp.set_note_quality.harmonics_raw', **measure(quality_harmonics_raw, n)})
+
+        # every note on beyond the 16 voices turns the oldest voice off
+        n = 20000 // scale
+        def voice_stealing():
+            for i in range(n):
+                mrp.note_on(notes[i % len(notes)])
+        results.append({'name': 'mrp.voice_stealing', **measure(voice_stealing, n, setup=mrp.all_notes_off)})
+        mrp.all_notes_off()
+    finally:
+        sink.close()
+    for r in results:
+        r['group'] = 'mrp'
+    return results
@@ -0,0 +1,30 @@
+'''
+`MRPHeatMonitor.monitor_heat` ticks with 16 sounding notes.
+'''
+
+import io
+import contextlib
+
+from common import measure, OSCSink
+from bench_mrp import make_mrp
+
+def run(quick:bool=False) -> list[dict]:
+    n = 200 if quick else 2000
+    sink = OSCSink()
+    try:
+        mrp = make_mrp(sink, heat_monitor=True)
+        from iimrp.thermal import MRPHeatMonitor
+        monitor = MRPHeatMonitor(mrp)
+        for note in range(48, 64):
+            mrp.note_on(note)
+            mrp.set_note_quality(note, 'harmonics_raw', [1.0, 0.5, 0.25, 0.125])
+        def ticks():
+            # monitor_heat prints the state of every note on each tick
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(n):
+                    monitor.monitor_heat()
+        result = measure(ticks, n)
+        mrp.all_notes_off()
+    finally:
+        sink.close()
+    return [{'name': 'thermal.monitor_heat', 'group': 'thermal', **result}]
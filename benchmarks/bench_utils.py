@@ -0,0 +1,47 @@
+'''
+`utils.mrp_to_df` and `utils.df_to_mrp` on a synthetic log of several megabytes.
+'''
+
+import io
+import os
+import tempfile
+import contextlib
+import numpy as np
+
+from common import measure
+from iimrp.utils import mrp_to_df, df_to_mrp
+
+def synthetic_log(file:str, n:int, seed:int=0) -> int:
+    """
+    Write a log of n /mrp/midi and scalar /mrp/quality/* lines (the lines `mrp_to_df` reads),
+    returning its size in bytes.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.exponential(0.01, n))
+    notes = rng.integers(21, 109, n)
+    kind = rng.integers(0, 4, n)
+    qualities = ('brightness', 'intensity', 'harmonic')
+    values = rng.random(n)
+    with open(file, 'w') as f:
+        for t, k, note, v in zip(times.tolist(), kind.tolist(), notes.tolist(), values.tolist()):
+            if k == 0:
+                f.write(f"{t:.5f} /mrp/midi iii {159 if v > 0.5 else 143} {note} {127 if v > 0.5 else 0}\n")
+            else:
+                f.write(f"{t:.5f} /mrp/quality/{qualities[k - 1]} iif 15 {note} {v:.5f}\n")
+    return os.path.getsize(file)
+
+def run(quick:bool=False) -> list[dict]:
+    n = 20000 if quick else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, 'synthetic.log')
+        size = synthetic_log(log, n)
+        df = mrp_to_df(log)
+        read = measure(lambda: mrp_to_df(log), n, repeat=3)
+        def write():
+            with contextlib.redirect_stdout(io.StringIO()):
+                df_to_mrp(df.copy(), os.path.join(tmp, 'out.log'))
+        written = measure(write, n, repeat=3)
+    return [
+        {'name': 'utils.mrp_to_df', 'group': 'utils', 'bytes': size, **read},
+        {'name': 'utils.df_to_mrp', 'group': 'utils', 'bytes': size, **written},
+    ]
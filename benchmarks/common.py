@@ -0,0 +1,124 @@
+'''
+Shared helpers of the benchmark suite: timing, a local OSC sink, and JSON results.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import threading
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+def measure(fn, n:int, repeat:int=5, setup=None) -> dict:
+    """
+    Time fn(), which performs n operations, repeat times.
+
+    Args
+        fn (callable): the benchmark body
+        n (int): operations per call, for the throughput
+        repeat (int): number of timed calls
+        setup (callable): called before each timed call, untimed
+
+    Returns
+        dict: 'n', 'repeat', 'best_s', 'median_s' and 'ops_per_s' (from the best time)
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    return {'n': n, 'repeat': repeat, 'best_s': best, 'median_s': statistics.median(times),
+            'ops_per_s': n / best if best > 0 else float('inf')}
+
+class OSCSink:
+    """
+    A UDP socket on localhost that receives and counts datagrams in a background thread,
+    standing in for the MRP software.
+    """
+    def __init__(self, ip:str='127.0.0.1', port:int=0) -> None:
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind((ip, port))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.packets = 0
+        self.bytes = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.packets += 1
+            self.bytes += len(data)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self.sock.close()
+
+class SinkOSC:
+    """
+    The part of the iipyper OSC interface used by `MRP`, sending real OSC packets with
+    python-osc to an `OSCSink`.
+    """
+    def __init__(self, sink:OSCSink) -> None:
+        from pythonosc.udp_client import SimpleUDPClient
+        self._client_class = SimpleUDPClient
+        self.sink = sink
+        self.clients = {}
+
+    def get_client_by_name(self, name:str):
+        return self.clients.get(name)
+
+    def create_client(self, name:str, ip:str, port:int):
+        # every client sends to the sink, whatever address the caller asked for
+        self.clients[name] = self._client_class(*self.sink.address)
+
+    def send(self, path:str, *args, client:str=None):
+        self.clients[client].send_message(path, list(args))
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment() -> dict:
+    import numpy as np
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'revision': _git_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def write_results(results:list, file:str):
+    """Write benchmark results with a description of the environment as JSON."""
+    with open(file, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=1)
+
+def compare_results(results:list, baseline_file:str) -> list:
+    """Return (name, baseline ops/s, ops/s, ratio) for the benchmarks in both runs."""
+    with open(baseline_file) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    rows = []
+    for r in results:
+        b = baseline.get(r['name'])
+        if b is not None:
+            rows.append((r['name'], b['ops_per_s'], r['ops_per_s'], r['ops_per_s'] / b['ops_per_s']))
+    return rows
@@ -0,0 +1,72 @@
+'''
+Import time of the iimrp package and its submodules.
+
+Each import runs in a fresh interpreter, `repeat` times. Reports the median wall time of the
+interpreter minus that of an empty one, the cumulative import time Python reports with
+`-X importtime`, and the optional dependencies the import pulled in.
+
+Usage
+    python benchmarks/import_time.py [--repeat 10] [--json import_time.json] [module ...]
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+MODULES = ('iimrp', 'iimrp.recording', 'iimrp.state', 'iimrp.iimrp', 'iimrp.harmonics', 'iimrp.utils')
+OPTIONAL = ('numpy', 'pandas', 'tqdm', 'mido', 'bokeh')
+
+def run(code:str, importtime:bool=False) -> tuple[float, str, str]:
+    """Run code in a fresh interpreter, returning the wall time, stdout and stderr."""
+    args = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', code]
+    t0 = time.perf_counter()
+    result = subprocess.run(args, cwd=SRC, capture_output=True, text=True, check=True)
+    return time.perf_counter() - t0, result.stdout, result.stderr
+
+def cumulative_us(stderr:str, module:str) -> int:
+    """Cumulative microseconds of a module from `-X importtime` output."""
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    return 0
+
+def bench_import(module:str, repeat:int=10) -> dict:
+    baseline = statistics.median(run('pass')[0] for _ in range(repeat))
+    walls, cumulative = [], []
+    for _ in range(repeat):
+        wall, _, err = run(f'import {module}', importtime=True)
+        walls.append(wall - baseline)
+        cumulative.append(cumulative_us(err, module))
+    _, out, _ = run(f'import sys, {module}; print(*sys.modules)')
+    return {
+        'module': module,
+        'wall_ms': 1e3 * statistics.median(walls),
+        'import_ms': 1e-3 * statistics.median(cumulative),
+        'optional_loaded': [m for m in OPTIONAL if m in out.split()],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    results = []
+    for module in args.modules:
+        r = bench_import(module, args.repeat)
+        results.append(r)
+        print(f"{module:20s} {r['wall_ms']:8.1f} ms wall {r['import_ms']:8.1f} ms import  {' '.join(r['optional_loaded'])}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'import_time', 'python': platform.python_version(),
+                       'platform': platform.platform(), 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+Run the benchmark suite: `MRP` client throughput against a local OSC sink, nearest-harmonic
+search, heat monitor ticks, and MRP DataFrame reading and writing.
+
+Usage
+    python benchmarks/run.py [--quick] [--json results.json] [--compare baseline.json] [group ...]
+
+Results are written as JSON (see `common.write_results`), so runs of different versions can
+be compared with --compare.
+'''
+
+import argparse
+
+from common import write_results, compare_results
+import bench_mrp
+import bench_harmonics
+import bench_thermal
+import bench_utils
+
+GROUPS = {'mrp': bench_mrp, 'harmonics': bench_harmonics, 'thermal': bench_thermal, 'utils': bench_utils}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('groups', nargs='*', help=f"groups to run, of {', '.join(GROUPS)} (default all)")
+    parser.add_argument('--quick', action='store_true', help='run fewer iterations')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of a previous run to compare with')
+    args = parser.parse_args()
+    for group in args.groups:
+        if group not in GROUPS:
+            parser.error(f"unknown group '{group}'")
+    results = []
+    for group in args.groups or GROUPS:
+        for r in GROUPS[group].run(args.quick):
+            results.append(r)
+            print(f"{r['name']:40s} {r['ops_per_s']:14,.0f} ops/s {1e3 * r['best_s']:10.2f} ms")
+    if args.json:
+        write_results(results, args.json)
+    if args.compare:
+        print(f"\ncompared with {args.compare}:")
+        for name, before, after, ratio in compare_results(results, args.compare):
+            print(f"{name:40s} {before:14,.0f} -> {after:14,.0f} ops/s  x{ratio:.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,99 @@
-from .harmonics import *
-from .iimrp import *
+'''
+Magnetic Resonator Piano tools.
+
+Submodules are imported on first use, so `import iimrp` is cheap: `iimrp.MRP` imports
+`iimrp.iimrp` (and NumPy) the first time it is accessed, and `from iimrp import *` imports
+everything as before. Optional dependencies (pandas, tqdm, mido, bokeh) are only imported
+by the functions that use them.
+'''
+
+import importlib
+
+_EXPORTS = {
+    'harmonics': (
+        'create_harmonics', 'MAX_HARMONICS', 'piano_harmonics', 'find_harmonic',
+        'find_nearest_harmonics', 'create_single_harmonic_gain_array', 'get_harmonic_gain_arrays',
+        'freq_to_harmonics_and_gains', 'instrument_harmonics', 'harmonic_frequencies',
+        'create_frequency_map', 'midi_to_freq', 'freq_to_midi', 'harmonic_map_for_frequencies',
+        'harmonic_map_for_midi_notes', 'basic_harmonic_series', 'alternating_sign_harmonic_series',
+        'odd_harmonic_series', 'even_harmonic_series', 'shifted_harmonic_series',
+        'reverse_basic_harmonic_series', 'reverse_odd_harmonic_series', 'prime_harmonic_series',
+        'squared_harmonic_series', 'cubic_harmonic_series', 'const_base_harmonic_series',
+        'fibonacci_harmonic_series', 'triangular_number_harmonic_series',
+        'factorial_harmonic_series', 'geometric_progression_harmonic_series', 'power_series',
+        'logarithmic_harmonic_series', 'double_harmonic_series', 'harmonic_series_with_sin',
+        'harmonic_series_with_cos', 'harmonic_series_with_tan', 'exponent_harmonic_series',
+        'prime_power_series', 'fibonacci_square_series', 'reciprocals_of_triangular_numbers',
+        'create_subplot', 'plot_grid'),
+    'thermal': (
+        'HEAT_INCREASE', 'HARMONICS_SCALAR', 'HEAT_DISSIPATION', 'OVERHEATING_RISK',
+        'COOLING_PERIOD', 'MRPHeatMonitor', 'MRPNoteHeatMonitor'),
+    'iimrp': (
+        'NOTE_ON', 'NOTE_OFF', 'clamp', 'MRP'),
+    'patch': (
+        'DEFAULT_PATCH_FILE', 'MAX_HARMONICS_RAW', 'QUALITIES', 'SCALING_PARAMETERS', 'db_to_amp',
+        'parse_range_value', 'concave_curve', 'MRPQualityParameter', 'MRPPatch', 'MRPPatchTable',
+        'load_patch_table'),
+    'simulator': (
+        'SIM_QUALITIES', 'MRPSimulator', 'render_log'),
+    'recording': (
+        'MAX_VECTOR', 'VECTOR_PATH', 'MRP_PATHS', 'LOG_DTYPE', 'COMPRESSION', 'open_log',
+        'LogBatch', 'parse_log_line', 'parse_log_lines', 'iter_log', 'iter_log_messages',
+        'concat_batches', 'empty_batch', 'read_log', 'LOG_TAGS', 'format_log_line',
+        'format_log_lines', 'write_log', 'VECTOR_SCALE', 'VECTOR_DELTA_NAMES',
+        'encode_vector_deltas', 'decode_vector_deltas', 'save_recording', 'load_recording',
+        'MRPRecorder'),
+    'state': (
+        'STATE_QUALITIES', 'STATE_H', 'STATE_PEDALS', 'STATE_UI', 'NOTE_ON_STATUS',
+        'NOTE_OFF_STATUS', 'STATE_BUNDLE_BYTES', 'MRPState', 'osc_message_size', 'bundle_messages'),
+    'index': (
+        'INDEX_SUFFIX', 'index_file', 'is_text_log', 'MRPLogIndex', 'load_index'),
+    'replay': (
+        'MRPReplay',),
+    'midi': (
+        'QUALITY_CC', 'PEDAL_CC', 'ALL_NOTES_OFF_CC', 'DEFAULT_TEMPO', 'MIDI_DTYPE',
+        'ticks_to_seconds', 'read_midi', 'midi_to_mrp', 'midi_to_log', 'midi_files_to_logs',
+        'encode_vlq', 'write_midi', 'mrp_to_midi'),
+    'compact': (
+        'compact_batch', 'verify_compaction', 'compact_log'),
+    'analytics': (
+        'NOTES_PER_BOARD', 'BOARD_START', 'N_BOARDS', 'VOICES_MAX', 'RATE_BINS', 'default_boards',
+        'boards_from_mrp', 'note_intervals', 'RecordingStats', 'analyze', 'analyze_files'),
+    'dataset': (
+        'PIANO_ROLL_KEYS', 'PIANO_ROLL_START', 'INDEX_FILE', 'piano_roll_features', 'n_frames',
+        'piano_roll_chunks', 'build_dataset', 'PianoRollDataset'),
+    'emulator': (
+        'EMULATOR_PREFIXES', 'decode_datagram', 'MRPEmulator'),
+    'metrics': (
+        'LATENCY_BUCKETS', 'METRICS_METHODS', 'METRICS_PREFIX', 'LatencyHistogram', 'MRPMetrics',
+        'instrument', 'uninstrument', 'PrometheusExporter'),
+    'commands': (
+        'MRPCommandQueue',),
+    'cluster': (
+        'CLUSTER_POLICIES', 'MRPCluster'),
+    'gateway': (
+        'GATEWAY_MAX_BUNDLE', 'GatewayOSC', 'MRPGateway'),
+    'envelopes': (
+        'ENVELOPE_QUALITIES', 'MRPEnvelope', 'MRPEnvelopes'),
+    'sequencer': (
+        'SEQUENCER_EVENT_DTYPE', 'EVENT_NOTE_OFF', 'EVENT_NOTE_ON', 'EVENT_QUALITY', 'MRPPattern',
+        'MRPSequencer'),
+    'diagnostics': (
+        'DIAGNOSTICS_PATH', 'DIAGNOSTICS_QUALITIES', 'MRPDiagnostics'),
+}
+_SUBMODULES = (*_EXPORTS, 'utils')
+_LAZY = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_LAZY)
+
+def __getattr__(name:str):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(f'.{_LAZY[name]}', __name__), name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *_SUBMODULES, *_LAZY})
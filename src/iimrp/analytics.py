@@ -0,0 +1,273 @@
+'''
+Analytics of MRP recordings, for planning hardware maintenance.
+
+`analyze` computes, in vectorized passes over a recording:
+- per-key on-time and note-on counts
+- per-board on-time, duty cycle (time with at least one note on the board) and load
+  (mean fraction of the board's notes on), with boards as in `MRP.amp_notes`
+- the time spent at each polyphony, the peak polyphony and the time over `voices['max']`
+- message counts per OSC path, and histograms of their per-second rates
+
+Results are `RecordingStats`, which add up, so `analyze_files` can aggregate many
+recordings (analyzed in a process pool).
+
+Example
+    stats = analyze_files(sorted(glob('logs/*.log')), mrp=mrp)
+    stats.summary()
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .recording import LogBatch, load_recording
+
+NOTES_PER_BOARD = 18 # as in MRP.setup_amp_data
+BOARD_START = 21
+N_BOARDS = 6
+VOICES_MAX = 16
+RATE_BINS = np.array([0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, np.inf]) # messages per second
+
+def default_boards() -> np.ndarray:
+    """Board of each MIDI note (-1 for none), for the default 3 amps x 2 rows of 18 notes."""
+    notes = np.arange(128)
+    boards = (notes - BOARD_START) // NOTES_PER_BOARD
+    return np.where((notes >= BOARD_START) & (boards < N_BOARDS), boards, -1)
+
+def boards_from_mrp(mrp) -> np.ndarray:
+    """Board of each MIDI note (-1 for none), from `MRP.amp_notes`."""
+    boards = np.full(128, -1)
+    for board, notes in enumerate(mrp.amp_notes):
+        numbers = [n for n in notes.values() if 0 <= n < 128]
+        boards[numbers] = board
+    return boards
+
+def note_intervals(batch:LogBatch) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return the intervals notes are on: from a note on (of a note that is off) to the next
+    note off of the note, /mrp/allnotesoff, or the end of the recording.
+
+    Returns
+        np.ndarray: note of each interval
+        np.ndarray: start time
+        np.ndarray: end time
+        np.ndarray: note on velocity
+    """
+    n = len(batch)
+    path = np.asarray(batch['path'])
+    status = np.asarray(batch['channel']).astype(np.int64)
+    note = np.asarray(batch['note']).astype(np.int64)
+    value = np.asarray(batch['value'])
+    time = np.asarray(batch['time'])
+    is_midi = path == batch.path_id('/mrp/midi')
+    on = is_midi & (status & 0xF0 == 0x90) & (value > 0)
+    off = is_midi & ~on & np.isin(status & 0xF0, (0x80, 0x90))
+    resets = np.flatnonzero(path == batch.path_id('/mrp/allnotesoff'))
+    span = n + 1
+    # an on starts an interval unless the note's previous switch was an on with no reset since
+    switches = np.flatnonzero(on | off)
+    switch_keys = np.sort(note[switches] * span + switches)
+    ons = np.flatnonzero(on)
+    k = np.searchsorted(switch_keys, note[ons] * span + ons) - 1
+    prev = switch_keys[np.maximum(k, 0)]
+    prev_index = prev % span
+    already_on = (k >= 0) & (prev // span == note[ons]) & on[prev_index] \
+        & (np.searchsorted(resets, prev_index) == np.searchsorted(resets, ons))
+    starts = ons[~already_on]
+    # an interval ends at the note's next off, the next reset, or the end
+    offs = np.flatnonzero(off)
+    off_keys = np.sort(note[offs] * span + offs)
+    next_off = np.append(off_keys, n * span)[np.searchsorted(off_keys, note[starts] * span + starts)]
+    next_off = np.where(next_off // span == note[starts], next_off % span, n)
+    next_reset = np.append(resets, n)[np.searchsorted(resets, starts)]
+    stops = np.minimum(next_off, next_reset)
+    end_time = time[-1] if n else 0.0
+    stop_time = np.where(stops < n, time[np.minimum(stops, n - 1)], end_time)
+    return note[starts], time[starts], stop_time, value[starts]
+
+class RecordingStats:
+    """
+    Usage statistics of one or more recordings. Stats of different recordings can be added.
+
+    Attributes
+        duration (float): total seconds
+        key_on_time (np.ndarray): (128,) seconds each MIDI note was on
+        key_note_ons (np.ndarray): (128,) note ons of each MIDI note
+        board_on_time (np.ndarray): (B,) summed on-time of each board's notes
+        board_active_time (np.ndarray): (B,) seconds with at least one note on each board
+        board_notes (np.ndarray): (B,) notes on each board
+        polyphony_time (np.ndarray): (129,) seconds spent with each number of notes on
+        peak_polyphony (int): most notes on at once
+        voices_max (int): the MRP's maximum number of voices
+        messages (dict): message count per OSC path
+        rate_bins (np.ndarray): edges of the message rate histograms (messages per second)
+        rate_hist (dict): per OSC path, the number of seconds with a rate in each bin
+        files (int): number of recordings
+    """
+    def __init__(self, duration, key_on_time, key_note_ons, board_on_time, board_active_time, board_notes,
+                 polyphony_time, peak_polyphony, voices_max, messages, rate_bins, rate_hist, files=1) -> None:
+        self.duration = duration
+        self.key_on_time = key_on_time
+        self.key_note_ons = key_note_ons
+        self.board_on_time = board_on_time
+        self.board_active_time = board_active_time
+        self.board_notes = board_notes
+        self.polyphony_time = polyphony_time
+        self.peak_polyphony = peak_polyphony
+        self.voices_max = voices_max
+        self.messages = messages
+        self.rate_bins = rate_bins
+        self.rate_hist = rate_hist
+        self.files = files
+
+    def __add__(self, other:'RecordingStats') -> 'RecordingStats':
+        if other == 0: return self # for sum()
+        messages = dict(self.messages)
+        for p, c in other.messages.items():
+            messages[p] = messages.get(p, 0) + c
+        rate_hist = {p: h.copy() for p, h in self.rate_hist.items()}
+        for p, h in other.rate_hist.items():
+            rate_hist[p] = rate_hist[p] + h if p in rate_hist else h.copy()
+        return RecordingStats(
+            self.duration + other.duration,
+            self.key_on_time + other.key_on_time,
+            self.key_note_ons + other.key_note_ons,
+            self.board_on_time + other.board_on_time,
+            self.board_active_time + other.board_active_time,
+            self.board_notes,
+            self.polyphony_time + other.polyphony_time,
+            max(self.peak_polyphony, other.peak_polyphony),
+            self.voices_max, messages, self.rate_bins, rate_hist, self.files + other.files)
+
+    __radd__ = __add__
+
+    @property
+    def key_duty(self) -> np.ndarray:
+        """Fraction of time each MIDI note was on."""
+        return self.key_on_time / max(self.duration, 1e-12)
+
+    @property
+    def board_duty(self) -> np.ndarray:
+        """Fraction of time each board had at least one note on."""
+        return self.board_active_time / max(self.duration, 1e-12)
+
+    @property
+    def board_load(self) -> np.ndarray:
+        """Mean fraction of each board's notes that were on."""
+        return self.board_on_time / (max(self.duration, 1e-12) * np.maximum(self.board_notes, 1))
+
+    @property
+    def time_over_voices(self) -> float:
+        """Seconds with more notes on than voices_max."""
+        return float(self.polyphony_time[self.voices_max + 1:].sum())
+
+    @property
+    def message_rate(self) -> dict:
+        """Mean messages per second of each OSC path."""
+        return {p: c / max(self.duration, 1e-12) for p, c in self.messages.items()}
+
+    def summary(self) -> dict:
+        """Return the main statistics as plain Python values."""
+        return {
+            'files': self.files,
+            'duration': float(self.duration),
+            'note_ons': int(self.key_note_ons.sum()),
+            'busiest_keys': [int(k) for k in np.argsort(self.key_on_time)[::-1][:10] if self.key_on_time[k] > 0],
+            'board_duty': self.board_duty.round(4).tolist(),
+            'board_load': self.board_load.round(4).tolist(),
+            'peak_polyphony': int(self.peak_polyphony),
+            'voices_max': self.voices_max,
+            'time_over_voices': self.time_over_voices,
+            'messages': dict(self.messages),
+            'message_rate': {p: round(r, 3) for p, r in self.message_rate.items()},
+        }
+
+def analyze(recording, mrp=None, boards:np.ndarray=None, voices_max:int=None, rate_bins:np.ndarray=RATE_BINS) -> RecordingStats:
+    """
+    Compute the usage statistics of a recording.
+
+    Args
+        recording (str | LogBatch): recording (see `recording.load_recording`)
+        mrp (MRP): take the boards and voices_max from an MRP instance
+        boards (np.ndarray): (128,) board of each MIDI note, -1 for none, defaults to `default_boards`
+        voices_max (int): maximum voices, defaults to 16
+        rate_bins (np.ndarray): edges of the message rate histograms (messages per second)
+
+    Returns
+        RecordingStats: statistics of the recording
+    """
+    batch = load_recording(recording) if isinstance(recording, str) else recording
+    if mrp is not None:
+        boards = boards_from_mrp(mrp) if boards is None else boards
+        voices_max = mrp.settings['voices']['max'] if voices_max is None else voices_max
+    boards = default_boards() if boards is None else np.asarray(boards)
+    voices_max = VOICES_MAX if voices_max is None else voices_max
+    n_boards = int(boards.max()) + 1
+    time = np.asarray(batch['time'])
+    duration = float(time[-1] - time[0]) if len(time) else 0.0
+
+    notes, start, stop, _ = note_intervals(batch)
+    on_time = stop - start
+    key_on_time = np.bincount(notes, weights=on_time, minlength=128)[:128]
+    key_note_ons = np.bincount(notes, minlength=128)[:128]
+    board_notes = np.bincount(boards[boards >= 0], minlength=n_boards)
+    on_board = boards[notes] >= 0
+    board_on_time = np.bincount(boards[notes][on_board], weights=on_time[on_board], minlength=n_boards)
+
+    # sweep over interval starts (+1) and ends (-1), ends first at equal times
+    times = np.concatenate([start, stop])
+    delta = np.concatenate([np.ones(len(start), dtype=np.int64), -np.ones(len(stop), dtype=np.int64)])
+    order = np.lexsort((delta, times))
+    count = np.cumsum(delta[order])
+    dt = np.diff(times[order])
+    polyphony_time = np.bincount(count[:-1], weights=dt, minlength=129)[:129] if len(dt) else np.zeros(129)
+    polyphony_time[0] = duration - polyphony_time[1:].sum() # including before the first and after the last note
+    peak_polyphony = int(count.max()) if len(count) else 0
+    # per board: sorted by board, each board's sweep starts and ends at zero
+    board = np.concatenate([boards[notes], boards[notes]])
+    order = np.lexsort((delta, times, board))
+    order = order[board[order] >= 0]
+    count = np.cumsum(delta[order])
+    same_board = board[order][1:] == board[order][:-1]
+    active = (count[:-1] > 0) & same_board
+    board_active_time = np.bincount(board[order][:-1][active], weights=np.diff(times[order])[active], minlength=n_boards) \
+        if len(order) else np.zeros(n_boards)
+
+    # messages per path, and histograms of per-second rates
+    path = np.asarray(batch['path']).astype(np.int64)
+    n_paths = len(batch.paths)
+    counts = np.bincount(path, minlength=n_paths)
+    messages = {batch.paths[p]: int(c) for p, c in enumerate(counts) if c}
+    rate_hist = {}
+    if len(time):
+        seconds = (time - time[0]).astype(np.int64)
+        n_seconds = int(seconds[-1]) + 1 if len(seconds) else 0
+        per_second = np.bincount(path * n_seconds + seconds, minlength=n_paths * n_seconds).reshape(n_paths, n_seconds)
+        level = np.digitize(per_second, rate_bins[1:-1])
+        for p in np.flatnonzero(counts):
+            rate_hist[batch.paths[p]] = np.bincount(level[p], minlength=len(rate_bins) - 1)
+
+    return RecordingStats(duration, key_on_time, key_note_ons, board_on_time, board_active_time, board_notes,
+        polyphony_time, peak_polyphony, voices_max, messages, rate_bins, rate_hist)
+
+def analyze_files(files:list, mrp=None, workers:int=None, **kwargs) -> RecordingStats:
+    """
+    Analyze many recordings in a process pool and add up their statistics.
+
+    Args
+        files (list): recordings
+        mrp (MRP): take the boards and voices_max from an MRP instance
+        workers (int): number of processes, defaults to the number of CPUs
+        **kwargs: passed to `analyze`
+    """
+    if not files:
+        raise ValueError('analyze_files needs at least one file')
+    if mrp is not None:
+        kwargs.setdefault('boards', boards_from_mrp(mrp))
+        kwargs.setdefault('voices_max', mrp.settings['voices']['max'])
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        return sum(analyze(f, **kwargs) for f in files)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(analyze, f, **kwargs) for f in files]
+        return sum(f.result() for f in futures)
@@ -0,0 +1,261 @@
+'''
+Control several MRP-equipped pianos as one instrument.
+
+`MRPCluster` keeps one `MRP` per piano, each with its own OSC client (named after the
+instrument), address, key range and voice pool, so total polyphony and thermal headroom
+add up. Notes are routed to a piano by a policy and remembered, so note offs and quality
+updates reach the piano holding the note:
+
+    'split'         the first piano whose range contains the note (keyboard split)
+    'round_robin'   the next piano in turn
+    'least_loaded'  the piano using the smallest fraction of its voices
+    'coolest'       the piano where the note has the lowest heat score (see `thermal.py`),
+                    then the least loaded
+
+Except for 'split', pianos with a free voice are preferred, before the piano's own voice
+rule steals one. Bulk updates (`broadcast`, `set_notes_qualities`) are grouped into one
+batch per piano and the batches sent in parallel, one thread per piano.
+
+Example
+    cluster = MRPCluster(osc, [
+        {'name': 'mrp-a', 'address': {'ip': '10.0.0.10', 'port': 7770}},
+        {'name': 'mrp-b', 'address': {'ip': '10.0.0.11', 'port': 7770}},
+    ], policy='least_loaded')
+    cluster.note_on(60) # on mrp-a
+    cluster.note_on(64) # on mrp-b
+    cluster.set_notes_qualities({60: {'brightness': 0.5}, 64: {'intensity': 0.8}})
+    cluster.pedal_damper(1.0) # every piano
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .iimrp import MRP
+
+CLUSTER_POLICIES = ('split', 'round_robin', 'least_loaded', 'coolest')
+
+class MRPCluster:
+    """
+    Route notes to, and fan out updates across, several MRP instruments.
+
+    Args
+        osc: OSC interface shared by the instruments (iipyper OSC or compatible)
+        instruments (list): one dict per piano: 'name' (the OSC client name) and any MRP
+                            settings to override, e.g. 'address', 'range', 'voices'
+        policy (str): note routing policy, one of `CLUSTER_POLICIES`
+        parallel (bool): send per-instrument batches from one thread per instrument
+        **kwargs: passed to each MRP (verbose, metrics, ...)
+
+    Attributes
+        instruments (list): the MRP instances
+        names (list): the instrument names
+        routes (dict): note -> index of the instrument it was sent to
+    """
+    def __init__(self, osc, instruments:list, policy:str='split', parallel:bool=True, **kwargs) -> None:
+        if policy not in CLUSTER_POLICIES:
+            raise ValueError(f'unknown policy {policy!r}, expected one of {CLUSTER_POLICIES}')
+        if not instruments:
+            raise ValueError('MRPCluster needs at least one instrument')
+        self.osc = osc
+        self.policy = policy
+        self.parallel = parallel
+        self.names = []
+        self.instruments = []
+        for i, spec in enumerate(instruments):
+            settings = dict(spec)
+            name = settings.pop('name', f'mrp{i}')
+            if name in self.names:
+                raise ValueError(f'duplicate instrument name {name!r}')
+            self.names.append(name)
+            self.instruments.append(MRP(osc, client=name, settings=settings, **kwargs))
+        self.routes = {}
+        self._next = 0 # round robin position
+        self._executor = None
+
+    def __len__(self) -> int:
+        return len(self.instruments)
+
+    def __getitem__(self, name) -> MRP:
+        """Instrument by name or index."""
+        return self.instruments[self.names.index(name) if isinstance(name, str) else name]
+
+    """
+    routing
+    """
+    def candidates(self, note:int) -> list:
+        """Indices of the instruments whose range contains note."""
+        return [i for i, mrp in enumerate(self.instruments) if mrp.note_is_in_range(note)]
+
+    def load(self, i:int) -> float:
+        """Fraction of instrument i's voices in use."""
+        mrp = self.instruments[i]
+        return len(mrp.voices) / mrp.settings['voices']['max']
+
+    def heat(self, i:int, note:int) -> float:
+        """Heat score of note on instrument i, 0 without a heat monitor."""
+        mrp = self.instruments[i]
+        if not mrp.settings['heat_monitor'] or getattr(mrp, 'heat_monitor', None) is None:
+            return 0.0
+        return mrp.heat_monitor.notes[mrp.note_index(note)].heat_score
+
+    def route(self, note:int) -> int:
+        """
+        Index of the instrument the policy would send a new note to, None if no
+        instrument's range contains it.
+        """
+        candidates = self.candidates(note)
+        if not candidates:
+            return None
+        if self.policy == 'split':
+            return candidates[0]
+        free = [i for i in candidates if self.load(i) < 1]
+        if free:
+            candidates = free
+        match self.policy:
+            case 'round_robin':
+                n = len(self.instruments)
+                return min(candidates, key=lambda i: (i - self._next) % n)
+            case 'least_loaded':
+                return min(candidates, key=self.load)
+            case 'coolest':
+                return min(candidates, key=lambda i: (self.heat(i, note), self.load(i)))
+
+    def instrument_of(self, note:int) -> MRP:
+        """The instrument holding note, None if the note is off everywhere."""
+        i = self.routes.get(note)
+        if i is None or self.instruments[i].note_is_off(note):
+            return None
+        return self.instruments[i]
+
+    """
+    notes
+    """
+    def note_on(self, note:int, velocity:int=1, channel:int=None):
+        """Route a note on by the policy; returns the message sent, None if invalid."""
+        if self.instrument_of(note) is not None:
+            return None # already on, possibly on another instrument
+        i = self.route(note)
+        if i is None:
+            return None
+        sent = self.instruments[i].note_on(note, velocity, channel)
+        if sent is not None:
+            self.routes[note] = i
+            self._next = (i + 1) % len(self.instruments)
+        return sent
+
+    def note_off(self, note:int, velocity:int=0, channel:int=None):
+        i = self.routes.pop(note, None)
+        if i is None:
+            return None
+        return self.instruments[i].note_off(note, velocity, channel)
+
+    def set_note_quality(self, note:int, quality:str, value, relative:bool=False, channel:int=None):
+        mrp = self.instrument_of(note)
+        if mrp is None:
+            return None
+        return mrp.set_note_quality(note, quality, value, relative, channel)
+
+    def set_note_qualities(self, note:int, qualities:dict, relative:bool=False, channel:int=None):
+        mrp = self.instrument_of(note)
+        if mrp is None:
+            return None
+        return mrp.set_note_qualities(note, qualities, relative, channel)
+
+    def set_notes_qualities(self, updates:dict, relative:bool=False, channel:int=None) -> int:
+        """
+        Update the qualities of many notes, in one batch per instrument.
+
+        Args
+            updates (dict): note -> qualities dict
+        Returns
+            number of notes updated (notes that are off are skipped)
+        """
+        batches = [[] for _ in self.instruments]
+        for note, qualities in updates.items():
+            i = self.routes.get(note)
+            if i is not None and not self.instruments[i].note_is_off(note):
+                batches[i].append(('set_note_qualities', (note, qualities, relative, channel), {}))
+        self.fan_out(batches)
+        return sum(len(b) for b in batches)
+
+    """
+    bulk updates
+    """
+    def fan_out(self, batches:list) -> list:
+        """
+        Apply one batch of (method, args, kwargs) per instrument, in order within a batch.
+        Batches of different instruments run in parallel (see `parallel`).
+
+        Returns
+            one list of results per instrument
+        """
+        run = lambda i: [getattr(self.instruments[i], m)(*a, **kw) for m, a, kw in batches[i]]
+        busy = [i for i, batch in enumerate(batches) if batch]
+        results = [[] for _ in batches]
+        if not self.parallel or len(busy) < 2:
+            for i in busy:
+                results[i] = run(i)
+            return results
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(len(self.instruments), thread_name_prefix='MRPCluster')
+        futures = {i: self._executor.submit(run, i) for i in busy}
+        for i, future in futures.items():
+            results[i] = future.result()
+        return results
+
+    def broadcast(self, method:str, *args, **kwargs) -> list:
+        """Call an MRP method on every instrument; returns the results by instrument."""
+        return [r[0] for r in self.fan_out([[(method, args, kwargs)] for _ in self.instruments])]
+
+    def set_quality(self, quality:str, value, relative:bool=False, channel:int=None) -> list:
+        return self.broadcast('set_quality', quality, value, relative, channel)
+
+    def set_qualities(self, qualities:dict, relative:bool=False, channel:int=None) -> list:
+        return self.broadcast('set_qualities', qualities, relative, channel)
+
+    def pedal_damper(self, value:float) -> list:
+        return self.broadcast('pedal_damper', value)
+
+    def pedal_sostenuto(self, value:float) -> list:
+        return self.broadcast('pedal_sostenuto', value)
+
+    def ui_volume(self, value:float) -> list:
+        return self.broadcast('ui_volume', value)
+
+    def all_notes_off(self) -> list:
+        self.routes.clear()
+        return self.broadcast('all_notes_off')
+
+    """
+    state
+    """
+    def get_notes_on(self) -> list:
+        return sorted(n for mrp in self.instruments for n in mrp.voices)
+
+    def voices(self) -> dict:
+        """Active voices by instrument name."""
+        return {name: list(mrp.voices) for name, mrp in zip(self.names, self.instruments)}
+
+    def polyphony(self) -> int:
+        """Total voices of the cluster."""
+        return sum(mrp.settings['voices']['max'] for mrp in self.instruments)
+
+    def monitor(self):
+        """Run each instrument's heat monitor (see `MRP.monitor`)."""
+        for mrp in self.instruments:
+            mrp.monitor()
+
+    def stats(self) -> dict:
+        return {
+            'policy': self.policy,
+            'voices': sum(len(mrp.voices) for mrp in self.instruments),
+            'polyphony': self.polyphony(),
+            'instruments': {name: mrp.stats() for name, mrp in zip(self.names, self.instruments)},
+        }
+
+    def cleanup(self):
+        for mrp in self.instruments:
+            mrp.cleanup()
+        self.routes.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,219 @@
+'''
+Thread-safe command queue front end for `MRP`.
+
+`MRP` mutates its notes, voices and recording state without locking, so calling it
+from several threads (MIDI input, model inference, OSC control) can desync them.
+`MRPCommandQueue` makes one dispatcher thread the only caller of the `MRP`: producers
+append commands to a deque, which is thread-safe without locks, and never block. Every
+`interval` seconds the dispatcher drains the deque and applies the commands in order.
+
+Quality updates to the same note and quality within a dispatch are coalesced to the
+last value (relative updates are summed), at the position of the first. Note on, note
+off and other commands for a note are barriers: updates before and after them are never
+merged, so every update still reaches the note it was meant for.
+
+Example
+    queue = MRPCommandQueue(mrp).start()
+    # from any thread
+    queue.note_on(60)
+    queue.set_note_quality(60, 'brightness', 0.5)
+    voices = queue.submit('voices_update').result()
+    queue.flush() # wait until this thread's commands are applied
+    queue.stop()
+'''
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+class MRPCommandQueue:
+    """
+    Multi-producer, single-consumer command queue for an `MRP` instance.
+
+    Args
+        mrp (MRP): the instance; only the dispatcher thread should call it once started
+        interval (float): seconds between dispatches
+        coalesce (bool): merge quality updates to the same note and quality in a dispatch
+
+    Attributes
+        enqueued (int): commands enqueued
+        dispatched (int): MRP calls made
+        coalesced (int): quality updates merged into another
+        dispatches (int): dispatches that applied at least one command
+        max_batch (int): most commands drained in one dispatch
+        errors (int): commands that raised, see `last_error`
+    """
+    def __init__(self, mrp, interval:float=0.002, coalesce:bool=True) -> None:
+        self.mrp = mrp
+        self.interval = interval
+        self.coalesce = coalesce
+        self._pending = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self.enqueued = self.dispatched = self.coalesced = 0
+        self.dispatches = self.max_batch = self.errors = 0
+        self.last_error = None
+
+    def start(self) -> 'MRPCommandQueue':
+        """Start the dispatcher thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush:bool=True):
+        """Stop the dispatcher thread, by default after applying the queued commands."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.dispatch()
+
+    def __enter__(self) -> 'MRPCommandQueue':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    """
+    producers
+    """
+    def put(self, method:str, *args, **kwargs):
+        """Enqueue a call of an MRP method, without waiting for it."""
+        self._pending.append((method, args, kwargs, None))
+
+    def submit(self, method:str, *args, **kwargs) -> Future:
+        """Enqueue a call of an MRP method, returning a Future of its result."""
+        future = Future()
+        self._pending.append((method, args, kwargs, future))
+        return future
+
+    def note_on(self, note:int, velocity:int=1, channel:int=None):
+        self.put('note_on', note, velocity, channel)
+
+    def note_off(self, note:int, velocity:int=0, channel:int=None):
+        self.put('note_off', note, velocity, channel)
+
+    def set_note_quality(self, note:int, quality:str, value, relative:bool=False, channel:int=None):
+        self.put('set_note_quality', note, quality, value, relative, channel)
+
+    def set_note_qualities(self, note:int, qualities:dict, relative:bool=False, channel:int=None):
+        """Enqueue one quality update per quality (each is sent, and coalesced, separately)."""
+        for quality, value in qualities.items():
+            self.set_note_quality(note, quality, value, relative, channel)
+
+    def pedal_damper(self, value:float):
+        self.put('pedal_damper', value)
+
+    def pedal_sostenuto(self, value:float):
+        self.put('pedal_sostenuto', value)
+
+    def all_notes_off(self):
+        self.put('all_notes_off')
+
+    def flush(self, timeout:float=None) -> bool:
+        """
+        Wait until the commands this thread enqueued so far have been applied.
+        Returns False on timeout.
+        """
+        future = Future()
+        self._pending.append((None, (), {}, future))
+        if self._thread is None:
+            self.dispatch()
+        try:
+            future.result(timeout)
+        except FutureTimeoutError:
+            return False
+        return True
+
+    """
+    dispatcher
+    """
+    def _run(self):
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            self.dispatch()
+            next_time += self.interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.perf_counter()
+
+    def _drain(self) -> list:
+        commands = []
+        pop = self._pending.popleft
+        try:
+            while True:
+                commands.append(pop())
+        except IndexError:
+            return commands
+
+    def _coalesce(self, commands:list) -> list:
+        merged = []
+        slots = {} # (note, quality, channel) -> index in merged of the update to merge into
+        for command in commands:
+            method, args, kwargs, future = command
+            if method == 'set_note_quality' and future is None and not kwargs and len(args) == 5:
+                note, quality, value, relative, channel = args
+                key = (note, quality, channel)
+                i = slots.get(key)
+                scalar = isinstance(value, (int, float))
+                if i is not None:
+                    old, old_relative = merged[i][1][2:4]
+                    if not relative:
+                        merged[i] = (method, args, kwargs, None)
+                        self.coalesced += 1
+                        continue
+                    if scalar and isinstance(old, (int, float)):
+                        merged[i] = (method, (note, quality, old + value, old_relative, channel), kwargs, None)
+                        self.coalesced += 1
+                        continue
+                slots[key] = len(merged)
+            elif method in ('note_on', 'note_off', 'set_note_quality') and args:
+                for key in [k for k in slots if k[0] == args[0]]:
+                    del slots[key]
+            else:
+                slots.clear()
+            merged.append(command)
+        return merged
+
+    def dispatch(self) -> int:
+        """
+        Drain the queue and apply its commands; called by the dispatcher thread.
+        Returns the number of MRP calls made.
+        """
+        commands = self._drain()
+        if not commands:
+            return 0
+        self.enqueued += sum(method is not None for method, *_ in commands)
+        self.max_batch = max(self.max_batch, len(commands))
+        if self.coalesce:
+            commands = self._coalesce(commands)
+        calls = 0
+        for method, args, kwargs, future in commands:
+            if method is None: # flush marker
+                future.set_result(None)
+                continue
+            calls += 1
+            try:
+                result = getattr(self.mrp, method)(*args, **kwargs)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                if future is not None:
+                    future.set_exception(e)
+            else:
+                if future is not None:
+                    future.set_result(result)
+        self.dispatched += calls
+        self.dispatches += 1
+        return calls
+
+    def stats(self) -> dict:
+        return {'enqueued': self.enqueued, 'dispatched': self.dispatched, 'coalesced': self.coalesced,
+                'dispatches': self.dispatches, 'max_batch': self.max_batch, 'errors': self.errors,
+                'pending': len(self._pending)}
@@ -0,0 +1,210 @@
+'''
+Compaction of MRP recordings.
+
+Long sessions are dominated by redundant quality messages. `compact_batch` removes
+- no-op updates: a quality, pedal or UI value equal to the last one sent for it
+- dead-note updates: qualities sent to a note that is off, unless they are the last
+  values set before the note is turned on again
+- optionally, quality updates faster than a control `rate`, as long as the value
+  stays within `tolerance` of the last one kept
+
+Note messages are never removed, so the notes that are on are the same at every point
+of the recording, and the qualities of sounding notes are the same (or within
+`tolerance` when downsampling). `verify_compaction` checks this by folding both
+recordings through `MRPState`. Harmonics vectors can additionally be delta-encoded
+per note when saving (see `recording.save_recording`).
+
+Example
+    batch, report = compact_batch(read_log('installation.log'), rate=50, tolerance=0.01)
+    report = compact_log('installation.log', 'installation.npz', rate=50)
+'''
+
+import os
+import numpy as np
+
+from .recording import LogBatch, load_recording, save_recording, write_log
+from .state import MRPState
+
+def _next_in(events:np.ndarray, index:np.ndarray, n:int) -> np.ndarray:
+    """First element of sorted events after each index, n if there is none."""
+    return np.append(events, n)[np.searchsorted(events, index, side='right')]
+
+def _equal_rows(a:np.ndarray, b:np.ndarray) -> np.ndarray:
+    return ((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=1)
+
+def compact_batch(batch:LogBatch, rate:float=None, tolerance:float=0.01, verify:bool=True) -> tuple[LogBatch, dict]:
+    """
+    Remove redundant messages from a time-ordered recording.
+
+    Args
+        batch (LogBatch): the recording
+        rate (float): maximum rate (Hz) of updates to each note's scalar qualities, None to keep all changes
+        tolerance (float): largest deviation of a downsampled quality from the original
+        verify (bool): check the result with `verify_compaction`, raising RuntimeError if it differs
+
+    Returns
+        LogBatch: the compacted recording
+        dict: message counts: 'messages', 'kept', and removed as 'noop', 'dead' and 'downsampled'
+    """
+    n = len(batch)
+    path = np.asarray(batch['path']).astype(np.int64)
+    status = np.asarray(batch['channel']).astype(np.int64)
+    note = np.asarray(batch['note']).astype(np.int64)
+    value = np.asarray(batch['value'])
+    time = np.asarray(batch['time'])
+    vector = np.asarray(batch['vector'])
+
+    is_midi = path == batch.path_id('/mrp/midi')
+    note_on = is_midi & (status & 0xF0 == 0x90) & (value > 0)
+    note_off = is_midi & ~note_on & np.isin(status & 0xF0, (0x80, 0x90))
+    resets = np.flatnonzero(path == batch.path_id('/mrp/allnotesoff'))
+    quality_ids = [i for i, p in enumerate(batch.paths) if p.startswith('/mrp/quality/')]
+    is_quality = np.isin(path, quality_ids) & (note >= 0)
+    setting_ids = [i for i, p in enumerate(batch.paths) if p.startswith(('/mrp/pedal/', '/ui/volume'))]
+    is_setting = np.isin(path, setting_ids) & ~np.isnan(value)
+
+    # quality records grouped by (note, path), in time order within each group
+    q = np.flatnonzero(is_quality)
+    q = q[np.lexsort((q, path[q], note[q]))]
+    group = note[q] * len(batch.paths) + path[q]
+    same_next = np.append(group[1:] == group[:-1], False)
+    next_same = np.where(same_next, np.append(q[1:], n), n)
+
+    # whether each quality record's note is sounding, and when it next turns on or is reset
+    span = n + 1
+    switches = np.flatnonzero(note_on | note_off)
+    switch_keys = np.sort(note[switches] * span + switches)
+    k = np.searchsorted(switch_keys, note[q] * span + q) - 1
+    last_switch = np.where(k >= 0, switch_keys[np.maximum(k, 0)], -1)
+    last_switch = np.where(last_switch // span == note[q], last_switch % span, -1)
+    last_reset = np.append(-1, resets)[np.searchsorted(resets, q)]
+    sounding = (last_switch > last_reset) & note_on[np.maximum(last_switch, 0)]
+    on_keys = np.flatnonzero(note_on)
+    on_keys = np.sort(note[on_keys] * span + on_keys)
+    next_on = _next_in(on_keys, note[q] * span + q, n * span)
+    next_on = np.where(next_on // span == note[q], next_on % span, n)
+    next_reset = _next_in(resets, q, n)
+    dead = ~sounding & ((next_on == n) | (np.minimum(next_same, next_reset) < next_on))
+
+    # no-op: equal to the previous kept update of the group, with no reset in between
+    live = q[~dead]
+    live_group = group[~dead]
+    prev, cur = live[:-1], live[1:]
+    same_group = live_group[1:] == live_group[:-1]
+    no_reset = np.searchsorted(resets, prev) == np.searchsorted(resets, cur)
+    has_vector = vector[cur] >= 0
+    equal = np.where(has_vector,
+        _equal_rows(batch.vectors[np.maximum(vector[cur], 0)], batch.vectors[np.maximum(vector[prev], 0)]),
+        value[cur] == value[prev])
+    noop = np.zeros(n, dtype=bool)
+    noop[cur[same_group & no_reset & equal]] = True
+    s = np.flatnonzero(is_setting)
+    s = s[np.lexsort((s, path[s]))]
+    noop[s[1:][(path[s][1:] == path[s][:-1]) & (value[s][1:] == value[s][:-1])]] = True
+
+    keep = np.ones(n, dtype=bool)
+    keep[q[dead]] = False
+    keep &= ~noop
+    removed_dead = int(dead.sum())
+    removed_noop = int(noop.sum())
+
+    # downsampling of scalar qualities of sounding notes; the first update of a group and after
+    # a reset, and the last before a note off, a reset or the end are always kept
+    removed_down = 0
+    if rate:
+        offs = np.flatnonzero(note_off)
+        off_keys = np.sort(note[offs] * span + offs)
+        select = keep[q] & (vector[q] < 0)
+        live, live_group = q[select], group[select]
+        next_off = _next_in(off_keys, note[live] * span + live, n * span)
+        next_off = np.where(next_off // span == note[live], next_off % span, n)
+        boundary = np.minimum(next_off, _next_in(resets, live, n))
+        first = np.ones(len(live), dtype=bool)
+        first[1:] = (live_group[1:] != live_group[:-1]) | (np.searchsorted(resets, live[1:]) != np.searchsorted(resets, live[:-1]))
+        last = np.append(first[1:], True) | (np.append(live[1:], n) > boundary)
+        force = first | last | ~sounding[select]
+        period = 1.0 / rate
+        kept_time, kept_value = 0.0, 0.0
+        for i, t, v, forced in zip(live.tolist(), time[live].tolist(), value[live].tolist(), force.tolist()):
+            if forced or abs(v - kept_value) > tolerance or t - kept_time >= period:
+                kept_time, kept_value = t, v
+            else:
+                keep[i] = False
+                removed_down += 1
+
+    result = _select(batch, keep)
+    if verify and not verify_compaction(batch, keep, tolerance if rate else 0.0):
+        raise RuntimeError("compact_batch(): compacted recording does not reproduce the note state")
+    report = {'messages': n, 'kept': int(keep.sum()), 'noop': removed_noop, 'dead': removed_dead, 'downsampled': removed_down}
+    return result, report
+
+def _select(batch:LogBatch, keep:np.ndarray) -> LogBatch:
+    """Select records, dropping the vectors no longer referenced."""
+    result = batch.select(keep)
+    rows = result['vector']
+    used = rows >= 0
+    columns = dict(result.columns)
+    columns['vector'] = np.where(used, np.cumsum(used) - 1, -1).astype(rows.dtype)
+    return LogBatch(columns, batch.vectors[rows[used]], batch.paths)
+
+def _note_state(state:MRPState) -> tuple:
+    on = state.on
+    return on, state.order, state.velocity[on], state.qualities[on], state.n_harmonics[on], state.harmonics[on]
+
+def verify_compaction(original:LogBatch, keep:np.ndarray, tolerance:float=0.0) -> bool:
+    """
+    Check that replaying the kept records of a recording gives the same note state as the
+    original after every note message and at the end: the same notes on in the same order
+    with the same velocities and harmonics, and qualities within tolerance.
+
+    Args
+        original (LogBatch): the recording
+        keep (np.ndarray): mask of the records kept by `compact_batch`
+        tolerance (float): largest allowed difference of a quality
+    """
+    a, b = MRPState(), MRPState()
+    midi = original.path_id('/mrp/midi')
+    paths = np.asarray(original['path'])
+    check = np.append(paths[1:] == midi, True) | (paths == midi)
+    for (_, path, args), kept, checked in zip(original.messages(), keep.tolist(), check.tolist()):
+        a.apply(path, *args)
+        if kept:
+            b.apply(path, *args)
+        if checked:
+            on_a, order_a, vel_a, q_a, nh_a, h_a = _note_state(a)
+            on_b, order_b, vel_b, q_b, nh_b, h_b = _note_state(b)
+            if not (np.array_equal(on_a, on_b) and order_a == order_b and np.array_equal(vel_a, vel_b)
+                    and np.array_equal(nh_a, nh_b) and np.array_equal(h_a, h_b)
+                    and np.all(np.abs(q_a - q_b) <= tolerance + 1e-9)):
+                return False
+    return True
+
+def compact_log(file:str, out_file:str=None, rate:float=None, tolerance:float=0.01, delta:bool=True, verify:bool=True) -> dict:
+    """
+    Compact a recording file, reporting the message and size reduction.
+
+    Args
+        file (str): recording to compact (see `recording.load_recording`)
+        out_file (str): output path: a .log is written as text, anything else with
+            `recording.save_recording`; defaults to `<name>.compact.log`
+        rate, tolerance, verify: see `compact_batch`
+        delta (bool): delta-encode harmonics vectors of binary outputs
+
+    Returns
+        dict: the report of `compact_batch`, with 'bytes' and 'out_bytes' file sizes
+    """
+    if out_file is None:
+        out_file = os.path.splitext(file.rstrip('/'))[0] + '.compact.log'
+    batch, report = compact_batch(load_recording(file), rate, tolerance, verify)
+    if out_file.endswith('.log') or out_file.endswith(('.log.gz', '.log.xz', '.log.bz2')):
+        write_log(batch, out_file)
+    else:
+        save_recording(batch, out_file, delta=delta)
+    report['bytes'] = _size(file)
+    report['out_bytes'] = _size(out_file)
+    return report
+
+def _size(file:str) -> int:
+    if os.path.isdir(file):
+        return sum(os.path.getsize(os.path.join(file, f)) for f in os.listdir(file))
+    return os.path.getsize(file)
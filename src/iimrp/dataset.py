@@ -0,0 +1,262 @@
+'''
+Piano-roll datasets of MRP recordings, for training generative models.
+
+`build_dataset` samples the note and quality state of recordings at a fixed frame rate
+into float tensors of shape (frames, 88 keys, features), with the features
+    on, brightness, intensity, pitch, pitch_vibrato, harmonic, harmonic_1 ... harmonic_H
+(the qualities and raw harmonics of `state.py`). Each frame holds the state after all
+messages up to its time. Tensors are written in chunks as `.npy` shards, listed in an
+`index.json` with the size and modification time of each recording, so rebuilding only
+processes recordings that are new or have changed.
+
+`PianoRollDataset` memory-maps the shards and returns windows as views of the maps,
+without copying.
+
+Example
+    build_dataset(sorted(glob('logs/*.log')), 'dataset', rate=50)
+    data = PianoRollDataset('dataset', window=256)
+    x = data[0] # (256, 88, features) view
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from .recording import load_recording, VECTOR_PATH
+from .state import STATE_QUALITIES
+
+PIANO_ROLL_KEYS = 88
+PIANO_ROLL_START = 21 # MIDI number of the lowest key
+INDEX_FILE = 'index.json'
+
+def piano_roll_features(harmonics:int=8) -> list[str]:
+    """Names of the features of a piano roll with the given number of raw harmonics."""
+    return ['on', *STATE_QUALITIES] + [f'harmonic_{h + 1}' for h in range(harmonics)]
+
+def _updates(batch, rate:float, harmonics:int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Expand a recording into (frame, column, value) state updates, in the order they apply.
+    Columns index the flattened (key, feature) axes of a frame.
+    """
+    F = 1 + len(STATE_QUALITIES) + harmonics
+    C = PIANO_ROLL_KEYS * F
+    path = np.asarray(batch['path']).astype(np.int64)
+    status = np.asarray(batch['channel']).astype(np.int64)
+    key = np.asarray(batch['note']).astype(np.int64) - PIANO_ROLL_START
+    value = np.asarray(batch['value'])
+    vector = np.asarray(batch['vector'])
+    frame = np.ceil(np.asarray(batch['time']) * rate - 1e-9).astype(np.int64)
+    in_range = (key >= 0) & (key < PIANO_ROLL_KEYS)
+    # feature of each path, -1 for paths that are not a scalar quality
+    feature = np.full(len(batch.paths) + 1, -1)
+    for i, p in enumerate(batch.paths):
+        q = p[len('/mrp/quality/'):].replace('/', '_') if p.startswith('/mrp/quality/') else None
+        if q in STATE_QUALITIES:
+            feature[i] = 1 + STATE_QUALITIES.index(q)
+
+    frames, columns, values, orders = [], [], [], []
+    def add(mask, column, val):
+        frames.append(frame[mask]); orders.append(np.flatnonzero(mask))
+        columns.append(column); values.append(val)
+    midi = (path == batch.path_id('/mrp/midi')) & in_range
+    on = midi & (status & 0xF0 == 0x90) & (value > 0)
+    switch = on | (midi & np.isin(status & 0xF0, (0x80, 0x90)))
+    add(switch, key[switch] * F, on[switch].astype(float))
+    quality = (feature[path] >= 0) & in_range
+    add(quality, key[quality] * F + feature[path[quality]], value[quality])
+    if harmonics:
+        raw = (path == batch.path_id(VECTOR_PATH)) & in_range & (vector >= 0)
+        base = key[raw] * F + 1 + len(STATE_QUALITIES)
+        vals = np.zeros((raw.sum(), harmonics))
+        v = batch.vectors[vector[raw], :harmonics]
+        vals[:, :v.shape[1]] = np.nan_to_num(v)
+        index = np.flatnonzero(raw)
+        frames.append(np.repeat(frame[raw], harmonics)); orders.append(np.repeat(index, harmonics))
+        columns.append((base[:, np.newaxis] + np.arange(harmonics)).ravel()); values.append(vals.ravel())
+    resets = np.flatnonzero(path == batch.path_id('/mrp/allnotesoff'))
+    if len(resets):
+        # /mrp/allnotesoff turns every note off and clears its qualities
+        frames.append(np.repeat(frame[resets], C)); orders.append(np.repeat(resets, C))
+        columns.append(np.tile(np.arange(C), len(resets))); values.append(np.zeros(len(resets) * C))
+    frames, columns, values, orders = (np.concatenate(a) for a in (frames, columns, values, orders))
+    order = np.lexsort((orders, frames))
+    return frames[order], columns[order], values[order]
+
+def n_frames(batch, rate:float) -> int:
+    """Number of frames of a recording: one per 1/rate seconds, up to its last message."""
+    return int(np.floor(batch['time'][-1] * rate)) + 1 if len(batch) else 0
+
+def piano_roll_chunks(recording, rate:float=50.0, harmonics:int=8, chunk_frames:int=4096, mask_off:bool=True):
+    """
+    Yield the piano roll of a recording in chunks of at most chunk_frames frames.
+
+    Args
+        recording (str | LogBatch): recording (see `recording.load_recording`)
+        rate (float): frames per second
+        harmonics (int): number of raw harmonics features
+        chunk_frames (int): frames per chunk
+        mask_off (bool): zero the qualities and harmonics of keys that are off
+
+    Yields
+        np.ndarray: (frames, 88, features) float32
+    """
+    batch = load_recording(recording) if isinstance(recording, str) else recording
+    F = 1 + len(STATE_QUALITIES) + harmonics
+    C = PIANO_ROLL_KEYS * F
+    total = n_frames(batch, rate)
+    frames, columns, values = _updates(batch, rate, harmonics)
+    values = np.append(values, 0).astype(np.float32) # index -1: never set
+    carry = np.full(C, -1, dtype=np.int32) # last update of each column before the chunk
+    for f0 in range(0, total, chunk_frames):
+        n = min(chunk_frames, total - f0)
+        lo, hi = np.searchsorted(frames, [f0, f0 + n])
+        cell = (frames[lo:hi] - f0) * C + columns[lo:hi]
+        # the last update of each (frame, column) wins, then update indices (which increase
+        # with time) are carried forward
+        last = len(cell) - 1 - np.unique(cell[::-1], return_index=True)[1]
+        changed = np.full((n, C), -1, dtype=np.int32)
+        changed[0] = carry
+        changed.ravel()[cell[last]] = lo + last
+        np.maximum.accumulate(changed, axis=0, out=changed)
+        carry = changed[-1].copy()
+        chunk = values[changed].reshape(n, PIANO_ROLL_KEYS, F)
+        if mask_off:
+            chunk[..., 1:] *= chunk[..., :1]
+        yield chunk
+
+def _shard_prefix(file:str) -> str:
+    name = os.path.splitext(os.path.basename(file.rstrip('/')))[0]
+    return f"{name}-{hashlib.sha1(os.path.abspath(file).encode()).hexdigest()[:8]}"
+
+def _signature(file:str) -> dict:
+    if os.path.isdir(file):
+        stats = [os.stat(os.path.join(file, f)) for f in sorted(os.listdir(file))]
+        return {'size': sum(s.st_size for s in stats), 'mtime': max(s.st_mtime for s in stats)}
+    s = os.stat(file)
+    return {'size': s.st_size, 'mtime': s.st_mtime}
+
+def build_dataset(files:list, out_dir:str, rate:float=50.0, harmonics:int=8, shard_frames:int=65536,
+                  mask_off:bool=True, prune:bool=True, verbose:bool=False) -> dict:
+    """
+    Convert recordings to piano-roll shards, processing only new or changed recordings.
+
+    Args
+        files (list): recordings (see `recording.load_recording`)
+        out_dir (str): dataset directory
+        rate (float): frames per second
+        harmonics (int): number of raw harmonics features
+        shard_frames (int): frames per shard
+        mask_off (bool): zero the qualities and harmonics of keys that are off
+        prune (bool): remove recordings that are not in files from the dataset
+        verbose (bool): print the recordings processed
+
+    Returns
+        dict: the dataset index
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    config = {'rate': rate, 'harmonics': harmonics, 'shard_frames': shard_frames, 'mask_off': mask_off,
+              'keys': PIANO_ROLL_KEYS, 'start': PIANO_ROLL_START, 'features': piano_roll_features(harmonics), 'dtype': 'float32'}
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    index = {'config': config, 'recordings': {}}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            old = json.load(f)
+        if old['config'] == config:
+            index = old
+    def save_index():
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(index_path + '.tmp', index_path)
+    def remove(entry):
+        for shard in entry['shards']:
+            path = os.path.join(out_dir, shard['file'])
+            if os.path.exists(path): os.remove(path)
+
+    keys = [os.path.abspath(f) for f in files]
+    if prune:
+        for key in [k for k in index['recordings'] if k not in keys]:
+            remove(index['recordings'].pop(key))
+    for file, key in zip(files, keys):
+        signature = _signature(file)
+        entry = index['recordings'].get(key)
+        if entry is not None and entry['signature'] == signature:
+            continue
+        if entry is not None:
+            remove(entry)
+        if verbose:
+            print(f"build_dataset(): processing {file}")
+        batch = load_recording(file)
+        frames = n_frames(batch, rate)
+        prefix, shards, shard, pos = _shard_prefix(file), [], None, 0
+        for chunk in piano_roll_chunks(batch, rate, harmonics, min(4096, shard_frames), mask_off):
+            i = 0
+            while i < len(chunk):
+                if shard is None or pos == len(shard):
+                    if shard is not None: shard.flush()
+                    name = f"{prefix}-{len(shards):04d}.npy"
+                    size = min(shard_frames, frames - len(shards) * shard_frames)
+                    shard = np.lib.format.open_memmap(os.path.join(out_dir, name), mode='w+', dtype=np.float32,
+                        shape=(size, PIANO_ROLL_KEYS, len(config['features'])))
+                    shards.append({'file': name, 'frames': size})
+                    pos = 0
+                n = min(len(chunk) - i, len(shard) - pos)
+                shard[pos:pos + n] = chunk[i:i + n]
+                pos += n
+                i += n
+        if shard is not None:
+            shard.flush()
+            del shard
+        index['recordings'][key] = {'file': file, 'signature': signature, 'frames': frames, 'shards': shards}
+        save_index()
+    save_index()
+    return index
+
+class PianoRollDataset:
+    """
+    Windows of a piano-roll dataset written by `build_dataset`, read from memory-mapped shards.
+
+    Windows do not cross shard boundaries, so every window is a view of a shard (no copy).
+
+    Args
+        path (str): dataset directory
+        window (int): frames per window
+        hop (int): frames between window starts, defaults to window
+    """
+    def __init__(self, path:str, window:int, hop:int=None) -> None:
+        self.path = path
+        self.window = window
+        self.hop = hop or window
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.config = self.index['config']
+        self.features = self.config['features']
+        self.shards = []
+        starts = []
+        for entry in self.index['recordings'].values():
+            for shard in entry['shards']:
+                self.shards.append(np.load(os.path.join(path, shard['file']), mmap_mode='r'))
+                n = max(0, (shard['frames'] - window) // self.hop + 1)
+                starts.append(n)
+        self._offsets = np.concatenate([[0], np.cumsum(starts)]).astype(np.int64)
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def __getitem__(self, i:int) -> np.ndarray:
+        """Return window i as a (window, 88, features) read-only view."""
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"PianoRollDataset: window {i} out of range")
+        s = int(np.searchsorted(self._offsets, i, side='right')) - 1
+        start = (i - int(self._offsets[s])) * self.hop
+        return self.shards[s][start:start + self.window]
+
+    def sample(self, batch_size:int, rng:np.random.Generator=None) -> list[np.ndarray]:
+        """Return batch_size random windows, as views."""
+        rng = rng or np.random.default_rng()
+        return [self[int(i)] for i in rng.integers(len(self), size=batch_size)]
+
+    def feature(self, name:str) -> int:
+        """Index of a feature in the last axis."""
+        return self.features.index(name)
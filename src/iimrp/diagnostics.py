@@ -0,0 +1,302 @@
+'''
+Amplifier-board diagnostics for the MRP.
+
+Each key under test is swept through a note on, its harmonics one at a time
+(`harmonics_raw` with a single partial, as `create_single_harmonic_gain_array`) and a
+note off. Rather than stepping through the boards of `MRP.amp_notes` one key at a time,
+`MRPDiagnostics` tests one key per board (or `keys_per_board`) at once, every board in
+lock step: each `dwell` seconds every key under test advances one step, and the step's
+messages for all of them are sent in one bundle (`MRP.bundle`). Within limits:
+
+- voices: keys sounding together never exceed the voices the MRP has free
+- heat: the heat of each key is simulated over its sweep with `MRPNoteHeatMonitor`, and
+  a key over `heat_limit` is turned off at once and fails; the keys of a board play in
+  an interleaved order, so neighbouring keys do not sound back to back
+
+A key passes when its note on is accepted, every message is sent, it stays under the
+heat limit and, if a `probe` is given (e.g. the level of a pickup near the strings),
+the probe accepts every harmonic step. With the defaults (8 harmonics, 0.25 s steps) a
+key takes 2.25 s, so all 6 boards of 18 keys take about 40 s instead of 4 minutes.
+
+Sent messages and one `/diagnostics/key` line per key (board, note, 1 pass or 0 fail)
+are recorded to `log` in the recording format (see `recording.py`).
+
+Example
+    diagnostics = MRPDiagnostics(mrp, boards=[0, 1])
+    report = diagnostics.run(log='boards-0-1.log')
+    print(diagnostics.summary(), diagnostics.failed())
+
+From a shell, `python -m iimrp.diagnostics --boards 0 1 --log boards-0-1.log`.
+'''
+
+import time
+import threading
+import numpy as np
+
+from .harmonics import MAX_HARMONICS, create_single_harmonic_gain_array
+from .thermal import MRPNoteHeatMonitor, OVERHEATING_RISK
+
+DIAGNOSTICS_PATH = '/diagnostics/key'
+DIAGNOSTICS_QUALITIES = ('intensity', 'harmonics_raw') # set by the sweep, restored after it
+
+class MRPDiagnostics:
+    """
+    Sweeps the keys of amplifier boards, the boards in parallel.
+
+    Args
+        mrp (MRP): instance whose `amp_notes` lists the keys of each board
+        boards (list): board indices to test, all by default
+        keys (list): MIDI notes to test on those boards, all by default
+        harmonics (int): harmonics swept per key, from the fundamental
+        dwell (float): seconds per step
+        intensity (float): intensity of the keys under test
+        keys_per_board (int): keys of a board sounding at once
+        heat_limit (float): simulated heat score failing a key (see `thermal.py`)
+        probe (callable): probe(note, harmonic) -> bool, called at the end of each
+                          harmonic step while the key sounds, False failing the key
+
+    Attributes
+        report (dict): note -> result dict ('board', 'note', 'name', 'passed', 'reason',
+                       'failed_harmonics', 'heat'), in the order the keys finished
+        seconds (float): duration of the last run
+    """
+    def __init__(self, mrp, boards:list=None, keys:list=None, harmonics:int=MAX_HARMONICS,
+                 dwell:float=0.25, intensity:float=1.0, keys_per_board:int=1,
+                 heat_limit:float=OVERHEATING_RISK, probe=None) -> None:
+        if harmonics < 1 or keys_per_board < 1:
+            raise ValueError('harmonics and keys_per_board must be at least 1')
+        self.mrp = mrp
+        self.boards = list(range(len(mrp.amp_notes))) if boards is None else list(boards)
+        for board in self.boards:
+            if not 0 <= board < len(mrp.amp_notes):
+                raise ValueError(f'no board {board}, the MRP has {len(mrp.amp_notes)}')
+        self.names = {note: name for board in self.boards for name, note in mrp.amp_notes[board].items()}
+        if keys is not None:
+            missing = sorted(set(keys) - set(self.names))
+            if missing:
+                raise ValueError(f'keys {missing} are not on boards {self.boards}')
+        self.keys = keys
+        self.harmonics = harmonics
+        self.dwell = dwell
+        self.intensity = intensity
+        self.keys_per_board = keys_per_board
+        self.heat_limit = heat_limit
+        self.probe = probe
+        self.report = {}
+        self.seconds = 0.0
+        self._stop = threading.Event()
+
+    """
+    planning
+    """
+    def lanes(self) -> list:
+        """
+        Keys as (board, note) lists, each tested in turn; the lanes run in parallel.
+
+        A board's keys are split into `keys_per_board` contiguous ranges, so keys sounding
+        together are far apart, each range played in even then odd positions.
+        """
+        lanes = []
+        for board in self.boards:
+            notes = [n for n in self.mrp.amp_notes[board].values() if self.keys is None or n in self.keys]
+            k = min(self.keys_per_board, len(notes))
+            for j in range(k):
+                part = notes[j * len(notes) // k:(j + 1) * len(notes) // k]
+                lanes.append([(board, n) for n in part[0::2] + part[1::2]])
+        return lanes
+
+    def capacity(self) -> int:
+        """Keys that can sound at once: the voices the MRP has free."""
+        return self.mrp.settings['voices']['max'] - len(self.mrp.voices)
+
+    def duration(self) -> float:
+        """
+        Seconds a run takes, from the lanes and the capacity; each key takes one step
+        per harmonic and one for its note off.
+        """
+        lengths = sorted((len(lane) for lane in self.lanes()), reverse=True)
+        capacity = max(self.capacity(), 1)
+        # lanes over capacity start as others end: pack them greedily, longest first
+        ends = [0] * min(capacity, len(lengths))
+        for n in lengths:
+            i = int(np.argmin(ends))
+            ends[i] += n
+        return max(ends, default=0) * (self.harmonics + 1) * self.dwell
+
+    """
+    running
+    """
+    def run(self, log:str=None) -> dict:
+        """
+        Test every key, blocking until done (or `stop`).
+
+        Args
+            log (str): record the run to this file (see `MRP.record_start`)
+
+        Returns
+            dict: the report, note -> result
+        """
+        if self.capacity() < 1:
+            raise RuntimeError('the MRP has no free voices to test with')
+        self.report = {}
+        self._stop.clear()
+        if log is not None:
+            self.mrp.record_start(log, buffered=True)
+        t0 = time.perf_counter()
+        try:
+            self._sweep()
+        finally:
+            self.seconds = time.perf_counter() - t0
+            if log is not None:
+                self.mrp.record_stop()
+        return self.report
+
+    def stop(self):
+        """End a run from another thread at the next step; sounding keys are turned off and fail."""
+        self._stop.set()
+
+    def _sweep(self):
+        waiting = self.lanes()
+        capacity = self.capacity()
+        active = []
+        next_time = time.perf_counter()
+        while waiting or active:
+            while waiting and len(active) < capacity:
+                active.append({'keys': waiting.pop(0), 'key': None})
+            stopping = self._stop.is_set()
+            now = time.perf_counter()
+            try:
+                with self.mrp.bundle():
+                    for lane in active:
+                        self._advance(lane, now, stopping)
+            except OSError as e:
+                for lane in active:
+                    if lane['key'] is not None:
+                        lane['key']['reasons'].append(f'error: {e}')
+            if stopping:
+                break
+            active = [lane for lane in active if lane['key'] is not None or lane['keys']]
+            next_time += self.dwell
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.perf_counter()
+
+    def _advance(self, lane:dict, now:float, stopping:bool):
+        key = lane['key']
+        if key is None:
+            while lane['keys'] and lane['key'] is None and not stopping:
+                self._start(lane, *lane['keys'].pop(0), now)
+            return
+        note = key['note']
+        gains = create_single_harmonic_gain_array(key['harmonic'], self.intensity, self.harmonics)
+        key['monitor'].update_heat_score_on(gains, current_time=now)
+        if self.probe is not None and not self.probe(note, key['harmonic']):
+            key['failed_harmonics'].append(key['harmonic'])
+        if key['monitor'].heat_score > self.heat_limit:
+            key['reasons'].append('heat')
+        elif key['harmonic'] < self.harmonics:
+            if stopping:
+                key['reasons'].append('stopped')
+            else:
+                key['harmonic'] += 1
+                self.mrp.set_note_quality(note, 'harmonics_raw',
+                    create_single_harmonic_gain_array(key['harmonic'], 1.0, self.harmonics).tolist())
+                return
+        if key['restore']:
+            self.mrp.set_note_qualities(note, key['restore'])
+        self.mrp.note_off(note)
+        self._finish(lane)
+
+    def _start(self, lane:dict, board:int, note:int, now:float):
+        key = {'board': board, 'note': note, 'harmonic': 1, 'reasons': [], 'failed_harmonics': []}
+        lane['key'] = key
+        if self.mrp.note_on(note) is None:
+            key['reasons'].append('rejected')
+            self._finish(lane)
+            return
+        qualities = self.mrp.notes[self.mrp.note_index(note)]['qualities']
+        key['restore'] = {q: qualities[q] for q in DIAGNOSTICS_QUALITIES if len(np.atleast_1d(qualities[q]))}
+        key['monitor'] = MRPNoteHeatMonitor(note)
+        key['monitor'].last_played = now
+        self.mrp.set_note_qualities(note, {
+            'intensity': self.intensity,
+            'harmonics_raw': create_single_harmonic_gain_array(1, 1.0, self.harmonics).tolist()})
+
+    def _finish(self, lane:dict):
+        key, lane['key'] = lane['key'], None
+        note = key['note']
+        if key['failed_harmonics']:
+            key['reasons'].append('probe')
+        passed = not key['reasons']
+        self.report[note] = {
+            'board': key['board'], 'note': note, 'name': self.names[note], 'passed': passed,
+            'reason': 'ok' if passed else key['reasons'][0],
+            'failed_harmonics': key['failed_harmonics'],
+            'heat': float(key['monitor'].heat_score) if 'monitor' in key else 0.0}
+        if self.mrp.recording:
+            self.mrp.log(DIAGNOSTICS_PATH, key['board'], note, int(passed))
+
+    """
+    results
+    """
+    def failed(self) -> list:
+        """Notes of the keys that failed."""
+        return sorted(note for note, result in self.report.items() if not result['passed'])
+
+    def summary(self) -> dict:
+        """
+        Counts of tested, passed and failed keys overall and per board.
+
+        Returns
+            dict: 'keys', 'passed', 'failed', 'seconds' and 'boards', board -> (passed, tested)
+        """
+        boards = {board: [0, 0] for board in self.boards}
+        for result in self.report.values():
+            boards[result['board']][0] += result['passed']
+            boards[result['board']][1] += 1
+        passed = sum(p for p, _ in boards.values())
+        return {'keys': len(self.report), 'passed': passed, 'failed': len(self.report) - passed,
+                'seconds': self.seconds, 'boards': {b: tuple(c) for b, c in boards.items()}}
+
+    def format_report(self) -> str:
+        """The report as text, one line per key in note order."""
+        lines = []
+        for note in sorted(self.report):
+            r = self.report[note]
+            detail = f" (harmonics {r['failed_harmonics']})" if r['failed_harmonics'] else ''
+            lines.append(f"board {r['board']} {r['name']:>4} {note:3d} {'pass' if r['passed'] else 'FAIL'} "
+                         f"{r['reason']}{detail}")
+        return '\n'.join(lines)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Sweep the keys of MRP amplifier boards.')
+    parser.add_argument('--ip', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7770)
+    parser.add_argument('--boards', type=int, nargs='*', default=None, help='board indices, all by default')
+    parser.add_argument('--keys', type=int, nargs='*', default=None, help='MIDI notes, all by default')
+    parser.add_argument('--harmonics', type=int, default=MAX_HARMONICS)
+    parser.add_argument('--dwell', type=float, default=0.25, help='seconds per step')
+    parser.add_argument('--intensity', type=float, default=1.0)
+    parser.add_argument('--keys-per-board', type=int, default=1)
+    parser.add_argument('--log', default=None, help='record the run to this file')
+    args = parser.parse_args()
+    from iipyper import OSC
+    from .iimrp import MRP
+    mrp = MRP(OSC(), settings={'address': {'ip': args.ip, 'port': args.port}})
+    diagnostics = MRPDiagnostics(mrp, args.boards, args.keys, args.harmonics, args.dwell,
+                                 args.intensity, args.keys_per_board)
+    print(f"MRPDiagnostics: {len(diagnostics.boards)} boards, about {diagnostics.duration():.0f} s")
+    try:
+        diagnostics.run(log=args.log)
+    except KeyboardInterrupt:
+        mrp.all_notes_off()
+    print(diagnostics.format_report())
+    s = diagnostics.summary()
+    print(f"MRPDiagnostics: {s['passed']}/{s['keys']} keys passed in {s['seconds']:.1f} s")
+    mrp.cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+'''
+Local stand-in for the MRP software, for testing clients without the piano.
+
+`MRPEmulator` binds a UDP port (7770 by default, as the MRP), decodes OSC messages and
+bundles in a background thread, and folds the MRP paths (`/mrp/midi`, `/mrp/quality/*`,
+`/mrp/pedal/*`, `/mrp/allnotesoff`, `/ui/*`) into its own `MRPState`. Bundles with a
+future time tag are applied when due, as by the MRP scheduler.
+
+Every message is recorded with its arrival time, so `stats` can report throughput, and,
+given the messages the client sent, packet loss, reordering and timing jitter.
+
+Example
+    with MRPEmulator(port=0) as emulator:
+        mrp = MRP(osc, settings={..., 'address': {'ip': '127.0.0.1', 'port': emulator.port}})
+        for note in range(48, 60):
+            mrp.note_on(note)
+        emulator.wait(12)
+        assert emulator.state.notes_on() == mrp.voices
+        print(emulator.stats())
+
+From a shell, `python -m iimrp.emulator --port 7770` listens and prints statistics.
+'''
+
+import time
+import heapq
+import socket
+import threading
+import numpy as np
+
+from pythonosc.osc_bundle import OscBundle
+from pythonosc.osc_message import OscMessage
+from pythonosc.parsing.osc_types import IMMEDIATELY
+
+from .state import MRPState
+from .recording import format_log_line, parse_log_lines, empty_batch
+
+EMULATOR_PREFIXES = ('/mrp/midi', '/mrp/quality/', '/mrp/pedal/', '/mrp/allnotesoff', '/ui/')
+
+def decode_datagram(dgram:bytes, timetag:float=None) -> list:
+    """
+    Decode an OSC datagram into (time tag, path, args) messages, nested bundles flattened.
+    The time tag (seconds, as time.time()) is None for plain messages and immediate bundles.
+    """
+    if OscBundle.dgram_is_bundle(dgram):
+        bundle = OscBundle(dgram)
+        tag = None if bundle.timestamp == IMMEDIATELY else bundle.timestamp
+        messages = []
+        for content in bundle:
+            if isinstance(content, OscBundle):
+                messages += decode_datagram(content.dgram, tag)
+            else:
+                messages.append((tag, content.address, tuple(content.params)))
+        return messages
+    message = OscMessage(dgram)
+    return [(timetag, message.address, tuple(message.params))]
+
+def _key(path:str, args) -> tuple:
+    # OSC floats are 32 bit: compare sent and received arguments at that precision
+    return (path,) + tuple(float(np.float32(a)) if isinstance(a, float) else a for a in args)
+
+class MRPEmulator:
+    """
+    UDP server that emulates the MRP's OSC interface.
+
+    Args
+        ip (str): address to bind
+        port (int): port to bind, 0 for any free port (see `port`)
+        voices_max (int): number of voices of the emulated MRP, for the 'voice_overflow' count
+        schedule (bool): apply bundles with a future time tag when due, otherwise on arrival
+        verbose (bool): print every message
+
+    Attributes
+        state (MRPState): the emulated note, quality, pedal and UI state
+        port (int): the bound port
+        arrivals (list): arrival time (time.time()) of each message
+        timetags (list): time tag of each message, None if it was not in a bundle
+        messages (list): (path, args) of each message, in arrival order
+    """
+    def __init__(self, ip:str='127.0.0.1', port:int=7770, voices_max:int=16, schedule:bool=True, verbose:bool=False) -> None:
+        self.ip = ip
+        self.voices_max = voices_max
+        self.schedule = schedule
+        self.verbose = verbose
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind((ip, port))
+        self.port = self.sock.getsockname()[1]
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.reset()
+
+    def reset(self):
+        """Clear the state, the recorded messages and the counters."""
+        with self._cond:
+            self.state = MRPState()
+            self.arrivals, self.timetags, self.messages = [], [], []
+            self.packets = self.bytes = self.bundles = self.errors = self.unknown = 0
+            self.applied = 0
+            self.peak_voices = self.voice_overflow = 0
+            self._pending = [] # (due time, sequence, path, args) of scheduled messages
+
+    def start(self) -> 'MRPEmulator':
+        """Start receiving in a background thread."""
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop receiving and close the socket."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sock.close()
+
+    def __enter__(self) -> 'MRPEmulator':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while self._running:
+            with self._cond:
+                due = self._pending[0][0] - time.time() if self._pending else 0.05
+            self.sock.settimeout(min(max(due, 1e-4), 0.05))
+            try:
+                dgram = self.sock.recv(65536)
+            except socket.timeout:
+                dgram = None
+            except OSError:
+                break
+            arrival = time.time()
+            with self._cond:
+                if dgram is not None:
+                    self._receive(dgram, arrival)
+                while self._pending and self._pending[0][0] <= time.time():
+                    _, _, path, args = heapq.heappop(self._pending)
+                    self._apply(path, args)
+                self._cond.notify_all()
+
+    def _receive(self, dgram:bytes, arrival:float):
+        self.packets += 1
+        self.bytes += len(dgram)
+        try:
+            decoded = decode_datagram(dgram)
+        except Exception:
+            self.errors += 1
+            return
+        self.bundles += OscBundle.dgram_is_bundle(dgram)
+        for timetag, path, args in decoded:
+            if self.verbose:
+                print(f"MRPEmulator: {arrival:.6f} {path} {' '.join(map(str, args))}")
+            self.arrivals.append(arrival)
+            self.timetags.append(timetag)
+            self.messages.append((path, args))
+            if not path.startswith(EMULATOR_PREFIXES):
+                self.unknown += 1
+            elif self.schedule and timetag is not None and timetag > arrival:
+                heapq.heappush(self._pending, (timetag, len(self.messages), path, args))
+            else:
+                self._apply(path, args)
+
+    def _apply(self, path:str, args:tuple):
+        before = len(self.state.order)
+        try:
+            self.state.apply(path, *args)
+        except (IndexError, ValueError, TypeError):
+            self.errors += 1
+            return
+        self.applied += 1
+        voices = len(self.state.order)
+        self.peak_voices = max(self.peak_voices, voices)
+        if voices > before and voices > self.voices_max:
+            self.voice_overflow += 1
+
+    def wait(self, count:int, timeout:float=1.0) -> bool:
+        """
+        Wait until count messages have been received and applied, returning False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.messages) >= count and not self._pending, timeout)
+
+    def snapshot(self) -> MRPState:
+        """Return a copy of the emulated state."""
+        with self._cond:
+            return self.state.copy()
+
+    def batch(self):
+        """Return the received messages as a LogBatch, timed from the first arrival."""
+        with self._cond:
+            arrivals, messages = list(self.arrivals), list(self.messages)
+        if not messages:
+            return empty_batch()
+        return parse_log_lines([format_log_line(t - arrivals[0], path, args) for t, (path, args) in zip(arrivals, messages)])
+
+    def stats(self, expected:list=None) -> dict:
+        """
+        Throughput, and optionally loss, reordering and jitter, of the received messages.
+
+        Args
+            expected (list): the messages the client sent, in order, as (path, args) or
+                (time, path, args) with the intended send times in seconds (e.g. the
+                messages of a log replayed with `MRPReplay`)
+
+        Returns
+            dict:
+                'packets', 'bytes', 'bundles', 'messages', 'errors' (undecodable packets or
+                arguments), 'unknown' (messages to other paths), 'peak_voices', 'voice_overflow'
+                (note ons beyond voices_max), 'duration' (s, first to last arrival), 'rate'
+                (messages/s), 'interval_mean' and 'interval_std' (s, between arrivals);
+                for bundled messages, 'late' (arrived after their time tag) and
+                'lateness_mean', 'lateness_max' (s);
+                with expected: 'expected', 'lost', 'unexpected' (received but not sent),
+                'reordered' (arrived after a message sent later), 'loss_rate';
+                with expected times: 'latency_mean' (s, relative to the fastest message),
+                'jitter' (s, mean absolute difference of successive transit times, as RFC 3550)
+                and 'jitter_max' (s, largest deviation of a transit time from the mean)
+        """
+        with self._cond:
+            arrivals = np.array(self.arrivals)
+            timetags = list(self.timetags)
+            messages = list(self.messages)
+            stats = {'packets': self.packets, 'bytes': self.bytes, 'bundles': self.bundles,
+                     'messages': len(messages), 'errors': self.errors, 'unknown': self.unknown,
+                     'peak_voices': self.peak_voices, 'voice_overflow': self.voice_overflow}
+        intervals = np.diff(arrivals)
+        stats['duration'] = float(arrivals[-1] - arrivals[0]) if len(arrivals) else 0.0
+        stats['rate'] = len(messages) / stats['duration'] if stats['duration'] > 0 else 0.0
+        stats['interval_mean'] = float(intervals.mean()) if len(intervals) else 0.0
+        stats['interval_std'] = float(intervals.std()) if len(intervals) else 0.0
+        tagged = np.array([t is not None for t in timetags], dtype=bool)
+        lateness = arrivals[tagged] - np.array([t for t in timetags if t is not None], dtype=float)
+        stats['late'] = int((lateness > 0).sum())
+        stats['lateness_mean'] = float(np.maximum(lateness, 0).mean()) if len(lateness) else 0.0
+        stats['lateness_max'] = float(lateness.max(initial=0.0))
+        if expected is not None:
+            stats.update(self._compare(expected, arrivals, messages))
+        return stats
+
+    def _compare(self, expected:list, arrivals:np.ndarray, messages:list) -> dict:
+        timed = len(expected) > 0 and not isinstance(expected[0][0], str)
+        pending = {}
+        for i, m in enumerate(expected):
+            pending.setdefault(_key(*m[-2:]), []).append(i)
+        for indices in pending.values():
+            indices.reverse()
+        # match each received message to the earliest unmatched identical message sent
+        matched = np.full(len(messages), -1)
+        for j, (path, args) in enumerate(messages):
+            indices = pending.get(_key(path, args))
+            if indices:
+                matched[j] = indices.pop()
+        received = matched >= 0
+        order = matched[received]
+        reordered = int((order[1:] < np.maximum.accumulate(order)[:-1]).sum()) if len(order) else 0
+        result = {'expected': len(expected), 'lost': len(expected) - int(received.sum()),
+                  'unexpected': int((~received).sum()), 'reordered': reordered,
+                  'loss_rate': (len(expected) - int(received.sum())) / len(expected) if expected else 0.0}
+        if timed:
+            sent = np.array([float(m[0]) for m in expected])
+            transit = arrivals[received] - sent[order]
+            if len(transit):
+                result['latency_mean'] = float((transit - transit.min()).mean())
+                result['jitter'] = float(np.abs(np.diff(transit)).mean()) if len(transit) > 1 else 0.0
+                result['jitter_max'] = float(np.abs(transit - transit.mean()).max())
+        return result
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Emulate the MRP OSC interface and print statistics.')
+    parser.add_argument('--ip', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7770)
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between statistics')
+    parser.add_argument('--verbose', action='store_true', help='print every message')
+    args = parser.parse_args()
+    with MRPEmulator(args.ip, args.port, verbose=args.verbose) as emulator:
+        print(f"MRPEmulator: listening on {args.ip}:{emulator.port}")
+        try:
+            while True:
+                time.sleep(args.interval)
+                s = emulator.stats()
+                print(f"MRPEmulator: {s['messages']} messages, {s['rate']:.0f}/s, {s['errors']} errors, "
+                      f"voices {len(emulator.state.order)} (peak {s['peak_voices']}), late {s['late']}")
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+'''
+Note-triggered envelopes for MRP qualities.
+
+An `MRPEnvelope` is a reusable template: breakpoints from note on, whose last value is
+held (the sustain), and release breakpoints from note off, starting at the level reached.
+`MRPEnvelopes` attaches templates to notes as they are turned on, and on each control tick
+evaluates every live envelope together, as NumPy operations over arrays of breakpoints,
+then sends only the values that changed, all in one bundle. A released note is turned
+off when its release ends.
+
+Example
+    envelopes = MRPEnvelopes(mrp, rate=100)
+    envelopes.attach('intensity', MRPEnvelope.adsr(0.05, 0.2, 0.6, 1.0))
+    envelopes.attach('brightness', MRPEnvelope([(0, 0), (2, 1)], release=[(0.5, 0)]))
+    envelopes.start()
+    envelopes.note_on(60)
+    ...
+    envelopes.note_off(60) # the MRP note off is sent 1 s later
+
+`mrp` may also be an `MRPCommandQueue`, so the runner thread does not share the `MRP`
+with other threads.
+'''
+
+import time
+import threading
+import contextlib
+import numpy as np
+
+from .state import STATE_QUALITIES
+
+ENVELOPE_QUALITIES = STATE_QUALITIES # scalar qualities; harmonics_raw is a vector
+
+class MRPEnvelope:
+    """
+    Multi-segment envelope template.
+
+    Args
+        points (list): (time, value) breakpoints from note on, times increasing from 0;
+                       the last value is held until note off
+        release (list): (time, value) breakpoints from note off, times increasing from >0,
+                        starting at the level at note off; empty to end at once
+        curve (float): segment shape, 1 linear, >1 slow start, <1 fast start
+    """
+    def __init__(self, points:list, release:list=((0.1, 0.0),), curve:float=1.0) -> None:
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        release = np.asarray(release, dtype=float).reshape(-1, 2)
+        if len(points) == 0 or points[0, 0] != 0:
+            raise ValueError('envelope points must start at time 0')
+        if np.any(np.diff(points[:, 0]) <= 0) or np.any(np.diff(release[:, 0]) <= 0) or np.any(release[:, 0] <= 0):
+            raise ValueError('envelope times must increase')
+        self.points = points
+        self.release = release
+        self.curve = float(curve)
+
+    @classmethod
+    def adsr(cls, attack:float, decay:float, sustain:float, release:float,
+             peak:float=1.0, start:float=0.0, end:float=0.0, curve:float=1.0) -> 'MRPEnvelope':
+        """
+        Attack to peak, decay to the sustain level held until note off, then release to end.
+
+        Example
+            MRPEnvelope.adsr(0.05, 0.2, 0.6, 1.0) # intensity swell
+        """
+        points = [(0.0, start), (attack, peak)] if attack > 0 else [(0.0, peak)]
+        if decay > 0: points.append((points[-1][0] + decay, sustain))
+        return cls(points, [(max(release, 1e-6), end)], curve)
+
+    @property
+    def duration(self) -> float:
+        """Time from note on to the sustain."""
+        return float(self.points[-1, 0])
+
+    @property
+    def release_time(self) -> float:
+        return float(self.release[-1, 0]) if len(self.release) else 0.0
+
+    def value(self, t:float, released:float=None) -> float:
+        """
+        Value t seconds after note on, the note released at `released` seconds, if given.
+        """
+        on = float(_interp(np.array([t]), self.points[None, :, 0], self.points[None, :, 1], np.array([self.curve]))[0])
+        if released is None or t < released:
+            return on
+        level = self.value(released)
+        times = np.concatenate([[0.0], self.release[:, 0]])[None]
+        values = np.concatenate([[level], self.release[:, 1]])[None]
+        return float(_interp(np.array([t - released]), times, values, np.array([self.curve]))[0])
+
+    def __repr__(self) -> str:
+        return f'MRPEnvelope({self.points.tolist()}, release={self.release.tolist()}, curve={self.curve})'
+
+def _interp(x:np.ndarray, times:np.ndarray, values:np.ndarray, curve:np.ndarray) -> np.ndarray:
+    """
+    Evaluate piecewise curves at x (E,), each row of times and values (E, K) a curve
+    padded with +inf times (and its last value).
+    """
+    rows = np.arange(len(x))
+    k = (x[:, None] >= times).sum(1)
+    last = times.shape[1] - 1
+    k0, k1 = np.clip(k - 1, 0, last), np.clip(k, 0, last)
+    t0, t1 = times[rows, k0], times[rows, k1]
+    v0, v1 = values[rows, k0], values[rows, k1]
+    span = t1 - t0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(np.isfinite(span) & (span > 0), (x - t0) / span, 0.0)
+    frac = np.clip(frac, 0.0, 1.0) ** curve
+    return v0 + (v1 - v0) * frac
+
+class MRPEnvelopes:
+    """
+    Runs the envelopes of all notes, one vectorized evaluation per control tick.
+
+    Args
+        mrp (MRP): instance (or MRPCommandQueue) sending the notes and qualities
+        rate (float): control ticks per second of the `start` thread
+        threshold (float): smallest change of a value that is sent
+
+    Attributes
+        envelopes (dict): quality -> MRPEnvelope attached to every note
+        sent (int): quality values sent
+    """
+    def __init__(self, mrp, rate:float=100.0, threshold:float=1e-4) -> None:
+        self.mrp = mrp
+        self.rate = rate
+        self.threshold = threshold
+        self.envelopes = {}
+        self._templates = [] # MRPEnvelope, indexed by the template column
+        self._template_index = {} # _template_key -> template column
+        self._on_t = self._on_v = self._rel_t = self._rel_v = self._curve = self._rel_end = None
+        # one row per live envelope
+        self._note = np.zeros(0, dtype=np.int16)
+        self._quality = np.zeros(0, dtype=np.int16)
+        self._template = np.zeros(0, dtype=np.int32)
+        self._start = np.zeros(0)
+        self._released = np.zeros(0) # note off time, +inf while held
+        self._level = np.zeros(0) # value at note off
+        self._last = np.zeros(0) # last value sent, NaN if none
+        self._notes = set() # notes with live envelopes, on in the MRP
+        self._releasing = set()
+        self.sent = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, quality:str, envelope:MRPEnvelope):
+        """Apply envelope to quality for the notes turned on from now on."""
+        self.envelopes[_check(quality)] = envelope
+
+    def detach(self, quality:str):
+        self.envelopes.pop(quality, None)
+
+    """
+    templates
+    """
+    def _template_ids(self, envelopes:list) -> list:
+        """
+        Template index of each envelope. Templates are keyed by value, and adding any
+        first drops the templates no live envelope uses, so the tables stay as small as
+        the set of distinct live envelopes.
+        """
+        keys = [_template_key(e) for e in envelopes]
+        missing = [k for k in dict.fromkeys(keys) if k not in self._template_index]
+        if missing:
+            by_key = dict(zip(keys, envelopes))
+            keep = sorted(set(self._template.tolist()) | {self._template_index[k] for k in keys if k in self._template_index})
+            remap = np.full(len(self._templates), -1, dtype=np.int32)
+            remap[keep] = np.arange(len(keep))
+            self._template = remap[self._template]
+            self._templates = [self._templates[i] for i in keep] + [by_key[k] for k in missing]
+            self._template_index = {_template_key(e): i for i, e in enumerate(self._templates)}
+            self._build_tables()
+        return [self._template_index[k] for k in keys]
+
+    def _build_tables(self):
+        k = max(len(e.points) for e in self._templates)
+        r = max(len(e.release) for e in self._templates) + 1 # the level at note off first
+        m = len(self._templates)
+        self._on_t, self._on_v = np.full((m, k), np.inf), np.zeros((m, k))
+        self._rel_t, self._rel_v = np.full((m, r), np.inf), np.zeros((m, r))
+        for i, e in enumerate(self._templates):
+            n = len(e.points)
+            self._on_t[i, :n], self._on_v[i, :n], self._on_v[i, n:] = e.points[:, 0], e.points[:, 1], e.points[-1, 1]
+            n = len(e.release)
+            self._rel_t[i, 0] = 0.0
+            self._rel_t[i, 1:n + 1], self._rel_v[i, 1:n + 1] = e.release[:, 0], e.release[:, 1]
+            self._rel_v[i, n + 1:] = e.release[-1, 1] if n else 0.0
+        self._curve = np.array([e.curve for e in self._templates])
+        self._rel_end = np.array([e.release_time for e in self._templates])
+
+    """
+    notes
+    """
+    def note_on(self, note:int, velocity:int=1, envelopes:dict=None, now:float=None):
+        """
+        Turn a note on with the attached envelopes, and any in envelopes (quality -> MRPEnvelope).
+        A note still held or releasing restarts its envelopes.
+        """
+        now = time.perf_counter() if now is None else now
+        envelopes = {**self.envelopes, **(envelopes or {})}
+        with self._lock:
+            retrigger = note in self._notes
+            self._remove(self._note == note)
+            self._releasing.discard(note)
+            if not retrigger:
+                self.mrp.note_on(note, velocity)
+            if not envelopes:
+                return
+            self._notes.add(note)
+            n = len(envelopes)
+            self._note = np.append(self._note, np.full(n, note, dtype=np.int16))
+            self._quality = np.append(self._quality, [STATE_QUALITIES.index(_check(q)) for q in envelopes]).astype(np.int16)
+            self._template = np.append(self._template, self._template_ids(list(envelopes.values()))).astype(np.int32)
+            self._start = np.append(self._start, np.full(n, now))
+            self._released = np.append(self._released, np.full(n, np.inf))
+            self._level = np.append(self._level, np.zeros(n))
+            self._last = np.append(self._last, np.full(n, np.nan))
+
+    def note_off(self, note:int, now:float=None):
+        """Release the envelopes of a note; the note is turned off when they end."""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            if note not in self._notes:
+                self.mrp.note_off(note)
+                return
+            held = (self._note == note) & np.isinf(self._released)
+            if held.any():
+                self._level[held] = self._on_values(now, held)
+                self._released[held] = now
+                self._releasing.add(note)
+
+    def _on_values(self, now:float, rows) -> np.ndarray:
+        template = self._template[rows]
+        return _interp(now - self._start[rows], self._on_t[template], self._on_v[template], self._curve[template])
+
+    def _remove(self, mask:np.ndarray):
+        if mask.any():
+            keep = ~mask
+            for name in ('_note', '_quality', '_template', '_start', '_released', '_level', '_last'):
+                setattr(self, name, getattr(self, name)[keep])
+
+    def live(self) -> int:
+        """Number of live envelopes."""
+        return len(self._note)
+
+    """
+    control
+    """
+    def values(self, now:float) -> tuple:
+        """Values of all live envelopes at time now, and which have ended."""
+        template = self._template
+        value = self._on_values(now, slice(None))
+        released = now >= self._released
+        if released.any():
+            rel_v = self._rel_v[template[released]]
+            rel_v[:, 0] = self._level[released]
+            t = template[released]
+            value[released] = _interp(now - self._released[released], self._rel_t[t], rel_v, self._curve[t])
+        ended = released & (now - self._released >= self._rel_end[template])
+        return value, ended
+
+    def tick(self, now:float=None) -> int:
+        """
+        Evaluate every live envelope, send the changed values and turn off the notes
+        whose release ended. Returns the number of values sent.
+
+        The messages are sent in one bundle (`MRP.bundle`) before the lock is released,
+        so a `note_on` from another thread cannot reach the device ahead of a note off.
+        """
+        now = time.perf_counter() if now is None else now
+        with self._lock, self._batch():
+            if not len(self._note):
+                return 0
+            value, ended = self.values(now)
+            changed = ~(np.abs(value - self._last) <= self.threshold) # NaN: never sent
+            self._last[changed] = value[changed]
+            updates = {}
+            for i in np.flatnonzero(changed).tolist():
+                updates.setdefault(int(self._note[i]), {})[STATE_QUALITIES[self._quality[i]]] = float(value[i])
+            for note, qualities in updates.items():
+                self.mrp.set_note_qualities(note, qualities)
+            if ended.any():
+                self._remove(ended)
+                for note in sorted(self._releasing):
+                    if not (self._note == note).any():
+                        self._releasing.discard(note)
+                        self._notes.discard(note)
+                        self.mrp.note_off(note)
+            n = int(changed.sum())
+            self.sent += n
+            return n
+
+    def _batch(self):
+        """Collects the messages of a tick into one bundle (an MRPCommandQueue batches them itself)."""
+        bundle = getattr(self.mrp, 'bundle', None)
+        return bundle() if bundle is not None else contextlib.nullcontext()
+
+    def start(self) -> 'MRPEnvelopes':
+        """Tick at `rate` in a background thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        interval = 1 / self.rate
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            self.tick()
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.perf_counter()
+
+def _template_key(envelope:MRPEnvelope) -> tuple:
+    return (envelope.points.tobytes(), envelope.release.tobytes(), envelope.curve)
+
+def _check(quality:str) -> str:
+    if quality not in ENVELOPE_QUALITIES:
+        raise ValueError(f'envelopes apply to the scalar qualities {ENVELOPE_QUALITIES}, not {quality!r}')
+    return quality
@@ -0,0 +1,361 @@
+'''
+OSC gateway sharing one MRP between several clients.
+
+The SuperCollider, TidalCycles and Max front ends all send to the MRP on port 7770, so
+performers connecting at once turn each other's notes off and flood it with quality
+updates. `MRPGateway` listens for the same OSC paths on another port (7771 by default),
+so the front ends only need a different port, and forwards to the MRP through an `MRP`
+instance:
+
+- voices are arbitrated between clients (one per source address): a note belongs to the
+  client that turned it on, only that client can change or release it, and a client over
+  its share of voices (`voices_per_client`) or a full MRP steals from the client holding
+  the most voices, oldest note first
+- quality updates are coalesced per note and quality by an `MRPCommandQueue`, and each
+  tick's messages are forwarded as OSC bundles
+
+The gateway runs on one thread which receives until the next tick is due, then dispatches,
+so a message waits at most `interval` plus the dispatch time before it is forwarded.
+
+Example
+    with MRPGateway(port=7771, mrp_port=7770) as gateway:
+        ... # point MRP.sc, mrp.tidal and mrp.osc at port 7771
+        print(gateway.stats())
+
+From a shell, `python -m iimrp.gateway --port 7771 --mrp-port 7770`.
+'''
+
+import time
+import socket
+import threading
+
+from pythonosc.osc_bundle_builder import OscBundleBuilder
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.parsing.osc_types import IMMEDIATELY
+
+from .iimrp import MRP
+from .commands import MRPCommandQueue
+from .emulator import decode_datagram
+
+GATEWAY_MAX_BUNDLE = 32 # messages per forwarded bundle
+
+class GatewayOSC:
+    """
+    The part of the iipyper OSC interface used by `MRP`, buffering sent messages until
+    `flush`, which sends them as OSC bundles.
+
+    Args
+        bundle (bool): send bundles of up to `max_bundle` messages, or one datagram per message
+        max_bundle (int): messages per bundle
+    """
+    def __init__(self, bundle:bool=True, max_bundle:int=GATEWAY_MAX_BUNDLE) -> None:
+        self.bundle = bundle
+        self.max_bundle = max_bundle
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.clients = {}
+        self._pending = {}
+        self.messages = self.datagrams = 0
+
+    def get_client_by_name(self, name:str):
+        return self.clients.get(name)
+
+    def create_client(self, name:str, ip:str, port:int):
+        self.clients[name] = (ip, port)
+        self._pending[name] = []
+
+    def send(self, path:str, *args, client:str=None):
+        self._pending[client].append((path, args))
+
+    def flush(self) -> int:
+        """Send the buffered messages; returns the number of datagrams sent."""
+        sent = 0
+        for name, messages in self._pending.items():
+            if not messages:
+                continue
+            address = self.clients[name]
+            self.messages += len(messages)
+            step = self.max_bundle if self.bundle else 1
+            for i in range(0, len(messages), step):
+                chunk = messages[i:i + step]
+                if len(chunk) == 1:
+                    dgram = _build(*chunk[0]).dgram
+                else:
+                    builder = OscBundleBuilder(IMMEDIATELY)
+                    for path, args in chunk:
+                        builder.add_content(_build(path, args))
+                    dgram = builder.build().dgram
+                self.sock.sendto(dgram, address)
+                sent += 1
+            messages.clear()
+        self.datagrams += sent
+        return sent
+
+    def close(self):
+        self.sock.close()
+
+def _build(path:str, args):
+    builder = OscMessageBuilder(path)
+    for a in args:
+        builder.add_arg(a)
+    return builder.build()
+
+class MRPGateway:
+    """
+    UDP server multiplexing OSC clients onto one MRP.
+
+    Args
+        ip (str): address to listen on
+        port (int): port to listen on, 0 for any free port (see `port`)
+        mrp_ip (str): MRP address
+        mrp_port (int): MRP port
+        interval (float): seconds between dispatches to the MRP
+        voices_per_client (int): most voices one client can hold, default all of them
+        idle_timeout (float): release the notes of clients silent for this many seconds
+        bundle (bool): forward each dispatch as OSC bundles
+        **kwargs: passed to `MRP` (settings, verbose, metrics, ...)
+
+    Attributes
+        mrp (MRP): the instance forwarding to the MRP
+        queue (MRPCommandQueue): coalesces commands between dispatches
+        clients (dict): (ip, port) -> {'notes': notes held oldest first, 'messages': count, 'last': time}
+        owner (dict): note -> client holding it
+    """
+    def __init__(self, ip:str='0.0.0.0', port:int=7771, mrp_ip:str='127.0.0.1', mrp_port:int=7770,
+                 interval:float=0.002, voices_per_client:int=None, idle_timeout:float=None,
+                 bundle:bool=True, **kwargs) -> None:
+        settings = kwargs.pop('settings', {})
+        settings['address'] = {'ip': mrp_ip, 'port': mrp_port}
+        self.osc = GatewayOSC(bundle)
+        self.mrp = MRP(self.osc, settings=settings, **kwargs)
+        self.queue = MRPCommandQueue(self.mrp, interval)
+        self.interval = interval
+        self.voices_per_client = voices_per_client
+        self.idle_timeout = idle_timeout
+        self.qualities = {path: q for q, path in self.mrp.osc_paths['qualities'].items()}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind((ip, port))
+        self.port = self.sock.getsockname()[1]
+        self._thread = None
+        self._running = False
+        self.reset()
+
+    def reset(self):
+        """Forget the clients and their notes, and clear the counters."""
+        self.clients = {}
+        self.owner = {}
+        self.voices = [] # notes on, oldest first
+        self.received = self.datagrams = self.errors = self.steals = 0
+        self.rejected = {}
+        self.tick_max = 0.0
+        self.start_time = time.time()
+
+    def start(self) -> 'MRPGateway':
+        """Start serving in a background thread."""
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving, turn every note off and close the sockets."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.queue.all_notes_off()
+        self.tick()
+        self.sock.close()
+        self.osc.close()
+
+    def __enter__(self) -> 'MRPGateway':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        next_tick = time.perf_counter() + self.interval
+        next_idle = time.time()
+        while self._running:
+            timeout = next_tick - time.perf_counter()
+            if timeout > 0:
+                self.sock.settimeout(min(timeout, 0.05))
+                try:
+                    dgram, client = self.sock.recvfrom(65536)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                self.receive(dgram, client)
+                continue
+            if self.idle_timeout is not None and time.time() >= next_idle:
+                self.release_idle()
+                next_idle = time.time() + min(self.idle_timeout, 1.0)
+            t0 = time.perf_counter()
+            self.tick()
+            now = time.perf_counter()
+            self.tick_max = max(self.tick_max, now - t0)
+            next_tick = max(next_tick + self.interval, now)
+
+    def tick(self) -> int:
+        """Apply the queued commands and forward the messages; returns the datagrams sent."""
+        self.queue.dispatch()
+        return self.osc.flush()
+
+    """
+    receiving
+    """
+    def receive(self, dgram:bytes, client:tuple):
+        """Handle one datagram from client (ip, port); time tags are ignored."""
+        self.datagrams += 1
+        try:
+            messages = decode_datagram(dgram)
+        except Exception:
+            self.errors += 1
+            return
+        state = self.clients.get(client)
+        if state is None:
+            state = self.clients[client] = {'notes': [], 'messages': 0, 'last': 0.0}
+        state['messages'] += len(messages)
+        state['last'] = time.time()
+        for _, path, args in messages:
+            self.received += 1
+            try:
+                self.message(client, path, args)
+            except (IndexError, TypeError, ValueError):
+                self.reject('malformed')
+
+    def message(self, client:tuple, path:str, args:tuple):
+        """Arbitrate one message from client and queue what should reach the MRP."""
+        if path == '/mrp/midi':
+            status, note, velocity = args[:3]
+            if status & 0xF0 == 0x90 and velocity > 0:
+                self.note_on(client, note, velocity)
+            elif status & 0xF0 in (0x80, 0x90):
+                self.note_off(client, note)
+            else:
+                self.reject('unknown')
+        elif path in self.qualities:
+            channel, note, *values = args
+            if self.owner.get(note) != client:
+                return self.reject('not_owner')
+            quality = self.qualities[path]
+            value = values if quality == 'harmonics_raw' else values[0]
+            self.queue.set_note_quality(note, quality, value, False, channel)
+        elif path == '/mrp/pedal/damper':
+            self.queue.pedal_damper(args[0])
+        elif path == '/mrp/pedal/sostenuto':
+            self.queue.pedal_sostenuto(args[0])
+        elif path == '/ui/volume':
+            self.queue.put('ui_volume', args[0])
+        elif path == '/ui/volume/raw':
+            self.queue.put('ui_volume_raw', args[0])
+        elif path == '/mrp/allnotesoff':
+            self.release(client) # only the notes of this client
+        else:
+            self.reject('unknown')
+
+    def reject(self, reason:str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    """
+    voice arbitration
+    """
+    def note_on(self, client:tuple, note:int, velocity:int=1):
+        if not self.mrp.note_is_in_range(note):
+            return self.reject('out_of_range')
+        owner = self.owner.get(note)
+        if owner is not None:
+            return self.reject('already_on' if owner == client else 'conflict')
+        notes = self.clients[client]['notes']
+        limit = self.voices_per_client or self.mrp.settings['voices']['max']
+        if len(notes) >= limit:
+            self._steal(notes[0])
+        elif len(self.voices) >= self.mrp.settings['voices']['max']:
+            victim = max(self.clients.values(), key=lambda c: len(c['notes']))
+            self._steal(victim['notes'][0])
+        self.owner[note] = client
+        notes.append(note)
+        self.voices.append(note)
+        self.queue.note_on(note, velocity)
+
+    def note_off(self, client:tuple, note:int):
+        owner = self.owner.get(note)
+        if owner != client:
+            return self.reject('not_owner')
+        self._off(note)
+
+    def _steal(self, note:int):
+        self.steals += 1
+        self._off(note)
+
+    def _off(self, note:int):
+        client = self.owner.pop(note)
+        self.clients[client]['notes'].remove(note)
+        self.voices.remove(note)
+        self.queue.note_off(note)
+
+    def release(self, client:tuple):
+        """Turn off every note of client."""
+        state = self.clients.get(client)
+        if state is not None:
+            for note in list(state['notes']):
+                self._off(note)
+
+    def release_idle(self):
+        """Release the notes of, and forget, clients silent for longer than `idle_timeout`."""
+        expired = time.time() - self.idle_timeout
+        for client, state in list(self.clients.items()):
+            if state['last'] < expired:
+                self.release(client)
+                del self.clients[client]
+
+    def stats(self) -> dict:
+        elapsed = time.time() - self.start_time
+        q = self.queue.stats()
+        return {
+            'clients': len(self.clients),
+            'voices': len(self.voices),
+            'datagrams': self.datagrams,
+            'received': self.received,
+            'rate': self.received / elapsed if elapsed > 0 else 0.0,
+            'errors': self.errors,
+            'rejected': dict(self.rejected),
+            'steals': self.steals,
+            'coalesced': q['coalesced'],
+            'forwarded': self.osc.messages,
+            'forwarded_datagrams': self.osc.datagrams,
+            'tick_max': self.tick_max,
+        }
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Share one MRP between several OSC clients.')
+    parser.add_argument('--ip', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=7771)
+    parser.add_argument('--mrp-ip', default='127.0.0.1')
+    parser.add_argument('--mrp-port', type=int, default=7770)
+    parser.add_argument('--interval', type=float, default=0.002, help='seconds between dispatches')
+    parser.add_argument('--voices-per-client', type=int, default=None)
+    parser.add_argument('--idle-timeout', type=float, default=None, help='release notes of silent clients')
+    parser.add_argument('--no-bundle', action='store_true', help='forward one datagram per message')
+    parser.add_argument('--stats', type=float, default=5.0, help='seconds between statistics')
+    args = parser.parse_args()
+    gateway = MRPGateway(args.ip, args.port, args.mrp_ip, args.mrp_port, args.interval,
+                         args.voices_per_client, args.idle_timeout, not args.no_bundle)
+    with gateway:
+        print(f"MRPGateway: listening on {args.ip}:{gateway.port}, forwarding to {args.mrp_ip}:{args.mrp_port}")
+        try:
+            while True:
+                time.sleep(args.stats)
+                s = gateway.stats()
+                print(f"MRPGateway: {s['clients']} clients, {s['received']} received ({s['rate']:.0f}/s), "
+                      f"{s['forwarded']} forwarded in {s['forwarded_datagrams']} datagrams, "
+                      f"{s['coalesced']} coalesced, voices {s['voices']}, tick max {s['tick_max']*1e3:.2f} ms")
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
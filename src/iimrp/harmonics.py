@@ -6,7 +6,6 @@ TODO: nearest harmonics: for a given frequency and a set of notes, find nearest
 '''
 
 import numpy as np
-np.set_printoptions(suppress=True)
 
 def create_harmonics(H:int, N:int=88, A0_freq:float=27.5) -> np.array:
     """Create a 2D array of harmonics for a piano with N keys.
@@ -472,6 +471,8 @@ def create_subplot(func, n):
     func -- function that generates a harmonic series
     n -- length of the harmonic series
     """
+    from bokeh.plotting import figure
+
     # Generate harmonic series
     harmonic_series = func(n)
     
@@ -496,6 +497,9 @@ def plot_grid(functions, n):
     functions -- list of functions that generate harmonic series
     n -- length of each harmonic series
     """
+    from bokeh.layouts import gridplot
+    from bokeh.io import output_notebook, show
+
     # Generate a list of subplots
     plots = [create_subplot(func, n) for func in functions]
 
@@ -14,7 +14,6 @@ TODO:
 - add timer to turn off notes after 90s
 - custom max/min ranges for qualities
 - harmonics_raw dict and functions
-- add simulator via sc3 lib
 - remove mido
 - rename harmonic -> harmonic_sweep and add harmonic(note, partial, amplitude)
 """
@@ -23,9 +22,14 @@ import time
 import math
 import numpy as np
 import copy
+import threading
+import contextlib
 from datetime import datetime
 
 from .thermal import *
+from .recording import MRPRecorder
+from .state import MRPState, STATE_BUNDLE_BYTES, bundle_messages
+from .metrics import MRPMetrics, PrometheusExporter, instrument, uninstrument
 
 NOTE_ON = True
 NOTE_OFF = False
@@ -51,16 +55,22 @@ class MRP:
             'qualities_min': 0.0,
             'heat_monitor': False
         }
-        self.settings = kwargs.get('settings', self.default_settings)
+        self.settings = copy.deepcopy(self.default_settings)
+        for key, value in kwargs.get('settings', {}).items(): # partial settings update the defaults
+            if isinstance(value, dict) and isinstance(self.settings.get(key), dict):
+                self.settings[key].update(value)
+            else:
+                self.settings[key] = value
         self.note_on_hex = 0x9F
         self.note_off_hex = 0x8F
         self.print('MRP starting with settings:', self.settings)
 
         # OSC reference and paths
         self.osc = osc
-        if self.osc.get_client_by_name("mrp") is None:
+        self.client = kwargs.get('client', 'mrp') # OSC client name, one per instrument
+        if self.osc.get_client_by_name(self.client) is None:
             self.print(f"MRP OSC client not found, creating one at {self.settings['address']['ip']}:{self.settings['address']['port']}")
-            self.osc.create_client("mrp", self.settings['address']['ip'], self.settings['address']['port'])
+            self.osc.create_client(self.client, self.settings['address']['ip'], self.settings['address']['port'])
         self.osc_paths = {
             'midi': '/mrp/midi',
             'qualities': {
@@ -109,9 +119,9 @@ class MRP:
             'damper': 0,
             'sostenuto': 0
         }
-        self.ui = {
-            'volume': 0,
-            'volume_raw': 0
+        self.ui = { # None until set
+            'volume': None,
+            'volume_raw': None
         }
         self.program = 0 # current program (see MRP XML)
         # init sequence
@@ -131,10 +141,17 @@ class MRP:
             "c9": 120, "cs9": 121, "d9": 122, "e9": 123, "f9": 124, "fs9": 125, "g9": 126, "gs9": 127, "a9": 128
         }
 
+        self._local = threading.local() # .bundle: messages collected by this thread's bundle()
+        self.metrics = None
+        self.metrics_exporter = None
+        if kwargs.get('metrics', False):
+            self.metrics_on(export=kwargs.get('metrics_file', None))
+
         self.recording = False
+        self.recorder = None
+        self.recording_filename = kwargs.get('file', None)
         if kwargs.get('record', False):
-            self.recording_filename = kwargs.get('file', None)
-            self.record_start()
+            self.record_start(buffered=kwargs.get('record_buffered', False), **kwargs.get('record_options', {}))
 
         self.setup_amp_data(kwargs)
 
@@ -177,9 +194,11 @@ class MRP:
             tmp['midi']['velocity'] = velocity
             path = self.osc_paths['midi']
             self.print(path, 'Note On:', note, ', Velocity:', velocity)
-            return self.send(path, self.note_on_hex, note, velocity, client="mrp")
+            return self.send(path, self.note_on_hex, note, velocity, client=self.client)
         else:
             self.print('note_on(): invalid Note On', note)
+            if self.metrics is not None:
+                self.metrics.count_invalid('note_on', 'out_of_range' if not self.note_is_in_range(note) else 'already_on')
             return None
 
     def note_off(self, note, velocity=0, channel=None):
@@ -199,9 +218,11 @@ class MRP:
             tmp['midi']['velocity'] = velocity
             path = self.osc_paths['midi']
             self.print(path, 'Note Off:', note)
-            return self.send(path, self.note_off_hex, note, velocity, client="mrp")
+            return self.send(path, self.note_off_hex, note, velocity, client=self.client)
         else:
             self.print('note_off(): invalid Note Off', note)
+            if self.metrics is not None:
+                self.metrics.count_invalid('note_off', 'out_of_range' if not self.note_is_in_range(note) else 'already_off')
             return None
 
     def notes_on(self, notes, velocities=None):
@@ -231,7 +252,7 @@ class MRP:
     #     )
     #     path = self.osc_paths['midi']
     #     self.print(path, 'Control Change:', *m.bytes())
-    #     self.send(path, *m.bytes(), client="mrp")
+    #     self.send(path, *m.bytes(), client=self.client)
 
     # def program_change(self, program, channel=None):
     #     """
@@ -249,7 +270,7 @@ class MRP:
     #     )
     #     path = self.osc_paths['midi']
     #     self.print(path, 'Program Change:', *m.bytes())
-    #     self.send(path, *m.bytes(), client="mrp")
+    #     self.send(path, *m.bytes(), client=self.client)
     
     """
     /mrp/qualities
@@ -288,7 +309,7 @@ class MRP:
                         tmp['qualities'][quality] = [self.quality_clamp(v) for v in value]
                     path = self.osc_paths['qualities'][quality]
                     self.print(path, channel, note, *tmp['qualities'][quality])
-                    return self.send(path, channel, note, *tmp['qualities'][quality], client="mrp")
+                    return self.send(path, channel, note, *tmp['qualities'][quality], client=self.client)
                 else:
                     if relative is True:
                         tmp['qualities'][quality] = self.quality_clamp(value + tmp['qualities'][quality])
@@ -296,9 +317,10 @@ class MRP:
                         tmp['qualities'][quality] = self.quality_clamp(value)
                     path = self.osc_paths['qualities'][quality]
                     self.print(path, channel, note, tmp['qualities'][quality])
-                    return self.send(path, channel, note, tmp['qualities'][quality], client="mrp")
+                    return self.send(path, channel, note, tmp['qualities'][quality], client=self.client)
             else:
                 self.print('set_note_quality(): invalid message:', quality, note, value)
+                if self.metrics is not None: self.metrics.count_invalid('quality', 'note_off')
                 return None
         else:
             self.print('set_note_quality(): "quality" is not a string:', quality)
@@ -321,7 +343,7 @@ class MRP:
             active_notes = self.note_on_numbers()
             changed_notes = []
             for note in active_notes:
-                changed_note = self.set_note_quality(self, note, quality, value, relative, channel)
+                changed_note = self.set_note_quality(note, quality, value, relative, channel)
                 changed_notes.append(changed_note)
             return changed_notes
         else:
@@ -345,12 +367,16 @@ class MRP:
                               must be same as key in osc_paths
             relative (bool): replace the value or add it to the current value
             channel (int): which MIDI channel to send on
+
+        Returns
+            list of the messages sent, one per quality
         """
         if isinstance(qualities, dict):
             if self.note_msg_is_valid(note) == True:
                 if channel is None:
                     channel = self.settings['channel']
                 tmp = self.notes[self.note_index(note)]
+                sent = []
                 for q, v in qualities.items():
                     if isinstance(v, list) or isinstance(v, np.ndarray): # e.g. /harmonics/raw
                         if relative is True:
@@ -359,17 +385,19 @@ class MRP:
                             tmp['qualities'][q] = [self.quality_clamp(i) for i in v]
                         path = self.osc_paths['qualities'][q]
                         self.print(path, channel, note, *tmp['qualities'][q])
-                        return self.send(path, channel, note, *tmp['qualities'][q], client="mrp")
+                        sent.append(self.send(path, channel, note, *tmp['qualities'][q], client=self.client))
                     else:
                         if relative is True:
-                            tmp['qualities'][q] = self.quality_clamp(v, tmp['qualities'][q])
+                            tmp['qualities'][q] = self.quality_clamp(v + tmp['qualities'][q])
                         else:
                             tmp['qualities'][q] = self.quality_clamp(v)
                         path = self.osc_paths['qualities'][q]
                         self.print(path, channel, note, tmp['qualities'][q])
-                        return self.send(path, channel, note, tmp['qualities'][q], client="mrp")
+                        sent.append(self.send(path, channel, note, tmp['qualities'][q], client=self.client))
+                return sent
             else:
                 self.print('quality_update(): invalid message:', note, qualities)
+                if self.metrics is not None: self.metrics.count_invalid('quality', 'note_off')
                 return None
         else:
             self.print('quality_update(): "qualities" is not an object:', note, qualities)
@@ -396,11 +424,11 @@ class MRP:
             active_notes = self.note_on_numbers()
             changed_notes = []
             for note in active_notes:
-                changed_note = self.qualities_update(self, qualities, relative, channel)
+                changed_note = self.set_note_qualities(note, qualities, relative, channel)
                 changed_notes.append(changed_note)
             return changed_notes
         else:
-            print('quality_update(): "qualities" is not an object:', note, qualities)
+            print('quality_update(): "qualities" is not an object:', qualities)
             return None
 
     def get_note_quality(self, note:int, quality:str) -> float:
@@ -470,19 +498,19 @@ class MRP:
         """
         set pedal sostenuto value
         """
-        self.pedal.sostenuto = sostenuto
+        self.pedal['sostenuto'] = sostenuto
         path = self.osc_paths['pedal']['sostenuto']
         self.print(path, sostenuto)
-        return self.send(path, sostenuto, client="mrp")
+        return self.send(path, sostenuto, client=self.client)
 
     def pedal_damper(self, damper):
         """
         set pedal damper value
         """
-        self.pedal.damper = damper
+        self.pedal['damper'] = damper
         path = self.osc_paths['pedal']['damper']
         self.print(path, damper)
-        return self.send(path, damper, client="mrp")
+        return self.send(path, damper, client=self.client)
 
     """
     /mrp/* miscellaneous
@@ -495,7 +523,7 @@ class MRP:
         self.print(path)
         self.init_notes()
         self.voices_reset()
-        return self.send(path, client="mrp")
+        return self.send(path, client=self.client)
 
     """
     /mrp/ui
@@ -504,19 +532,19 @@ class MRP:
         """
         float vol // 0-1, >0.5 ? 4^((vol-0.5)/0.5) : 10^((vol-0.5)/0.5)
         """
-        self.ui.volume = value
+        self.ui['volume'] = value
         path = self.osc_paths['ui']['volume']
         self.print(path, value)
-        return self.send(path, value, client="mrp")
+        return self.send(path, value, client=self.client)
 
     def ui_volume_raw(self, value):
         """
         float vol // 0-1, set volume directly
         """
-        self.ui.volume_raw = value
+        self.ui['volume_raw'] = value
         path = self.osc_paths['ui']['volume_raw']
         self.print(path, value)
-        return self.send(path, value, client="mrp")
+        return self.send(path, value, client=self.client)
 
     """
     note methods
@@ -623,9 +651,11 @@ class MRP:
                     self.print('voices_add(): removing oldest', oldest)
                     self.voices.pop(0)
                     self.voices.append(note)
+                    if self.metrics is not None: self.metrics.voice_steals += 1
                     self.note_off(oldest)
                     return self.voices
                 case _: # lowest, highest, quietest, ...
+                    if self.metrics is not None: self.metrics.voices_dropped += 1
                     return self.voices
         return self.voices
 
@@ -683,9 +713,18 @@ class MRP:
 
     def send(self, *args, **kwargs):
         """
-        wrapped osc.send to handle logging
+        wrapped osc.send to handle logging and metrics
         """
-        self.osc.send(*args, **kwargs)
+        collecting = getattr(self._local, 'bundle', None)
+        if collecting is not None: # inside this thread's bundle(): sent on exit
+            collecting.append((args[0], args[1:]))
+            return args
+        if self.metrics is None:
+            self.osc.send(*args, **kwargs)
+        else:
+            t0 = time.perf_counter_ns()
+            self.osc.send(*args, **kwargs)
+            self.metrics.sent(args[0], time.perf_counter_ns() - t0)
         if self.recording:
             self.log(*args)
         return args
@@ -699,6 +738,9 @@ class MRP:
             2.81722 /mrp/quality/intensity iif 15 70 0 
             3.00336 /mrp/allnotesoff
         """
+        if self.recorder is not None:
+            self.recorder.push(self.t(), args)
+            return args
         tag = self.osc.log.type_tag(args[1:])
         args = self.osc_args_to_log_str([self.t(), args[0], tag] + list(args[1:]))
         self.osc.log(args)
@@ -707,23 +749,184 @@ class MRP:
     def osc_args_to_log_str(self, arr: list) -> str:
         return ' '.join([f'{x:.5f}' if isinstance(x, float) else str(x) for x in arr])
 
-    def record_start(self, filename: str=None):
+    def record_start(self, filename: str=None, buffered: bool=False, **kwargs):
+        """
+        Start recording sent messages to a .log file.
+
+        Args
+            filename (str): log file, defaults to a timestamped name
+            buffered (bool): write from a background MRPRecorder instead of osc.log,
+                             so recording adds no file IO to send()
+            **kwargs: MRPRecorder options (flush_interval, max_bytes, max_seconds, compression)
+        """
         if filename is not None:
             self.recording_filename = filename
         elif self.recording_filename is None:
             self.recording_filename = f"iimrp-recording_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log"
         self.record_start_time = time.time()
         self.t = lambda: time.time() - self.record_start_time
+        if buffered:
+            self.recorder = MRPRecorder(self.recording_filename, **kwargs)
+            self.recorder.start()
+        else:
+            self.osc.log.record_start(self.recording_filename)
         self.recording = True
-        self.osc.log.record_start(self.recording_filename)
         print(f"[iimrp] Recording started")
 
+    def record_stop(self):
+        """
+        Stop recording, writing out any buffered messages.
+        """
+        self.recording = False
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+        print(f"[iimrp] Recording stopped")
+
+    """
+    metrics
+    """
+    def metrics_on(self, export: str=None, interval: float=5.0) -> MRPMetrics:
+        """
+        Start collecting metrics (see `metrics.py`).
+
+        Args
+            export (str): also write the metrics to this Prometheus text file every interval seconds
+            interval (float): seconds between writes of the export file
+        """
+        if self.metrics is None:
+            self.metrics = MRPMetrics()
+            instrument(self, self.metrics)
+        if export is not None:
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.stop()
+            self.metrics_exporter = PrometheusExporter(self, export, interval).start()
+        return self.metrics
+
+    def metrics_off(self):
+        """
+        Stop collecting metrics and exporting them.
+        """
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+        uninstrument(self)
+        self.metrics = None
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the metrics (see `MRPMetrics.snapshot`) with the current number of voices.
+        Only 'voices' and 'enabled' when metrics are off.
+        """
+        stats = {'enabled': self.metrics is not None, 'voices': len(self.voices)}
+        if self.metrics is not None:
+            stats.update(self.metrics.snapshot())
+        return stats
+
+    """
+    state resync
+    """
+    def snapshot(self) -> MRPState:
+        """
+        Snapshot the note, quality, pedal and UI state (see `MRPState`, and `MRPState.pack`
+        for a compact array form).
+        """
+        return MRPState.from_mrp(self)
+
+    def resync(self, target: MRPState=None, max_bytes: int=STATE_BUNDLE_BYTES, allow_reset: bool=True) -> list:
+        """
+        Bring the MRP software back to this instance's state, e.g. after it restarted,
+        with the fewest messages (see `MRPState.diff`), sent as bundles of at most max_bytes.
+        Bundles need a python-osc client (as iipyper's); otherwise messages are sent one by one.
+
+        Args
+            target (MRPState): what the MRP currently holds, e.g. `MRPEmulator.snapshot()`;
+                               None after a restart (all notes off, pedals at 0, UI unset)
+            max_bytes (int): largest bundle
+            allow_reset (bool): start with /mrp/allnotesoff when that needs fewer messages
+        Returns
+            the bundles sent, as lists of (path, args)
+        """
+        if target is None:
+            target = MRPState()
+        return self.send_messages(target.diff(self.snapshot(), allow_reset), max_bytes=max_bytes)
+
+    @contextlib.contextmanager
+    def bundle(self, timetag: float=None, max_bytes: int=STATE_BUNDLE_BYTES):
+        """
+        Collect the messages sent by MRP methods within the block and send them on exit
+        as OSC bundles (see `send_messages`). Nested blocks join the outer one. Only the
+        calling thread's messages are collected; other threads keep sending at once.
+
+        Example
+            with mrp.bundle(timetag=time.time() + 0.2): # played in 200 ms by the MRP
+                mrp.note_on(48)
+                mrp.set_note_quality(48, 'intensity', 0.8)
+        """
+        collecting = getattr(self._local, 'bundle', None)
+        if collecting is not None:
+            yield collecting
+            return
+        messages = self._local.bundle = []
+        try:
+            yield messages
+        finally:
+            self._local.bundle = None
+            self.send_messages(messages, timetag, max_bytes)
+
+    def send_messages(self, messages: list, timetag: float=None, max_bytes: int=STATE_BUNDLE_BYTES) -> list:
+        """
+        Send (path, args) messages as bundles of at most max_bytes, time tagged if
+        timetag (time.time() seconds) is given. Bundles need a python-osc client (as
+        iipyper's); otherwise the messages are sent one by one, at once.
+
+        Returns
+            the bundles, as lists of (path, args)
+        """
+        bundles = bundle_messages(messages, max_bytes)
+        client = self.osc.get_client_by_name(self.client)
+        for bundle in bundles:
+            if hasattr(client, 'send') and (len(bundle) > 1 or timetag is not None):
+                self.send_bundle(client, bundle, timetag)
+            else:
+                for path, args in bundle:
+                    self.send(path, *args, client=self.client)
+        return bundles
+
+    def send_bundle(self, client, messages: list, timetag: float=None):
+        """
+        send (path, args) messages in one OSC bundle through a python-osc client,
+        with logging and metrics as `send`
+        """
+        from pythonosc.osc_bundle_builder import OscBundleBuilder
+        from pythonosc.osc_message_builder import OscMessageBuilder
+        from pythonosc.parsing.osc_types import IMMEDIATELY
+        builder = OscBundleBuilder(IMMEDIATELY if timetag is None else timetag)
+        for path, args in messages:
+            message = OscMessageBuilder(path)
+            for a in args:
+                message.add_arg(a)
+            builder.add_content(message.build())
+        t0 = time.perf_counter_ns()
+        client.send(builder.build())
+        if self.metrics is not None:
+            ns = (time.perf_counter_ns() - t0) // len(messages)
+            for path, _ in messages:
+                self.metrics.sent(path, ns)
+        if self.recording:
+            for path, args in messages:
+                self.log(path, *args)
+
     """
     misc methods
     """
     def cleanup(self):
         print('MRP exiting...')
         self.all_notes_off()
+        if self.recording:
+            self.record_stop()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
 
     def print(self, *a, **kw):
         """verbose debug printing"""
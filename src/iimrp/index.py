@@ -0,0 +1,196 @@
+'''
+Sidecar time index for MRP recordings.
+
+One streaming pass over a recording stores, every `interval` seconds, the record
+number, the byte offset of the line in a text log, and a snapshot of the full
+note, quality, pedal, UI and voice state (see `state.py`). The index is saved next
+to the recording as `<recording>.idx.npz` and rebuilt when the recording is newer.
+
+With the index, a range query or the state at any time is a binary search over the
+snapshot times, a seek, and a replay of at most `interval` seconds of records.
+
+Example
+    index = load_index('session.log')
+    state = index.state_at(47 * 60)
+    batch = index.read_range(47 * 60, 48 * 60)
+'''
+
+import os
+import numpy as np
+
+from .recording import open_log, parse_log_line, parse_log_lines, load_recording, empty_batch, MAX_VECTOR
+from .state import MRPState
+
+INDEX_SUFFIX = '.idx.npz'
+
+def index_file(file:str) -> str:
+    """Return the sidecar index path of a recording."""
+    return file.rstrip('/') + INDEX_SUFFIX
+
+def is_text_log(file:str) -> bool:
+    return not (os.path.isdir(file) or file.endswith(('.npz', '.parquet')))
+
+class MRPLogIndex:
+    """
+    Snapshot index of a recording.
+
+    Attributes
+        file (str): the indexed recording
+        interval (float): seconds between snapshots
+        times (np.ndarray): (K,) time of the first record after each snapshot (-inf for the first)
+        records (np.ndarray): (K,) record number of that record
+        offsets (np.ndarray): (K,) byte offset of that record's line, -1 for binary recordings
+        n_records (int): records in the recording
+        duration (float): time of the last record
+    """
+    def __init__(self, file:str, interval:float, times, records, offsets, snapshots:dict, n_records:int, duration:float) -> None:
+        self.file = file
+        self.interval = interval
+        self.times = np.asarray(times)
+        self.records = np.asarray(records)
+        self.offsets = np.asarray(offsets)
+        self.snapshots = snapshots
+        self.n_records = n_records
+        self.duration = duration
+        self._log = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @classmethod
+    def build(cls, file:str, interval:float=10.0) -> 'MRPLogIndex':
+        """
+        Build the index of a recording in a single streaming pass.
+        """
+        state = MRPState()
+        snaps = []
+        times, records, offsets = [], [], []
+        def snapshot(t, i, offset):
+            times.append(t); records.append(i); offsets.append(offset)
+            snaps.append(state.pack())
+        snapshot(-np.inf, 0, 0 if is_text_log(file) else -1)
+        next_t = interval
+        n, t = 0, 0.0
+        for t, path, args, offset in _iter_with_offsets(file):
+            if t >= next_t:
+                snapshot(t, n, offset)
+                next_t = (t // interval + 1) * interval
+            state.apply(path, *args)
+            n += 1
+        return cls(file, interval, times, records, offsets, _stack_snapshots(snaps), n, float(t))
+
+    def save(self, file:str=None):
+        """Save the index, by default next to the recording."""
+        file = file or index_file(self.file)
+        np.savez_compressed(file, interval=self.interval, times=self.times, records=self.records,
+            offsets=self.offsets, n_records=self.n_records, duration=self.duration, **self.snapshots)
+
+    @classmethod
+    def load(cls, file:str, index:str=None) -> 'MRPLogIndex':
+        """Load the saved index of a recording."""
+        with np.load(index or index_file(file)) as z:
+            snapshots = {k: z[k] for k in z.files if k not in ('interval', 'times', 'records', 'offsets', 'n_records', 'duration')}
+            return cls(file, float(z['interval']), z['times'], z['records'], z['offsets'], snapshots, int(z['n_records']), float(z['duration']))
+
+    def snapshot(self, k:int) -> MRPState:
+        """Return snapshot k as an MRPState."""
+        s = self.snapshots
+        arrays = {name: s[name][k] for name in ('on', 'velocity', 'channel', 'qualities', 'n_harmonics', 'order', 'pedal', 'ui')}
+        harmonics = np.zeros((128, s['harmonics_values'].shape[1]))
+        lo, hi = s['harmonics_start'][k], s['harmonics_start'][k + 1]
+        harmonics[s['harmonics_note'][lo:hi]] = s['harmonics_values'][lo:hi]
+        arrays['harmonics'] = harmonics
+        return MRPState.unpack(arrays)
+
+    def checkpoints(self) -> list:
+        """Return (record number, state) for each snapshot, e.g. for `MRPReplay`."""
+        return [(int(self.records[k]), self.snapshot(k)) for k in range(len(self))]
+
+    def find(self, t:float) -> int:
+        """Return the last snapshot taken no later than time t."""
+        return int(np.searchsorted(self.times, t, side='right')) - 1
+
+    def state_at(self, t:float) -> MRPState:
+        """
+        Return the state just before time t: the nearest snapshot plus the records since.
+        """
+        k = self.find(t)
+        state = self.snapshot(k)
+        for rt, path, args in self._iter_from(k):
+            if rt >= t: break
+            state.apply(path, *args)
+        return state
+
+    def read_range(self, t0:float, t1:float, H:int=MAX_VECTOR):
+        """
+        Return the records with t0 <= time < t1 as a LogBatch.
+        """
+        k = self.find(t0)
+        if not is_text_log(self.file):
+            log = self._binary()
+            times = np.asarray(log['time'])
+            return log.select(slice(np.searchsorted(times, t0), np.searchsorted(times, t1)))
+        lines = []
+        with open_log(self.file, 'rb') as f:
+            f.seek(int(self.offsets[k]))
+            for line in f:
+                t = float(line.split(None, 1)[0]) if line.strip() else None
+                if t is None or t < t0: continue
+                if t >= t1: break
+                lines.append(line.decode())
+        return parse_log_lines(lines, H=H) if lines else empty_batch(H)
+
+    def _binary(self):
+        if self._log is None:
+            self._log = load_recording(self.file)
+        return self._log
+
+    def _iter_from(self, k:int):
+        if not is_text_log(self.file):
+            log = self._binary()
+            yield from log.select(slice(int(self.records[k]), None)).messages()
+            return
+        with open_log(self.file, 'rb') as f:
+            f.seek(int(self.offsets[k]))
+            for line in f:
+                if line.strip():
+                    yield parse_log_line(line.decode())
+
+def _iter_with_offsets(file:str):
+    if not is_text_log(file):
+        for t, path, args in load_recording(file).messages():
+            yield t, path, args, -1
+        return
+    offset = 0
+    with open_log(file, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield (*parse_log_line(line.decode()), offset)
+            offset += len(line)
+
+def _stack_snapshots(snaps:list) -> dict:
+    """Stack packed states, storing raw harmonics only for notes that have them."""
+    stacked = {k: np.stack([s[k] for s in snaps]) for k in snaps[0] if k != 'harmonics'}
+    notes = [np.flatnonzero(s['n_harmonics']) for s in snaps]
+    stacked['harmonics_start'] = np.concatenate([[0], np.cumsum([len(n) for n in notes])])
+    stacked['harmonics_note'] = np.concatenate(notes).astype(np.int16)
+    stacked['harmonics_values'] = np.concatenate([s['harmonics'][n] for s, n in zip(snaps, notes)])
+    return stacked
+
+def load_index(file:str, interval:float=10.0, build:bool=True) -> MRPLogIndex:
+    """
+    Load the sidecar index of a recording, building and saving it if it is missing or stale.
+
+    Args
+        file (str): the recording
+        interval (float): seconds between snapshots when building
+        build (bool): build a missing or stale index, otherwise raise FileNotFoundError
+    """
+    idx = index_file(file)
+    if os.path.exists(idx) and os.path.getmtime(idx) >= os.path.getmtime(file):
+        return MRPLogIndex.load(file, idx)
+    if not build:
+        raise FileNotFoundError(f"load_index(): no up to date index for {file}")
+    index = MRPLogIndex.build(file, interval)
+    index.save(idx)
+    return index
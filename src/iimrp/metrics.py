@@ -0,0 +1,246 @@
+'''
+Low-overhead instrumentation of the `MRP` client.
+
+`MRPMetrics` counts the messages sent per OSC path, times each `osc.send` call (the call
+to the socket write) and the note, quality and voice methods into latency histograms,
+and counts voice steals and invalid messages. Times are taken with the monotonic
+`time.perf_counter_ns`.
+
+Metrics are off by default and cost nothing then: the timed methods are only wrapped
+while metrics are on (see `instrument`), and the counters behind a `None` check.
+
+Example
+    mrp = MRP(osc, metrics=True)
+    ...
+    mrp.stats()['send']['/mrp/midi']['p99'] # seconds
+    mrp.metrics_on(export='/var/lib/node_exporter/mrp.prom') # Prometheus text file
+'''
+
+import os
+import time
+import bisect
+import threading
+
+# histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+# MRP methods timed while metrics are on
+METRICS_METHODS = ('note_on', 'note_off', 'set_note_quality', 'set_note_qualities', 'voices_add', 'voices_remove')
+METRICS_PREFIX = 'iimrp'
+
+class LatencyHistogram:
+    """
+    Histogram of durations in nanoseconds, with fixed buckets.
+
+    Args
+        buckets (tuple): bucket upper bounds in seconds
+    """
+    def __init__(self, buckets:tuple=LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self._bounds = [round(b * 1e9) for b in self.buckets]
+        self.counts = [0] * (len(self.buckets) + 1) # the last bucket is +Inf
+        self.count = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def observe(self, ns:int):
+        self.counts[bisect.bisect_left(self._bounds, ns)] += 1
+        self.count += 1
+        self.sum_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def quantile(self, q:float) -> float:
+        """Upper bound (s) of the bucket holding quantile q, the maximum for the +Inf bucket."""
+        if self.count == 0:
+            return 0.0
+        rank, total = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= rank:
+                return min(bound, self.max_ns * 1e-9)
+        return self.max_ns * 1e-9
+
+    def snapshot(self) -> dict:
+        """Count, sum, mean, max and p50/p90/p99 in seconds, and the bucket counts."""
+        return {
+            'count': self.count, 'sum': self.sum_ns * 1e-9,
+            'mean': self.sum_ns * 1e-9 / self.count if self.count else 0.0, 'max': self.max_ns * 1e-9,
+            'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+            'buckets': dict(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+class MRPMetrics:
+    """
+    Counters and latency histograms of an `MRP` instance. The dicts are updated and read
+    under a lock, so `snapshot` and `prometheus` can run in another thread (see
+    `PrometheusExporter`).
+
+    Attributes
+        messages (dict): messages sent per OSC path
+        send (dict): LatencyHistogram of osc.send per OSC path
+        methods (dict): LatencyHistogram per timed method (see `METRICS_METHODS`)
+        voice_steals (int): voices turned off to make room for a new note
+        voices_dropped (int): notes not given a voice because all were in use
+        invalid (dict): invalid messages by kind ('note_on', 'note_off', 'quality') and reason
+    """
+    def __init__(self, buckets:tuple=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            self.messages = {}
+            self.send = {}
+            self.methods = {}
+            self.voice_steals = 0
+            self.voices_dropped = 0
+            self.invalid = {}
+
+    def sent(self, path:str, ns:int):
+        """Count a message sent to path, whose osc.send call took ns nanoseconds."""
+        with self._lock:
+            self.messages[path] = self.messages.get(path, 0) + 1
+            histogram = self.send.get(path)
+            if histogram is None:
+                histogram = self.send[path] = LatencyHistogram(self.buckets)
+            histogram.observe(ns)
+
+    def timed(self, method:str, ns:int):
+        with self._lock:
+            histogram = self.methods.get(method)
+            if histogram is None:
+                histogram = self.methods[method] = LatencyHistogram(self.buckets)
+            histogram.observe(ns)
+
+    def count_invalid(self, kind:str, reason:str):
+        key = (kind, reason)
+        with self._lock:
+            self.invalid[key] = self.invalid.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        """Return the metrics as plain dicts (see `MRP.stats`)."""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> dict:
+        return {
+            'uptime': time.time() - self.start_time,
+            'messages': dict(self.messages),
+            'messages_total': sum(self.messages.values()),
+            'send': {p: h.snapshot() for p, h in self.send.items()},
+            'methods': {m: h.snapshot() for m, h in self.methods.items()},
+            'voice_steals': self.voice_steals,
+            'voices_dropped': self.voices_dropped,
+            'invalid': {f'{kind}/{reason}': n for (kind, reason), n in self.invalid.items()},
+            'invalid_total': sum(self.invalid.values()),
+        }
+
+    def prometheus(self, gauges:dict=None) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format.
+
+        Args
+            gauges (dict): extra gauge values by name, e.g. {'voices': 3}
+        """
+        with self._lock:
+            return self._prometheus(gauges)
+
+    def _prometheus(self, gauges:dict) -> str:
+        p = METRICS_PREFIX
+        lines = [f'# HELP {p}_messages_total OSC messages sent, by path',
+                 f'# TYPE {p}_messages_total counter']
+        lines += [f'{p}_messages_total{{path="{path}"}} {n}' for path, n in sorted(self.messages.items())]
+        lines += _histogram_lines(f'{p}_send_seconds', 'Duration of osc.send calls, by path', 'path', self.send)
+        lines += _histogram_lines(f'{p}_method_seconds', 'Duration of MRP method calls, by method', 'method', self.methods)
+        lines += [f'# HELP {p}_voice_steals_total Voices turned off to make room for a new note',
+                  f'# TYPE {p}_voice_steals_total counter', f'{p}_voice_steals_total {self.voice_steals}',
+                  f'# HELP {p}_voices_dropped_total Notes not given a voice',
+                  f'# TYPE {p}_voices_dropped_total counter', f'{p}_voices_dropped_total {self.voices_dropped}',
+                  f'# HELP {p}_invalid_messages_total Invalid messages not sent, by kind and reason',
+                  f'# TYPE {p}_invalid_messages_total counter']
+        lines += [f'{p}_invalid_messages_total{{kind="{kind}",reason="{reason}"}} {n}'
+                  for (kind, reason), n in sorted(self.invalid.items())]
+        for name, value in (gauges or {}).items():
+            lines += [f'# TYPE {p}_{name} gauge', f'{p}_{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file:str, gauges:dict=None):
+        """Write `prometheus` to file atomically, e.g. for the node_exporter textfile collector."""
+        tmp = f'{file}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus(gauges))
+        os.replace(tmp, file)
+
+def _histogram_lines(name:str, help:str, label:str, histograms:dict) -> list:
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    for key, h in sorted(histograms.items()):
+        total = 0
+        for bound, n in zip(h.buckets + (float('inf'),), h.counts):
+            total += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{label}="{key}",le="{le}"}} {total}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {h.sum_ns * 1e-9!r}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {h.count}')
+    return lines
+
+def instrument(mrp, metrics:MRPMetrics):
+    """
+    Time the `METRICS_METHODS` of an MRP instance, by binding timed wrappers on the instance.
+    """
+    for name in METRICS_METHODS:
+        method = getattr(type(mrp), name).__get__(mrp)
+        setattr(mrp, name, _timed(method, name, metrics))
+
+def uninstrument(mrp):
+    """Remove the wrappers bound by `instrument`."""
+    for name in METRICS_METHODS:
+        mrp.__dict__.pop(name, None)
+
+def _timed(method, name:str, metrics:MRPMetrics):
+    def timed(*args, **kwargs):
+        t0 = time.perf_counter_ns()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.timed(name, time.perf_counter_ns() - t0)
+    timed.__wrapped__ = method
+    timed.__doc__ = method.__doc__
+    return timed
+
+class PrometheusExporter:
+    """
+    Background thread writing the metrics of an MRP instance to a Prometheus text file.
+
+    Args
+        mrp (MRP): instance with metrics on
+        file (str): output file
+        interval (float): seconds between writes
+    """
+    def __init__(self, mrp, file:str, interval:float=5.0) -> None:
+        self.mrp = mrp
+        self.file = file
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'PrometheusExporter':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread, writing the file a last time."""
+        self._stop.set()
+        self._thread.join()
+
+    def write(self):
+        metrics = self.mrp.metrics
+        if metrics is not None:
+            metrics.write_prometheus(self.file, {'voices': len(self.mrp.voices)})
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+        self.write()
@@ -0,0 +1,352 @@
+'''
+Conversion between Standard MIDI Files and MRP recordings, on whole arrays.
+
+MIDI files are parsed straight from their bytes into arrays of (tick, status, data)
+events, without building a message object per event, and tick times are converted to
+seconds through the tempo map with `searchsorted`. Mapping to MRP messages is then
+vectorized:
+- note on / note off become /mrp/midi on the MRP channel
+- polyphonic aftertouch sets a quality of its note (`aftertouch`, default intensity)
+- control changes in `QUALITY_CC`, channel pressure (`aftertouch`) and pitch bend (`bend`)
+  set a quality of every note held on their channel, and of notes started after them
+- control changes in `PEDAL_CC` become /mrp/pedal messages
+
+The reverse direction writes the MIDI track bytes, including the variable-length delta
+times, with NumPy.
+
+Example
+    batch = midi_to_mrp('prelude.mid')
+    write_log(batch, 'prelude.log')
+    mrp_to_midi('iimrp-recording.log', 'recording.mid')
+'''
+
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .recording import LogBatch, MRP_PATHS, MAX_VECTOR, load_recording, write_log
+
+QUALITY_CC = {1: 'intensity', 74: 'brightness', 71: 'harmonic'} # modulation wheel, cutoff, resonance
+PEDAL_CC = {64: 'damper', 66: 'sostenuto'}
+ALL_NOTES_OFF_CC = 123
+DEFAULT_TEMPO = 500000 # microseconds per beat (120 bpm)
+
+MIDI_DTYPE = np.dtype([
+    ('time', 'f8'),
+    ('tick', 'i8'),
+    ('track', 'i2'),
+    ('status', 'u1'),
+    ('data1', 'u1'),
+    ('data2', 'u1'),
+])
+
+"""
+reading
+"""
+def _read_vlq(data:bytes, pos:int) -> tuple[int, int]:
+    value = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if b < 0x80:
+            return value, pos
+
+def _parse_track(data:bytes, tempos:list) -> tuple[list, list, list, list]:
+    ticks, status, data1, data2 = [], [], [], []
+    pos, tick, running, n = 0, 0, 0, len(data)
+    while pos < n:
+        delta, pos = _read_vlq(data, pos)
+        tick += delta
+        b = data[pos]
+        if b == 0xFF: # meta event
+            kind = data[pos + 1]
+            length, pos = _read_vlq(data, pos + 2)
+            if kind == 0x51:
+                tempos.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+            elif kind == 0x2F:
+                break
+            pos += length
+            continue
+        if b == 0xF0 or b == 0xF7: # sysex
+            length, pos = _read_vlq(data, pos + 1)
+            pos += length
+            continue
+        if b & 0x80:
+            running = b
+            pos += 1
+        ticks.append(tick)
+        status.append(running)
+        if running & 0xE0 == 0xC0: # program change, channel pressure
+            data1.append(data[pos])
+            data2.append(0)
+            pos += 1
+        else:
+            data1.append(data[pos])
+            data2.append(data[pos + 1])
+            pos += 2
+    return ticks, status, data1, data2
+
+def ticks_to_seconds(ticks:np.ndarray, division:int, tempos:list=()) -> np.ndarray:
+    """
+    Convert MIDI ticks to seconds.
+
+    Args
+        ticks (np.ndarray): tick times
+        division (int): the header's time division (ticks per beat, or SMPTE if negative)
+        tempos (list): (tick, microseconds per beat) tempo changes
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    if division < 0: # SMPTE: -frames per second, ticks per frame
+        fps = -(division >> 8)
+        fps = 29.97 if fps == 29 else fps
+        return ticks / (fps * (division & 0xFF))
+    changes = sorted(dict([(0, DEFAULT_TEMPO)] + list(tempos)).items())
+    change_ticks = np.array([c[0] for c in changes], dtype=np.int64)
+    change_tempo = np.array([c[1] for c in changes], dtype=float) / 1e6 / division
+    change_seconds = np.concatenate([[0], np.cumsum(np.diff(change_ticks) * change_tempo[:-1])])
+    k = np.searchsorted(change_ticks, ticks, side='right') - 1
+    return change_seconds[k] + (ticks - change_ticks[k]) * change_tempo[k]
+
+def read_midi(file:str) -> tuple[np.ndarray, int]:
+    """
+    Read the channel messages of a Standard MIDI File.
+
+    Args
+        file (str): path to a .mid file
+
+    Returns
+        np.ndarray: events with MIDI_DTYPE, all tracks merged in time order
+        int: ticks per beat (the header's time division)
+    """
+    with open(file, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError(f"read_midi(): {file} is not a MIDI file")
+    header_length, _, n_tracks, division = struct.unpack('>IHHh', data[4:14])
+    pos = 8 + header_length
+    tracks, tempos = [], []
+    while pos + 8 <= len(data) and len(tracks) < n_tracks:
+        kind, length = struct.unpack('>4sI', data[pos:pos + 8])
+        if kind == b'MTrk':
+            tracks.append(_parse_track(data[pos + 8:pos + 8 + length], tempos))
+        pos += 8 + length
+    events = np.empty(sum(len(t[0]) for t in tracks), dtype=MIDI_DTYPE)
+    i = 0
+    for track, (ticks, status, data1, data2) in enumerate(tracks):
+        j = i + len(ticks)
+        events['tick'][i:j] = ticks
+        events['track'][i:j] = track
+        events['status'][i:j] = status
+        events['data1'][i:j] = data1
+        events['data2'][i:j] = data2
+        i = j
+    events = events[np.argsort(events['tick'], kind='stable')]
+    events['time'] = ticks_to_seconds(events['tick'], division, tempos)
+    return events, division
+
+def midi_to_mrp(file:str, channel:int=15, cc:dict=QUALITY_CC, pedals:dict=PEDAL_CC,
+                aftertouch:str='intensity', bend:str='pitch', H:int=MAX_VECTOR) -> LogBatch:
+    """
+    Convert a MIDI file to MRP messages.
+
+    Args
+        file (str): path to a .mid file
+        channel (int): MRP real-time note channel (0-indexed) all notes are sent on
+        cc (dict): control change number to quality, applied to the notes held on its channel
+        pedals (dict): control change number to /mrp/pedal name
+        aftertouch (str): quality set by aftertouch, None to ignore aftertouch
+        bend (str): quality set by pitch bend (-1 to 1), None to ignore pitch bend
+        H (int): length of vector arguments of the returned batch
+
+    Returns
+        LogBatch: the MRP messages, in time order
+    """
+    events, _ = read_midi(file)
+    kind, midi_channel = events['status'] & 0xF0, events['status'] & 0x0F
+    d1, d2 = events['data1'].astype(np.int64), events['data2'].astype(np.int64)
+    time, pos = events['time'], np.arange(len(events), dtype=float)
+    paths = list(MRP_PATHS)
+    out = []
+    def emit(mask, path, status, note, value, offset=0.0):
+        if path not in paths: paths.append(path)
+        n = np.count_nonzero(mask) if mask.dtype == bool else len(mask)
+        out.append((pos[mask] + offset, time[mask], np.full(n, paths.index(path)),
+            np.broadcast_to(status, n), np.broadcast_to(note, n), np.broadcast_to(value, n)))
+
+    # notes
+    note_on = (kind == 0x90) & (d2 > 0)
+    is_note = note_on | (kind == 0x80) | (kind == 0x90)
+    emit(is_note, '/mrp/midi', np.where(note_on, 0x90, 0x80)[is_note] | channel, d1[is_note], np.where(note_on, d2, 0)[is_note])
+    # per-note aftertouch
+    if aftertouch:
+        m = kind == 0xA0
+        emit(m, f"/mrp/quality/{aftertouch.replace('_', '/')}", channel, d1[m], d2[m] / 127)
+    # pedals
+    for number, pedal in pedals.items():
+        m = (kind == 0xB0) & (d1 == number)
+        emit(m, f'/mrp/pedal/{pedal}', -1, -1, d2[m] / 127)
+    # channel controllers, applied to held notes
+    controllers = [((kind == 0xB0) & (d1 == number), d2 / 127, quality) for number, quality in cc.items()]
+    if aftertouch:
+        controllers.append((kind == 0xD0, d1 / 127, aftertouch))
+    if bend:
+        controllers.append((kind == 0xE0, ((d2 << 7 | d1) - 8192) / 8192, bend))
+    note_keys = midi_channel * 128 + d1
+    for mask, values, quality in controllers:
+        if not mask.any(): continue
+        path = f"/mrp/quality/{quality.replace('_', '/')}"
+        for c in np.unique(midi_channel[mask]):
+            ctrl = np.flatnonzero(mask & (midi_channel == c))
+            on_c = np.flatnonzero(note_on & (midi_channel == c))
+            # notes started after a controller inherit its last value
+            k = np.searchsorted(ctrl, on_c) - 1
+            emit(on_c[k >= 0], path, channel, d1[on_c[k >= 0]], values[ctrl[k[k >= 0]]], offset=0.5)
+            # notes held when the controller changes
+            for key in np.unique(note_keys[is_note & (midi_channel == c)]):
+                notes = np.flatnonzero(is_note & (note_keys == key))
+                k = np.searchsorted(notes, ctrl) - 1
+                held = (k >= 0) & note_on[notes[np.maximum(k, 0)]]
+                emit(ctrl[held], path, channel, key % 128, values[ctrl[held]])
+
+    order = np.argsort(np.concatenate([o[0] for o in out]), kind='stable')
+    columns = {
+        'time': np.concatenate([o[1] for o in out])[order],
+        'path': np.concatenate([o[2] for o in out]).astype(np.uint16)[order],
+        'channel': np.concatenate([o[3] for o in out]).astype(np.int16)[order],
+        'note': np.concatenate([o[4] for o in out]).astype(np.int16)[order],
+        'value': np.concatenate([o[5] for o in out]).astype(float)[order],
+    }
+    columns['vector'] = np.full(len(order), -1, dtype=np.int32)
+    return LogBatch(columns, np.empty((0, H), dtype=np.float32), paths)
+
+def midi_to_log(file:str, out_file:str=None, **kwargs) -> str:
+    """
+    Convert a MIDI file to an MRP .log file (see `midi_to_mrp`), returning the path written.
+    """
+    out_file = out_file or os.path.splitext(file)[0] + '.log'
+    write_log(midi_to_mrp(file, **kwargs), out_file)
+    return out_file
+
+def midi_files_to_logs(files:list, out_dir:str=None, workers:int=None, **kwargs) -> list[str]:
+    """
+    Convert many MIDI files to MRP .log files in a process pool.
+
+    Args
+        files (list): paths to .mid files
+        out_dir (str): directory of the .log files, defaults to next to each MIDI file
+        workers (int): number of processes, defaults to the number of CPUs
+        **kwargs: passed to `midi_to_mrp`
+
+    Returns
+        list: paths of the written .log files
+    """
+    out_files = [os.path.join(out_dir, os.path.splitext(os.path.basename(f))[0] + '.log') if out_dir else None for f in files]
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        return [midi_to_log(f, o, **kwargs) for f, o in zip(files, out_files)]
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(midi_to_log, f, o, **kwargs) for f, o in zip(files, out_files)]
+        return [f.result() for f in futures]
+
+"""
+writing
+"""
+def encode_vlq(values:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode non-negative integers (< 2**28) as MIDI variable-length quantities.
+
+    Returns
+        np.ndarray: (N, 4) uint8, each row's bytes left-aligned
+        np.ndarray: (N,) number of bytes of each value
+    """
+    values = np.asarray(values, dtype=np.int64)
+    lengths = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    encoded = np.zeros((len(values), 4), dtype=np.uint8)
+    for j in range(4):
+        shift = 7 * (lengths - 1 - j)
+        byte = (values >> np.maximum(shift, 0)) & 0x7F
+        encoded[:, j] = np.where(j < lengths, byte | np.where(j < lengths - 1, 0x80, 0), 0)
+    return encoded, lengths
+
+def write_midi(file:str, ticks:np.ndarray, status:np.ndarray, data1:np.ndarray, data2:np.ndarray,
+               ticks_per_beat:int=480, tempo:int=DEFAULT_TEMPO):
+    """
+    Write channel messages to a single-track MIDI file.
+
+    Args
+        file (str): output .mid path
+        ticks (np.ndarray): absolute tick time of each message, in order
+        status (np.ndarray): status bytes (3-byte channel messages)
+        data1, data2 (np.ndarray): data bytes, clipped to 0-127
+        ticks_per_beat (int): time division
+        tempo (int): microseconds per beat
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    delta, lengths = encode_vlq(np.diff(ticks, prepend=0))
+    size = lengths + 3
+    starts = np.concatenate([[0], np.cumsum(size)[:-1]])
+    body = np.zeros(int(size.sum()), dtype=np.uint8)
+    for j in range(4):
+        m = lengths > j
+        body[starts[m] + j] = delta[m, j]
+    body[starts + lengths] = status
+    body[starts + lengths + 1] = np.clip(data1, 0, 127)
+    body[starts + lengths + 2] = np.clip(data2, 0, 127)
+    track = b'\x00\xff\x51\x03' + int(tempo).to_bytes(3, 'big') + body.tobytes() + b'\x00\xff\x2f\x00'
+    with open(file, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, ticks_per_beat))
+        f.write(b'MTrk' + struct.pack('>I', len(track)) + track)
+
+def mrp_to_midi(recording, file:str, ticks_per_beat:int=480, tempo:int=DEFAULT_TEMPO,
+                cc:dict=QUALITY_CC, pedals:dict=PEDAL_CC, aftertouch:str='intensity') -> str:
+    """
+    Convert an MRP recording to a MIDI file.
+
+    Notes keep the MIDI channel of their /mrp/midi status byte. The `aftertouch` quality becomes
+    polyphonic aftertouch, other qualities in `cc` become control changes on the note's channel
+    (losing the note), pedals become control changes and /mrp/allnotesoff becomes All Notes Off.
+
+    Args
+        recording (str | LogBatch): recording (see `recording.load_recording`)
+        file (str): output .mid path
+        ticks_per_beat (int): time division
+        tempo (int): microseconds per beat
+        cc (dict): control change number to quality
+        pedals (dict): control change number to /mrp/pedal name
+        aftertouch (str): quality written as polyphonic aftertouch, None to write it with `cc`
+
+    Returns
+        str: the written path
+    """
+    batch = load_recording(recording) if isinstance(recording, str) else recording
+    order = np.argsort(batch['time'], kind='stable')
+    time, path = np.asarray(batch['time'])[order], np.asarray(batch['path'])[order]
+    channel = np.asarray(batch['channel'])[order].astype(np.int64)
+    note = np.asarray(batch['note'])[order].astype(np.int64)
+    value = np.nan_to_num(np.asarray(batch['value'])[order])
+    status = np.full(len(time), -1, dtype=np.int64)
+    data1, data2 = np.zeros_like(status), np.zeros_like(status)
+    def assign(mask, *columns):
+        for out, column in zip((status, data1, data2), columns):
+            out[mask] = np.broadcast_to(column, out.shape)[mask]
+
+    midi = path == batch.path_id('/mrp/midi')
+    assign(midi & (channel >= 0x80), channel, note, np.rint(value).astype(np.int64))
+    qualities = {q: n for n, q in cc.items()}
+    if aftertouch:
+        qualities.pop(aftertouch, None)
+        q = path == batch.path_id(f"/mrp/quality/{aftertouch.replace('_', '/')}")
+        assign(q, 0xA0 | (channel & 0x0F), note, np.rint(value * 127).astype(np.int64))
+    for quality, number in qualities.items():
+        q = path == batch.path_id(f"/mrp/quality/{quality.replace('_', '/')}")
+        assign(q, 0xB0 | (channel & 0x0F), number, np.rint(value * 127).astype(np.int64))
+    for number, pedal in pedals.items():
+        assign(path == batch.path_id(f'/mrp/pedal/{pedal}'), 0xBF, number, np.rint(value * 127).astype(np.int64))
+    assign(path == batch.path_id('/mrp/allnotesoff'), 0xBF, ALL_NOTES_OFF_CC, 0)
+
+    keep = status >= 0
+    ticks = np.rint(time[keep] * ticks_per_beat * 1e6 / tempo).astype(np.int64)
+    write_midi(file, ticks, status[keep], data1[keep], data2[keep], ticks_per_beat, tempo)
+    return file
@@ -0,0 +1,304 @@
+'''
+Compiled model of the MRP patch table (`mrp-standard.xml`).
+
+Each Patch's RealTimeQualities are compiled into vectorized transfer functions from
+the real-time qualities (intensity, brightness, pitch, harmonic) to the effective
+global amplitude and per-harmonic drive of the PLL synth. The functions operate on
+NumPy arrays, so the drive of every note in a performance can be estimated at once.
+
+The model follows the conventions of the XML file:
+- `value="a/b"` is the parameter at quality 0 and quality 1, `value="a"` is constant.
+- values with a `dB` suffix are levels, and are interpolated in dB.
+- `concavity` bends the curve between the two values (0 is linear).
+- `mode="exp"` interpolates geometrically, `mode="abs"` uses the magnitude of the quality.
+- dB-valued and constant contributions set a parameter, ranged unitless ones scale
+  (GlobalAmplitude, RelativeFrequency) or offset (HarmonicAmplitudes) it. Constants
+  equal to the identity (1 for scaling, 0 for offsets) leave it unchanged.
+
+HarmonicCentroid, UseHarmonicSweep and Vibrato are not modelled.
+'''
+
+import os
+import functools
+from importlib import resources
+import xml.etree.ElementTree as ET
+import numpy as np
+
+DEFAULT_PATCH_FILE = str(resources.files(__package__) / 'data' / 'mrp-standard.xml') # shipped as package data
+MAX_HARMONICS_RAW = 32 # harmonics accepted by /mrp/quality/harmonics/raw
+QUALITIES = ('intensity', 'brightness', 'pitch', 'harmonic')
+SCALING_PARAMETERS = ('GlobalAmplitude', 'RelativeFrequency')
+
+def db_to_amp(db):
+    """Convert decibels to linear amplitude."""
+    return 10.0 ** (np.asarray(db, dtype=float) / 20.0)
+
+def parse_range_value(value:str) -> tuple[float, float, bool]:
+    """Parse a parameter value of the form "a", "a/b", "adB" or "adB/bdB".
+
+    Args:
+        value (str): The `value` attribute of a Parameter.
+
+    Returns:
+        tuple[float, float, bool]: Value at quality 0, value at quality 1 and whether the values are in dB.
+    """
+    parts = value.strip().split('/')
+    db = any(p.strip().lower().endswith('db') for p in parts)
+    nums = [float(p.strip()[:-2] if p.strip().lower().endswith('db') else p) for p in parts]
+    lo = nums[0]
+    hi = nums[1] if len(nums) > 1 else nums[0]
+    return lo, hi, db
+
+def concave_curve(q:np.ndarray, concavity:float) -> np.ndarray:
+    """Bend a quality in [0, 1] with the MRP concavity convention.
+
+    Args:
+        q (np.ndarray): Quality values.
+        concavity (float): 0 for linear, negative for concave (fast rise), positive for convex.
+
+    Returns:
+        np.ndarray: Curved values, 0 at q=0 and 1 at q=1.
+    """
+    if concavity == 0:
+        return q
+    c = float(np.clip(concavity, -700, 700))
+    return np.expm1(c * q) / np.expm1(c)
+
+class MRPQualityParameter:
+    """
+    A single Parameter of a Quality, compiled to a transfer function of the quality value.
+    HarmonicAmplitudes parameters are vectors, every other parameter is a scalar.
+    """
+    def __init__(self, element:ET.Element, H:int=MAX_HARMONICS_RAW) -> None:
+        self.name = element.get('name')
+        self.concavity = float(element.get('concavity', 0))
+        self.mode = element.get('mode', 'lin')
+        values = [parse_range_value(v) for v in element.get('value', '0').split(',')]
+        self.lo = np.array([v[0] for v in values])
+        self.hi = np.array([v[1] for v in values])
+        self.db = values[0][2]
+        self.constant = bool(np.all(self.lo == self.hi))
+        self.vector = self.name == 'HarmonicAmplitudes'
+        if self.vector:
+            self.lo = np.pad(self.lo, (0, max(0, H - len(self.lo))))[:H]
+            self.hi = np.pad(self.hi, (0, max(0, H - len(self.hi))))[:H]
+        else:
+            self.lo, self.hi = self.lo[0], self.hi[0]
+
+    @property
+    def absolute(self) -> bool:
+        """Whether the parameter sets (rather than scales or offsets) its target."""
+        return self.db or self.constant
+
+    @property
+    def identity(self) -> bool:
+        """Whether the parameter leaves its target unchanged."""
+        identity = 1.0 if self.name in SCALING_PARAMETERS else 0.0
+        return not self.db and self.constant and bool(np.all(self.lo == identity))
+
+    def __call__(self, q) -> np.ndarray:
+        """Evaluate the parameter for an array of quality values.
+
+        Args:
+            q (np.ndarray): Quality values of shape (N,).
+
+        Returns:
+            np.ndarray: Shape (N,) for scalar parameters, (N, H) for HarmonicAmplitudes.
+        """
+        q = np.asarray(q, dtype=float)
+        if self.mode == 'abs':
+            q = np.abs(q)
+        x = np.sign(q) * concave_curve(np.abs(q), self.concavity)
+        if self.vector:
+            x = x[..., np.newaxis]
+        if self.db:
+            return db_to_amp(self.lo + (self.hi - self.lo) * x)
+        if self.mode == 'exp' and np.all(self.lo > 0):
+            return self.lo * (self.hi / self.lo) ** x
+        return self.lo + (self.hi - self.lo) * x
+
+    def __repr__(self) -> str:
+        return f"MRPQualityParameter({self.name}, {self.lo}/{self.hi}, db={self.db}, mode={self.mode}, concavity={self.concavity})"
+
+class MRPPatch:
+    """
+    A compiled Patch: the base PllSynth parameters plus the RealTimeQualities transfer functions.
+
+    Example
+        patch = load_patch_table().patch('mrp-standard')
+        amp, harmonics = patch.drive(intensity=np.linspace(0, 1, 88))
+    """
+    def __init__(self, element:ET.Element, H:int=MAX_HARMONICS_RAW) -> None:
+        self.name = element.get('name')
+        self.cls = element.get('class')
+        self.H = H
+        self.synth = {p.get('name'): MRPQualityParameter(p, H) for p in element.findall('./Synth/Parameter')}
+        self.synth.update({p.get('name'): MRPQualityParameter(p, H) for p in element.findall('./Parameter')})
+        self.qualities = {
+            q.get('name').lower(): [MRPQualityParameter(p, H) for p in q.findall('Parameter')]
+            for q in element.findall('./RealTimeQualities/Quality')
+        }
+
+    def _base(self, name:str, velocity, default):
+        if name in self.synth:
+            return self.synth[name](velocity)
+        return default
+
+    def amplitude(self, velocity=1.0, **qualities) -> np.ndarray:
+        """Effective global amplitude.
+
+        Args:
+            velocity (float | np.ndarray): Normalised note velocity in [0, 1].
+            **qualities: Quality values by name (intensity, brightness, pitch, harmonic), scalars or arrays.
+
+        Returns:
+            np.ndarray: Linear amplitude, broadcast over the inputs.
+        """
+        return self._combine('GlobalAmplitude', velocity, qualities, 1.0)
+
+    def relative_frequency(self, **qualities) -> np.ndarray:
+        """Effective frequency relative to the fundamental of the note."""
+        return self._combine('RelativeFrequency', 1.0, qualities, 1.0)
+
+    def harmonic_amplitudes(self, velocity=1.0, **qualities) -> np.ndarray:
+        """Effective relative amplitude of each harmonic, shape (..., H)."""
+        return np.maximum(self._combine('HarmonicAmplitudes', velocity, qualities, np.eye(1, self.H)[0]), 0)
+
+    def drive(self, velocity=1.0, harmonics_raw=None, **qualities) -> tuple[np.ndarray, np.ndarray]:
+        """Effective amplitude and per-harmonic drive.
+
+        Args:
+            velocity (float | np.ndarray): Normalised note velocity in [0, 1].
+            harmonics_raw (np.ndarray, optional): Raw harmonic amplitudes (N, <=H), overriding the patch harmonics.
+            **qualities: Quality values by name, scalars or arrays of shape (N,).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Amplitude (N,) and drive (N, H) = amplitude * harmonic amplitudes.
+        """
+        amp = self.amplitude(velocity, **qualities)
+        if harmonics_raw is not None:
+            harmonics_raw = np.atleast_2d(np.asarray(harmonics_raw, dtype=float))
+            harmonics = np.zeros(harmonics_raw.shape[:-1] + (self.H,))
+            harmonics[..., :harmonics_raw.shape[-1]] = harmonics_raw[..., :self.H]
+        else:
+            harmonics = self.harmonic_amplitudes(velocity, **qualities)
+        amp, harmonics = np.broadcast_arrays(np.atleast_1d(amp)[..., np.newaxis], harmonics)
+        return amp[..., 0], amp * harmonics
+
+    def _combine(self, name, velocity, qualities, default):
+        x = self._base(name, velocity, default)
+        for q in QUALITIES:
+            for p in self.qualities.get(q, []):
+                if p.name != name or p.identity: continue
+                y = p(qualities.get(q, 0.0))
+                if p.absolute:
+                    x = y
+                elif name in SCALING_PARAMETERS:
+                    x = x * y
+                else:
+                    x = x + y
+        return x
+
+    def __repr__(self) -> str:
+        return f"MRPPatch({self.name}, qualities={list(self.qualities)})"
+
+class MRPPatchTable:
+    """
+    All Patches and the Program table of an MRP XML file.
+    Use `load_patch_table` to get a cached instance.
+    """
+    def __init__(self, file:str=DEFAULT_PATCH_FILE, H:int=MAX_HARMONICS_RAW) -> None:
+        self.file = file
+        self.H = H
+        self.root = ET.parse(file).getroot()
+        self.patches = {p.get('name'): p for p in self.root.findall('Patch')}
+        self.programs = {}
+        for program in self.root.findall('./PatchTable/Program'):
+            channels = self.programs.setdefault(int(program.get('id')), {})
+            for channel in program.findall('Channel'):
+                r = channel.findtext('Range', '0-127').split('-')
+                channels.setdefault(int(channel.get('id')), []).append(
+                    (channel.findtext('Patch').strip(), (int(r[0]), int(r[-1]))))
+        self._compiled = {}
+
+    def patch(self, name:str) -> MRPPatch:
+        """Return the compiled patch `name`, compiling it on first use."""
+        if name not in self._compiled:
+            self._compiled[name] = MRPPatch(self.patches[name], self.H)
+        return self._compiled[name]
+
+    def drive(self, notes, program:int=0, channel:int=15, velocity=1.0, harmonics_raw=None, **qualities) -> tuple[np.ndarray, np.ndarray]:
+        """Effective amplitude and per-harmonic drive of notes under a program.
+
+        Notes outside every range of the program's channel get zero drive.
+
+        Example
+            amp, drive = table.drive([48, 60], intensity=[0.2, 0.9])
+
+        Args:
+            notes (np.ndarray): MIDI note numbers, shape (N,).
+            program (int): Program id (see `/ui/patch/set`).
+            channel (int): MIDI channel (0-indexed).
+            velocity (float | np.ndarray): Normalised note velocity.
+            harmonics_raw (np.ndarray, optional): Raw harmonic amplitudes (N, <=H).
+            **qualities: Quality values by name, scalars or arrays of shape (N,).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Amplitude (N,) and drive (N, H).
+        """
+        notes = np.atleast_1d(np.asarray(notes))
+        N = len(notes)
+        amp, drive = np.zeros(N), np.zeros((N, self.H))
+        for patch, mask in self._patch_masks(notes, program, channel):
+            qs = {q: _broadcast(v, N)[mask] for q, v in qualities.items()}
+            raw = None
+            if harmonics_raw is not None:
+                raw = np.atleast_2d(np.asarray(harmonics_raw, dtype=float))
+                raw = raw[mask] if len(raw) == N else raw
+            amp[mask], drive[mask] = patch.drive(_broadcast(velocity, N)[mask], raw, **qs)
+        return amp, drive
+
+    def relative_frequency(self, notes, program:int=0, channel:int=15, **qualities) -> np.ndarray:
+        """Effective frequency of notes relative to their fundamental under a program.
+
+        Args:
+            notes (np.ndarray): MIDI note numbers, shape (N,).
+            program (int): Program id.
+            channel (int): MIDI channel (0-indexed).
+            **qualities: Quality values by name, scalars or arrays of shape (N,).
+
+        Returns:
+            np.ndarray: Relative frequency (N,), 1 for notes outside the program.
+        """
+        notes = np.atleast_1d(np.asarray(notes))
+        N = len(notes)
+        freq = np.ones(N)
+        for patch, mask in self._patch_masks(notes, program, channel):
+            freq[mask] = patch.relative_frequency(**{q: _broadcast(v, N)[mask] for q, v in qualities.items()})
+        return freq
+
+    def _patch_masks(self, notes, program, channel):
+        for name, (lo, hi) in self.programs.get(program, {}).get(channel, []):
+            mask = (notes >= lo) & (notes <= hi)
+            if mask.any():
+                yield self.patch(name), mask
+
+def _broadcast(v, N):
+    return np.broadcast_to(np.asarray(v, dtype=float), (N,))
+
+@functools.lru_cache(maxsize=8)
+def _load_patch_table(file:str, mtime:float, H:int) -> MRPPatchTable:
+    return MRPPatchTable(file, H)
+
+def load_patch_table(file:str=DEFAULT_PATCH_FILE, H:int=MAX_HARMONICS_RAW) -> MRPPatchTable:
+    """Load an MRP patch table, cached per file until it is modified.
+
+    Args:
+        file (str, optional): Path to the XML file. Defaults to the `mrp-standard.xml` shipped with the package.
+        H (int, optional): Number of harmonics to model. Defaults to MAX_HARMONICS_RAW.
+
+    Returns:
+        MRPPatchTable: The parsed patch table.
+    """
+    file = os.path.abspath(file)
+    return _load_patch_table(file, os.path.getmtime(file), H)
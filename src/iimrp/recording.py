@@ -0,0 +1,534 @@
+'''
+Streaming reader for MRP recordings (`.log` files written by `MRP.record_start`).
+
+Each line of a recording is `time path [typetags args...]`, e.g.
+    0.50414 /mrp/midi iii 159 48 1
+    1.30600 /mrp/quality/harmonics/raw iifff 15 48 0.03 0.0 0.0
+
+Records are parsed into fixed-size chunks of typed NumPy records with the columns
+- time: seconds since the recording started
+- path: index into `paths` (the known MRP paths first, then any others in order of appearance)
+- channel: first integer argument (the MIDI status byte for /mrp/midi, the MIDI channel for qualities)
+- note: second integer argument (MIDI note number)
+- value: last scalar argument (velocity, quality or pedal value), NaN if there is none
+- vector: row of the batch's `vectors` array holding a list argument (harmonics/raw), -1 if there is none
+Vectors are padded with NaN to `H` values. Messages with no integer arguments
+(pedal, ui) have channel and note -1.
+
+Recordings can also be saved in a columnar binary format (`save_recording`):
+- a directory of one `.npy` per column plus `vectors.npy` and `paths.json`, read with mmap
+- a single compressed `.npz`
+- a single `.parquet` file, when pyarrow is installed
+Vectors of 'npy' and 'npz' recordings can be delta-encoded per note (`delta=True`).
+
+`MRPRecorder` writes text logs from a background thread (see `MRP.record_start`).
+Text logs may be compressed (.gz, .xz, .bz2), and are decompressed on the fly when read.
+'''
+
+import os
+import bz2
+import gzip
+import json
+import lzma
+import time
+import numbers
+import itertools
+import threading
+from collections import deque
+import numpy as np
+
+MAX_VECTOR = 32 # values in /mrp/quality/harmonics/raw
+
+VECTOR_PATH = '/mrp/quality/harmonics/raw'
+
+MRP_PATHS = (
+    '/mrp/midi',
+    '/mrp/quality/brightness',
+    '/mrp/quality/intensity',
+    '/mrp/quality/pitch',
+    '/mrp/quality/pitch/vibrato',
+    '/mrp/quality/harmonic',
+    '/mrp/quality/harmonics/raw',
+    '/mrp/pedal/damper',
+    '/mrp/pedal/sostenuto',
+    '/mrp/allnotesoff',
+    '/ui/volume',
+    '/ui/volume/raw',
+)
+
+LOG_DTYPE = np.dtype([
+    ('time', 'f8'),
+    ('path', 'u2'),
+    ('channel', 'i2'),
+    ('note', 'i2'),
+    ('value', 'f8'),
+    ('vector', 'i4'),
+])
+
+COMPRESSION = {'gzip': ('.gz', gzip.open), 'lzma': ('.xz', lzma.open), 'bz2': ('.bz2', bz2.open)}
+
+def open_log(file:str, mode:str='rt'):
+    """
+    Open a text log, transparently (de)compressing by extension (.gz, .xz, .bz2).
+    """
+    for ext, opener in COMPRESSION.values():
+        if file.endswith(ext):
+            return opener(file, mode)
+    return open(file, mode)
+
+class LogBatch:
+    """
+    A chunk of MRP log records, stored as columns.
+
+    Attributes
+        columns (dict): column name (see LOG_DTYPE) to 1D array
+        vectors (np.ndarray): (V, H) float32 list arguments, NaN-padded
+        paths (list): path strings indexed by the path column, shared by all batches of a file
+    """
+    def __init__(self, columns:dict, vectors:np.ndarray, paths:list) -> None:
+        self.columns = columns
+        self.vectors = vectors
+        self.paths = paths
+
+    def __len__(self) -> int:
+        return len(self.columns['time'])
+
+    def __getitem__(self, name:str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def records(self) -> np.ndarray:
+        """The batch as a structured array with LOG_DTYPE (a copy)."""
+        records = np.empty(len(self), dtype=LOG_DTYPE)
+        for name in LOG_DTYPE.names:
+            records[name] = self.columns[name]
+        return records
+
+    def select(self, index) -> 'LogBatch':
+        """Return the records selected by a mask, slice or index array, sharing vectors and paths."""
+        return LogBatch({k: v[index] for k, v in self.columns.items()}, self.vectors, self.paths)
+
+    def path_id(self, path:str) -> int:
+        """Return the id of a path, or -1 if it does not occur in the file."""
+        return self.paths.index(path) if path in self.paths else -1
+
+    def messages(self):
+        """
+        Yield (time, path, args) tuples, with args as they were written to the log.
+        Vectors are stored as float32, and rounded back to the 5 decimals of the log format.
+        """
+        midi = self.path_id('/mrp/midi')
+        cols = [self.columns[k].tolist() for k in LOG_DTYPE.names]
+        for t, p, channel, note, value, vector in zip(*cols):
+            if vector >= 0:
+                v = self.vectors[vector]
+                args = (channel, note) + tuple(np.round(v[~np.isnan(v)].astype(float), 5).tolist())
+            elif channel < 0:
+                args = () if value != value else (value,)
+            elif p == midi:
+                args = (channel, note, int(value))
+            else:
+                args = (channel, note, value)
+            yield t, self.paths[p], args
+
+def parse_log_line(line:str) -> tuple[float, str, tuple]:
+    """
+    Parse a line of an MRP recording into (time, path, args), typed by the type tag.
+    """
+    parts = line.split()
+    if len(parts) < 3 or not parts[2].isalpha():
+        return float(parts[0]), parts[1], ()
+    cast = {'i': int, 'f': float}
+    args = tuple(cast.get(tag, str)(v) for tag, v in zip(parts[2], parts[3:]))
+    return float(parts[0]), parts[1], args
+
+def parse_log_lines(lines:list, paths:list=None, H:int=MAX_VECTOR) -> LogBatch:
+    """
+    Parse lines of an MRP recording into a LogBatch.
+
+    Args
+        lines (list): lines of the log
+        paths (list): path table to extend, shared across the batches of a file
+        H (int): length of vector arguments
+
+    Returns
+        LogBatch: parsed records
+    """
+    if paths is None:
+        paths = list(MRP_PATHS)
+    path_ids = {p: i for i, p in enumerate(paths)}
+    n = len(lines)
+    time = np.empty(n)
+    path = np.empty(n, dtype=np.uint16)
+    channel = np.full(n, -1, dtype=np.int16)
+    note = np.full(n, -1, dtype=np.int16)
+    value = np.full(n, np.nan)
+    vector = np.full(n, -1, dtype=np.int32)
+    vectors = []
+    i = 0
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 2: continue
+        p = parts[1]
+        if p not in path_ids:
+            path_ids[p] = len(paths)
+            paths.append(p)
+        time[i] = float(parts[0])
+        path[i] = path_ids[p]
+        if len(parts) > 3:
+            tags, args = parts[2], parts[3:]
+            ints = tags.count('i')
+            if ints >= 1: channel[i] = int(args[0])
+            if ints >= 2: note[i] = int(args[1])
+            rest = args[min(ints, 2):]
+            if len(rest) > 1 or p == VECTOR_PATH:
+                vector[i] = len(vectors)
+                vectors.append(rest[:H])
+            elif len(rest) == 1:
+                value[i] = float(rest[0])
+        i += 1
+    columns = dict(zip(LOG_DTYPE.names, (time[:i], path[:i], channel[:i], note[:i], value[:i], vector[:i])))
+    vec = np.full((len(vectors), H), np.nan, dtype=np.float32)
+    for j, v in enumerate(vectors):
+        vec[j, :len(v)] = np.array(v, dtype=np.float32)
+    return LogBatch(columns, vec, paths)
+
+def iter_log(file, chunk_size:int=65536, H:int=MAX_VECTOR):
+    """
+    Stream an MRP recording as LogBatches of at most chunk_size records, in constant memory.
+
+    Example
+        for batch in iter_log('iimrp-recording.log'):
+            notes_on = batch.records[batch.records['channel'] == 159]['note']
+
+    Args
+        file (str | file): path or open text file
+        chunk_size (int): records per batch
+        H (int): length of vector arguments
+    """
+    f = open_log(file) if isinstance(file, str) else file
+    paths = list(MRP_PATHS)
+    try:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines: break
+            yield parse_log_lines(lines, paths, H)
+    finally:
+        if f is not file: f.close()
+
+def iter_log_messages(file):
+    """
+    Stream an MRP recording as (time, path, args) tuples.
+    """
+    f = open_log(file) if isinstance(file, str) else file
+    try:
+        for line in f:
+            if line.strip():
+                yield parse_log_line(line)
+    finally:
+        if f is not file: f.close()
+
+def concat_batches(batches:list, time_offsets=None) -> LogBatch:
+    """
+    Concatenate LogBatches into one, re-indexing their vectors, and their paths
+    if the batches come from files with different path tables.
+
+    Args
+        batches (list): LogBatches
+        time_offsets (list): optional time offset added to each batch
+    """
+    lengths = [len(b) for b in batches]
+    paths = batches[-1].paths
+    if any(b.paths is not paths and b.paths != paths for b in batches):
+        paths = list(dict.fromkeys(p for b in batches for p in b.paths))
+    columns = {name: np.concatenate([b[name] for b in batches]) for name in LOG_DTYPE.names}
+    vector_offsets = np.cumsum([0] + [len(b.vectors) for b in batches[:-1]])
+    vector = columns['vector']
+    vector += np.where(vector >= 0, np.repeat(vector_offsets, lengths), 0).astype(vector.dtype)
+    if paths is not batches[-1].paths:
+        lookup = np.concatenate([np.array([paths.index(p) for p in b.paths], dtype=columns['path'].dtype) for b in batches])
+        starts = np.cumsum([0] + [len(b.paths) for b in batches[:-1]])
+        columns['path'] = lookup[columns['path'] + np.repeat(starts, lengths)]
+    if time_offsets is not None:
+        columns['time'] += np.repeat(np.asarray(time_offsets, dtype=float), lengths)
+    return LogBatch(columns, np.concatenate([b.vectors for b in batches]), paths)
+
+def empty_batch(H:int=MAX_VECTOR) -> LogBatch:
+    """Return a LogBatch with no records."""
+    columns = {name: np.empty(0, dtype=LOG_DTYPE[name]) for name in LOG_DTYPE.names}
+    return LogBatch(columns, np.empty((0, H), dtype=np.float32), list(MRP_PATHS))
+
+def read_log(file, chunk_size:int=65536, H:int=MAX_VECTOR) -> LogBatch:
+    """
+    Read a whole MRP recording into a single LogBatch.
+    """
+    batches = list(iter_log(file, chunk_size, H))
+    if not batches:
+        return empty_batch(H)
+    return concat_batches(batches)
+
+LOG_TAGS = {int: 'i', float: 'f'}
+
+def format_log_line(t:float, path:str, args) -> str:
+    """
+    Format one message in the MRP text log format (see `MRP.log`), with a trailing newline.
+    """
+    if not args:
+        return f'{t:.5f} {path}\n'
+    tags, values = zip(*(_log_arg(a) for a in args))
+    return f'{t:.5f} {path} {"".join(tags)} {" ".join(values)}\n'
+
+def _log_arg(a) -> tuple[str, str]:
+    """Type tag and text of an argument; NumPy scalars are tagged as the Python numbers they hold."""
+    if isinstance(a, (bool, np.bool_)): # before Integral, which bool is: logged as 0 or 1
+        return LOG_TAGS[int], str(int(a))
+    if isinstance(a, numbers.Integral):
+        return LOG_TAGS[int], str(int(a))
+    if isinstance(a, numbers.Real):
+        return LOG_TAGS[float], f'{float(a):.5f}'
+    return 's', str(a)
+
+def format_log_lines(batch:LogBatch) -> list[str]:
+    """
+    Format a LogBatch as lines of the MRP text log format.
+    """
+    return [format_log_line(t, path, args) for t, path, args in batch.messages()]
+
+def write_log(batch:LogBatch, file:str, mode:str='wt'):
+    """
+    Write a LogBatch to the MRP text log format in a single buffered write.
+    """
+    with open_log(file, mode) as f:
+        f.write(''.join(format_log_lines(batch)))
+
+VECTOR_SCALE = 1e5 # vectors are quantized to the 5 decimals of the log format for delta encoding
+VECTOR_DELTA_NAMES = ('vector_deltas', 'vector_lengths', 'vector_notes')
+
+def encode_vector_deltas(batch:LogBatch) -> dict:
+    """
+    Delta-encode the vectors of a batch against the previous vector of the same note.
+
+    Vectors are quantized to integers at the log precision, so decoding is exact up to it.
+
+    Returns
+        dict: 'vector_deltas' (V, H) int32, 'vector_lengths' (V,) int16 and 'vector_notes' (V,) note of each vector
+    """
+    vectors = batch.vectors
+    lengths = (~np.isnan(vectors)).sum(axis=1).astype(np.int16)
+    q = np.rint(np.nan_to_num(vectors) * VECTOR_SCALE).astype(np.int32)
+    rows = np.asarray(batch['vector'])
+    has = rows >= 0
+    notes = np.full(len(vectors), -1, dtype=np.int64)
+    notes[rows[has]] = np.asarray(batch['note'])[has]
+    order = np.lexsort((np.arange(len(vectors)), notes))
+    deltas = q.copy()
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = notes[order][1:] != notes[order][:-1]
+    prev = order[:-1][~first[1:]]
+    deltas[order[1:][~first[1:]]] -= q[prev]
+    return {'vector_deltas': deltas, 'vector_lengths': lengths, 'vector_notes': notes}
+
+def decode_vector_deltas(deltas:np.ndarray, lengths:np.ndarray, notes:np.ndarray) -> np.ndarray:
+    """Invert `encode_vector_deltas`, returning NaN-padded float32 vectors."""
+    order = np.lexsort((np.arange(len(deltas)), notes))
+    summed = np.cumsum(deltas[order].astype(np.int64), axis=0)
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = notes[order][1:] != notes[order][:-1]
+    starts = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+    totals = np.concatenate([np.zeros((1, deltas.shape[1]), dtype=np.int64), summed])
+    vectors = np.empty(deltas.shape, dtype=np.float32)
+    vectors[order] = (summed - totals[starts]) / VECTOR_SCALE
+    vectors[np.arange(deltas.shape[1]) >= lengths[:, np.newaxis]] = np.nan
+    return vectors
+
+def save_recording(batch:LogBatch, file:str, format:str=None, delta:bool=False):
+    """
+    Save a LogBatch in a columnar binary format.
+
+    Args
+        batch (LogBatch): records to save
+        file (str): output path; a directory for 'npy', a file for 'npz' and 'parquet'
+        format (str): 'npy', 'npz' or 'parquet', defaults to the extension of file, or 'npy'
+        delta (bool): delta-encode vectors per note ('npy' and 'npz'), see `encode_vector_deltas`
+    """
+    if format is None:
+        format = {'.npz': 'npz', '.parquet': 'parquet'}.get(os.path.splitext(file)[1], 'npy')
+    vectors = encode_vector_deltas(batch) if delta else {'vectors': batch.vectors}
+    if format == 'npy':
+        os.makedirs(file, exist_ok=True)
+        for name in LOG_DTYPE.names:
+            np.save(os.path.join(file, f'{name}.npy'), np.ascontiguousarray(batch[name]))
+        for name, array in vectors.items():
+            np.save(os.path.join(file, f'{name}.npy'), array)
+        with open(os.path.join(file, 'paths.json'), 'w') as f:
+            json.dump(batch.paths, f)
+    elif format == 'npz':
+        np.savez_compressed(file, paths=np.array(batch.paths), **vectors, **batch.columns)
+    elif format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # vectors are stored per row, as empty lists for records without one
+        has_vector = batch['vector'] >= 0
+        H = batch.vectors.shape[1]
+        offsets = np.concatenate([[0], np.cumsum(has_vector * H)]).astype(np.int32)
+        values = batch.vectors[batch['vector'][has_vector]].ravel()
+        columns = {name: batch[name] for name in LOG_DTYPE.names if name != 'vector'}
+        columns['vectors'] = pa.ListArray.from_arrays(offsets, values)
+        table = pa.table(columns).replace_schema_metadata({'paths': json.dumps(batch.paths), 'H': str(H)})
+        pq.write_table(table, file)
+    else:
+        raise ValueError(f"save_recording(): unknown format '{format}'")
+
+def load_recording(file:str, mmap:bool=True) -> LogBatch:
+    """
+    Load a recording saved by `save_recording`, or parse a text `.log`.
+
+    Args
+        file (str): path to the recording
+        mmap (bool): memory-map the columns of an 'npy' directory instead of reading them
+
+    Returns
+        LogBatch: the recording
+    """
+    if os.path.isdir(file):
+        mode = 'r' if mmap else None
+        columns = {name: np.load(os.path.join(file, f'{name}.npy'), mmap_mode=mode) for name in LOG_DTYPE.names}
+        if os.path.exists(os.path.join(file, 'vector_deltas.npy')):
+            vectors = decode_vector_deltas(*(np.load(os.path.join(file, f'{name}.npy')) for name in VECTOR_DELTA_NAMES))
+        else:
+            vectors = np.load(os.path.join(file, 'vectors.npy'), mmap_mode=mode)
+        with open(os.path.join(file, 'paths.json')) as f:
+            paths = json.load(f)
+        return LogBatch(columns, vectors, paths)
+    ext = os.path.splitext(file)[1]
+    if ext == '.npz':
+        with np.load(file) as z:
+            vectors = decode_vector_deltas(*(z[name] for name in VECTOR_DELTA_NAMES)) if 'vector_deltas' in z.files else z['vectors']
+            return LogBatch({name: z[name] for name in LOG_DTYPE.names}, vectors, z['paths'].tolist())
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(file)
+        meta = table.schema.metadata
+        H = int(meta[b'H'])
+        lists = table.column('vectors').combine_chunks()
+        has_vector = lists.value_lengths().fill_null(0).to_numpy() > 0
+        vectors = lists.flatten().to_numpy().reshape(-1, H).astype(np.float32)
+        columns = {name: table.column(name).to_numpy() for name in LOG_DTYPE.names if name != 'vector'}
+        columns['vector'] = np.where(has_vector, np.cumsum(has_vector) - 1, -1).astype(np.int32)
+        return LogBatch(columns, vectors, json.loads(meta[b'paths']))
+    return read_log(file)
+
+class MRPRecorder:
+    """
+    Background writer for MRP recordings.
+
+    `push` only appends a (time, args) tuple to a deque, whose append and popleft are
+    atomic, so the sending thread never waits on formatting or file IO. A writer thread
+    drains the deque every `flush_interval` seconds (or as soon as `batch_size` messages
+    are waiting), formats them in one batch and writes them with a single call.
+
+    Example
+        recorder = MRPRecorder('session.log', max_seconds=3600, compression='gzip')
+        recorder.start()
+        recorder.push(0.5, ('/mrp/midi', 159, 48, 1))
+        recorder.stop()
+
+    Args
+        file (str): path of the log; rotated parts are numbered `name_001.log`, `name_002.log`, ...
+        flush_interval (float): seconds between writes
+        batch_size (int): pending messages that trigger an early write
+        max_bytes (int): rotate to a new part after this many (uncompressed) bytes
+        max_seconds (float): rotate to a new part after this many seconds of recording
+        compression (str): None, 'gzip', 'lzma' or 'bz2'; appends the matching extension
+    """
+    def __init__(self, file:str, flush_interval:float=0.5, batch_size:int=4096,
+                 max_bytes:int=None, max_seconds:float=None, compression:str=None) -> None:
+        self.file = file
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.files = []
+        self._buffer = deque()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        self._f = None
+
+    def start(self):
+        """Open the first part and start the writer thread."""
+        self._part = 0
+        self._open()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='MRPRecorder', daemon=True)
+        self._thread.start()
+
+    def push(self, t:float, args:tuple):
+        """Queue a message (path, *args) recorded at time t. Safe to call from any thread."""
+        self._buffer.append((t, args))
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def stop(self):
+        """Write all pending messages, stop the writer thread and close the file."""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._drain()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def _part_name(self) -> str:
+        name = self.file
+        if self._part > 0:
+            stem, ext = os.path.splitext(self.file)
+            name = f'{stem}_{self._part:03d}{ext}'
+        if self.compression is not None:
+            name += COMPRESSION[self.compression][0]
+        return name
+
+    def _open(self):
+        name = self._part_name()
+        self._f = open_log(name, 'wt')
+        self.files.append(name)
+        self._bytes = 0
+        self._opened = None # time of the first message in this part
+
+    def _rotate(self):
+        self._f.close()
+        self._part += 1
+        self._open()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self):
+        buf = self._buffer
+        lines = []
+        while buf:
+            t, args = buf.popleft()
+            if self._opened is None:
+                self._opened = t
+            elif self.max_seconds is not None and t - self._opened >= self.max_seconds:
+                self._write(lines)
+                lines = []
+                self._rotate()
+                self._opened = t
+            lines.append(format_log_line(t, args[0], args[1:]))
+        self._write(lines)
+
+    def _write(self, lines):
+        if not lines: return
+        text = ''.join(lines)
+        self._f.write(text)
+        self._f.flush()
+        self._bytes += len(text)
+        if self.max_bytes is not None and self._bytes >= self.max_bytes:
+            self._rotate()
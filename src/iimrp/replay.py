@@ -0,0 +1,211 @@
+'''
+Replay of MRP recordings through `MRP.send`.
+
+Events are scheduled against a fixed origin (the wall-clock time playback started
+from a given recording time), so timing errors do not accumulate: each event is due
+at `origin + (t - t_origin) / speed`. The scheduler sleeps until just before an event
+is due, then spins for the last `spin` seconds. Events that share a timestamp are sent
+together in one OSC bundle (see `MRP.send_messages`).
+
+Seeking restores the piano to the state at the target time: a time index (searchsorted
+on the time column) finds the position, the nearest earlier checkpoint of the note,
+quality, pedal and UI state (see `state.py`) is replayed forward silently to that
+position, and the result is sent as all notes off followed by the messages that
+recreate it.
+
+Example
+    replay = MRPReplay(mrp, 'session.log', speed=2.0, loop=True)
+    replay.seek(47 * 60)
+    replay.play()
+    ...
+    replay.stop()
+'''
+
+import time
+import bisect
+import threading
+import numpy as np
+
+from .recording import load_recording
+from .state import MRPState
+from .index import MRPLogIndex, load_index
+
+class MRPReplay:
+    """
+    Replay engine for a recording (text .log or binary, see `recording.load_recording`).
+
+    Args
+        mrp (MRP): MRP instance to send through
+        file (str | LogBatch): recording to replay
+        speed (float): playback rate, 2.0 plays twice as fast
+        loop (bool): restart from the beginning at the end of the recording
+        checkpoint_interval (float): seconds of recording between state checkpoints
+        spin (float): seconds before an event to stop sleeping and busy-wait
+        save_index (bool): save the checkpoints of a recording file as its sidecar index (see `index.py`)
+    """
+    def __init__(self, mrp, file, speed:float=1.0, loop:bool=False, checkpoint_interval:float=10.0, spin:float=0.002,
+                 save_index:bool=False) -> None:
+        self.mrp = mrp
+        self.file = file if isinstance(file, str) else None
+        self.log = load_recording(file) if isinstance(file, str) else file
+        times = np.asarray(self.log['time'])
+        if np.any(np.diff(times) < 0):
+            self.log = self.log.select(np.argsort(times, kind='stable'))
+            self.file = None
+        self.times = np.asarray(self.log['time'])
+        self.loop = loop
+        self.spin = spin
+        self._speed = speed
+        self.checkpoint_interval = checkpoint_interval
+        self.save_index = save_index
+        self.build_checkpoints()
+        self.state = MRPState()
+        self.position = 0
+        self.time = float(self.times[0]) if len(self.times) else 0.0
+        self._thread = None
+        self._running = False
+        self._wake = threading.Event()
+        self._anchor()
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed:float):
+        """Change the playback rate, taking effect from the current position."""
+        if self._running:
+            now = time.perf_counter()
+            self._origin_rec += (now - self._origin_wall) * self._speed
+            self._origin_wall = now
+        self._speed = speed
+
+    @property
+    def is_playing(self) -> bool:
+        return self._running
+
+    def build_checkpoints(self):
+        """
+        Fold the whole recording once, storing (record index, state) every checkpoint_interval seconds.
+        A recording file with an up to date sidecar index of the same interval takes its
+        checkpoints from the index (see `index.py`), which is built and saved if save_index.
+        """
+        index = self._index() if self.file is not None else None
+        if index is not None:
+            self.checkpoints = index.checkpoints()
+            self._checkpoint_index = [c[0] for c in self.checkpoints]
+            return
+        state = MRPState()
+        self.checkpoints = [(0, state.copy())]
+        next_t = self.checkpoint_interval
+        for i, (t, path, args) in enumerate(self.log.messages()):
+            if t >= next_t:
+                self.checkpoints.append((i, state.copy()))
+                next_t = (t // self.checkpoint_interval + 1) * self.checkpoint_interval
+            state.apply(path, *args)
+        self._checkpoint_index = [c[0] for c in self.checkpoints]
+
+    def _index(self) -> MRPLogIndex:
+        try:
+            index = load_index(self.file, build=False)
+            if index.interval == self.checkpoint_interval:
+                return index
+        except FileNotFoundError:
+            pass
+        if not self.save_index:
+            return None
+        index = MRPLogIndex.build(self.file, self.checkpoint_interval)
+        index.save()
+        return index
+
+    def state_at(self, t:float) -> tuple[int, MRPState]:
+        """
+        Return the record index and MRP state just before time t.
+        """
+        i = int(np.searchsorted(self.times, t, side='left'))
+        k = bisect.bisect_right(self._checkpoint_index, i) - 1
+        start, state = self.checkpoints[k]
+        state = state.copy()
+        state.apply_batch(self.log, start, i)
+        return i, state
+
+    def seek(self, t:float):
+        """
+        Move playback to time t, restoring the notes and qualities sounding at t.
+        """
+        playing = self._running
+        if playing:
+            self.stop(sync=False)
+        self._restore(t)
+        if playing:
+            self.play()
+
+    def _restore(self, t:float):
+        self.position, self.state = self.state_at(t)
+        self.time = t
+        self.mrp.all_notes_off()
+        for path, args in self.state.messages():
+            self.mrp.send(path, *args, client=self.mrp.client)
+        self.state.sync_mrp(self.mrp)
+        self._anchor()
+
+    def play(self, block:bool=False):
+        """
+        Start playback from the current position, in a background thread unless block is True.
+        """
+        if self._running: return
+        self._running = True
+        self._wake.clear()
+        if block:
+            self._run()
+        else:
+            self._thread = threading.Thread(target=self._run, name='MRPReplay', daemon=True)
+            self._thread.start()
+
+    def stop(self, sync:bool=True):
+        """
+        Stop playback, leaving notes sounding. The MRP note table is synced to the replayed state.
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if sync:
+            self.state.sync_mrp(self.mrp)
+
+    def _anchor(self):
+        self._origin_wall = time.perf_counter()
+        self._origin_rec = self.time
+
+    def _run(self):
+        self._anchor()
+        times, n = self.times, len(self.times)
+        while self._running:
+            i = self.position
+            if i >= n:
+                if not self.loop or n == 0: break
+                self._restore(float(times[0]))
+                continue
+            t = times[i]
+            due = self._origin_wall + (t - self._origin_rec) / self._speed
+            wait = due - time.perf_counter()
+            if wait > self.spin:
+                self._wake.wait(min(wait - self.spin, 0.1))
+                continue
+            while time.perf_counter() < due:
+                pass
+            j = int(np.searchsorted(times, t, side='right'))
+            messages = [(path, args) for _, path, args in self.log.select(slice(i, j)).messages()]
+            self.mrp.send_messages(messages)
+            for path, args in messages:
+                self.state.apply(path, *args)
+            self.position = j
+            self.time = float(t)
+        if self.position >= n:
+            self.state.sync_mrp(self.mrp)
+        self._running = False
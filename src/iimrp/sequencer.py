@@ -0,0 +1,335 @@
+'''
+Cycle-based pattern sequencer for the MRP, after `TidalCycles/mrp.tidal`.
+
+Patterns use a subset of the Tidal mini-notation:
+
+    "48 72"         steps dividing the cycle
+    "[1 0 -1] 0"    a bracketed group subdivides its step
+    "48 ~ 50"       ~ is a rest
+    "48*2 50"       *n repeats a step n times within it
+    "<48 50 52>"    one step per cycle, in turn
+    "[48, 52] 55"   comma separated sequences play together (chords)
+
+`MRPSequencer` holds named parts, each a note pattern with optional quality patterns
+sampled at the note onsets, as `mrp_n` does. Ahead of time, each cycle is compiled into
+one sorted event array; the dispatcher thread then sleeps until each group of
+simultaneous events is due (`latency` seconds early) and sends the group in one bundle
+time tagged with its play time (see `MRP.bundle`). Cost scales with the events per
+cycle, not with a control rate.
+
+Example
+    seq = MRPSequencer(mrp, cps=0.5)
+    seq.set('p1', "48 72", intensity="1 1", brightness="0 1", pitch="[1 0 -1] 0")
+    seq.start()
+    ...
+    seq.set('p1', "<48 47> [49 80 64]", intensity="1", legato=0.5) # from the next cycle
+    seq.stop()
+'''
+
+import math
+import time
+import threading
+import numpy as np
+from fractions import Fraction
+
+from .state import STATE_QUALITIES
+
+SEQUENCER_EVENT_DTYPE = np.dtype([('time', 'f8'), ('kind', 'i1'), ('note', 'i2'), ('quality', 'i1'), ('value', 'f8')])
+# event kinds, in the order simultaneous events are sent
+EVENT_NOTE_OFF = 0
+EVENT_NOTE_ON = 1
+EVENT_QUALITY = 2
+
+class MRPPattern:
+    """
+    A parsed mini-notation pattern.
+
+    Args
+        pattern (str|float|list): mini-notation, a single value, or a list of steps
+    """
+    def __init__(self, pattern) -> None:
+        if isinstance(pattern, MRPPattern):
+            pattern = pattern.text
+        elif isinstance(pattern, (list, tuple)):
+            pattern = ' '.join(str(p) for p in pattern)
+        self.text = str(pattern)
+        self._tokens = self.text.replace('[', ' [ ').replace(']', ' ] ').replace('<', ' < ') \
+            .replace('>', ' > ').replace(',', ' , ').replace('*', ' * ').split()
+        self._pos = 0
+        self.tree = self._stack(None)
+        if self._pos != len(self._tokens):
+            raise ValueError(f'unexpected {self._tokens[self._pos]!r} in pattern {self.text!r}')
+        del self._tokens
+
+    def __repr__(self) -> str:
+        return f'MRPPattern({self.text!r})'
+
+    """
+    parsing
+    """
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _stack(self, close:str) -> tuple:
+        layers = [self._sequence(close)]
+        while self._peek() == ',':
+            self._pos += 1
+            layers.append(self._sequence(close))
+        return layers[0] if len(layers) == 1 else ('stack', layers)
+
+    def _sequence(self, close:str) -> tuple:
+        steps = []
+        while self._peek() not in (None, ',', close):
+            steps.append(self._step())
+        if not steps:
+            raise ValueError(f'empty sequence in pattern {self.text!r}')
+        return ('seq', steps)
+
+    def _step(self) -> tuple:
+        token = self._peek()
+        self._pos += 1
+        if token == '[':
+            node = self._stack(']')
+            self._expect(']')
+        elif token == '<':
+            node = ('alt', self._sequence('>')[1])
+            self._expect('>')
+        elif token == '~':
+            node = ('rest',)
+        elif token in (']', '>', '*'):
+            raise ValueError(f'unexpected {token!r} in pattern {self.text!r}')
+        else:
+            try:
+                node = ('value', float(token))
+            except ValueError:
+                raise ValueError(f'bad value {token!r} in pattern {self.text!r}') from None
+        while self._peek() == '*':
+            self._pos += 1
+            token = self._peek()
+            self._pos += 1
+            if token is None or not token.isdigit() or int(token) == 0:
+                raise ValueError(f'*n needs a positive integer in pattern {self.text!r}')
+            node = ('fast', node, int(token))
+        return node
+
+    def _expect(self, token:str):
+        if self._peek() != token:
+            raise ValueError(f'missing {token!r} in pattern {self.text!r}')
+        self._pos += 1
+
+    """
+    querying
+    """
+    def events(self, cycle:int) -> list:
+        """(start, end, value) of the events of a cycle, as Fractions of a cycle from its start."""
+        out = []
+        _query(self.tree, cycle, Fraction(0), Fraction(1), out)
+        out.sort(key=lambda e: e[0])
+        return out
+
+    def query(self, cycle:int) -> tuple:
+        """Starts, ends (in cycles from the cycle start) and values of a cycle's events, as arrays."""
+        events = self.events(cycle)
+        if not events:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        starts, ends, values = zip(*events)
+        return np.array(starts, dtype=float), np.array(ends, dtype=float), np.array(values)
+
+def _query(node:tuple, cycle:int, start:Fraction, length:Fraction, out:list):
+    kind = node[0]
+    if kind == 'value':
+        out.append((start, start + length, node[1]))
+    elif kind == 'seq':
+        step = length / len(node[1])
+        for i, child in enumerate(node[1]):
+            _query(child, cycle, start + i * step, step, out)
+    elif kind == 'stack':
+        for layer in node[1]:
+            _query(layer, cycle, start, length, out)
+    elif kind == 'alt':
+        children = node[1]
+        _query(children[cycle % len(children)], cycle // len(children), start, length, out)
+    elif kind == 'fast':
+        _, child, n = node
+        step = length / n
+        for i in range(n):
+            _query(child, cycle * n + i, start + i * step, step, out)
+
+class MRPSequencer:
+    """
+    Plays named parts of note and quality patterns on an MRP, one cycle ahead at a time.
+
+    Args
+        mrp (MRP): the instance to play on (bundles need iipyper's or a python-osc client)
+        cps (float): cycles per second
+        latency (float): seconds each event is sent before it is due, as its bundle time tag
+
+    Attributes
+        parts (dict): name -> part dict ('notes', 'qualities', 'legato')
+        cycle (int): next cycle to compile
+    """
+    def __init__(self, mrp, cps:float=0.5, latency:float=0.2) -> None:
+        self.mrp = mrp
+        self.cps = cps
+        self.latency = latency
+        self.parts = {}
+        self.cycle = 0
+        self.origin = time.time() # time of cycle 0
+        self.dispatched = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set(self, name:str, notes, legato:float=1.0, **qualities):
+        """
+        Set a part, from the next compiled cycle.
+
+        Args
+            name (str): part name, e.g. 'p1'
+            notes: note pattern (see `MRPPattern`)
+            legato (float): note length relative to its step
+            **qualities: quality name -> pattern of values, sampled at each note onset
+        """
+        for q in qualities:
+            if q not in STATE_QUALITIES:
+                raise ValueError(f'unknown quality {q!r}, expected one of {STATE_QUALITIES}')
+        self.parts = {**self.parts, name: {
+            'notes': MRPPattern(notes), 'legato': Fraction(legato).limit_denominator(1000),
+            'qualities': {STATE_QUALITIES.index(q): MRPPattern(p) for q, p in qualities.items()}}}
+
+    def remove(self, name:str):
+        self.parts = {k: v for k, v in self.parts.items() if k != name}
+
+    def hush(self):
+        """Remove every part; sounding notes end as scheduled."""
+        self.parts = {}
+
+    """
+    time
+    """
+    def cycle_at(self, t:float=None) -> float:
+        """Cycle position at time t (time.time())."""
+        return ((time.time() if t is None else t) - self.origin) * self.cps
+
+    def time_of(self, position:float) -> float:
+        """Time (time.time()) of a cycle position."""
+        return self.origin + position / self.cps
+
+    def set_cps(self, cps:float):
+        """Change tempo, keeping the current cycle position."""
+        now = time.time()
+        position = self.cycle_at(now)
+        self.cps = cps
+        self.origin = now - position / cps
+
+    """
+    compiling
+    """
+    def compile(self, cycle:int) -> np.ndarray:
+        """
+        Events of a cycle as a SEQUENCER_EVENT_DTYPE array sorted by time (in cycles)
+        and kind: note offs, note ons, then qualities.
+        """
+        times, kinds, notes, qualities = [], [], [], []
+        for part in self.parts.values():
+            events = part['notes'].events(cycle)
+            if not events:
+                continue
+            onsets = [start for start, _, _ in events]
+            for start, end, note in events:
+                note = int(round(note))
+                times += [start, start + (end - start) * part['legato']]
+                kinds += [EVENT_NOTE_ON, EVENT_NOTE_OFF]
+                notes += [note, note]
+            for q, pattern in part['qualities'].items():
+                q_events = pattern.events(cycle)
+                if not q_events:
+                    continue
+                # the value of the quality event holding each note onset
+                starts = np.array([float(s) for s, _, _ in q_events])
+                ends = np.array([float(e) for _, e, _ in q_events])
+                at = np.array([float(t) for t in onsets])
+                i = np.searchsorted(starts, at, side='right') - 1
+                held = (i >= 0) & (at < ends[np.maximum(i, 0)])
+                for k in np.flatnonzero(held).tolist():
+                    times.append(onsets[k])
+                    kinds.append(EVENT_QUALITY)
+                    notes.append(int(round(events[k][2])))
+                    qualities.append((len(times) - 1, q, q_events[i[k]][2]))
+        out = np.zeros(len(times), dtype=SEQUENCER_EVENT_DTYPE)
+        if not len(out):
+            return out
+        # exact (Fraction) times, so simultaneous events compare equal
+        out['time'] = [cycle + float(t) for t in times]
+        out['kind'] = kinds
+        out['note'] = notes
+        for row, q, value in qualities:
+            out['quality'][row] = q
+            out['value'][row] = value
+        return out[np.lexsort((out['kind'], out['time']))]
+
+    """
+    dispatching
+    """
+    def dispatch(self, events:np.ndarray):
+        """
+        Send a group of simultaneous events in one bundle, time tagged with their time.
+        """
+        with self.mrp.bundle(timetag=self.time_of(float(events['time'][0]))):
+            qualities = {}
+            for kind, note, q, value in zip(events['kind'].tolist(), events['note'].tolist(),
+                                            events['quality'].tolist(), events['value'].tolist()):
+                if kind == EVENT_NOTE_OFF:
+                    self.mrp.note_off(note)
+                elif kind == EVENT_NOTE_ON:
+                    self.mrp.note_on(note)
+                else:
+                    qualities.setdefault(note, {})[STATE_QUALITIES[q]] = value
+            for note, values in qualities.items():
+                self.mrp.set_note_qualities(note, values)
+        self.dispatched += len(events)
+
+    def start(self, cycle:int=None) -> 'MRPSequencer':
+        """
+        Play in a background thread from the start of the next cycle (or of cycle, if given,
+        resetting the clock so it starts after `latency`).
+        """
+        if self._thread is None:
+            if cycle is not None:
+                self.origin = time.time() + self.latency - cycle / self.cps
+                self.cycle = cycle
+            else:
+                self.cycle = math.floor(self.cycle_at(time.time() + self.latency)) + 1
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop playing; every note is turned off after the events already sent."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            with self.mrp.bundle(timetag=time.time() + self.latency):
+                self.mrp.all_notes_off()
+
+    def _run(self):
+        pending = np.zeros(0, dtype=SEQUENCER_EVENT_DTYPE)
+        while not self._stop.is_set():
+            now = time.time()
+            # compile each cycle one cycle before its first events are sent
+            compile_due = self.time_of(self.cycle - 1) - self.latency
+            if now >= compile_due:
+                pending = np.concatenate([pending, self.compile(self.cycle)])
+                pending = pending[np.lexsort((pending['kind'], pending['time']))]
+                self.cycle += 1
+                continue
+            # events at or after the next cycle wait for it, to be sorted with its events
+            ready = len(pending) and pending['time'][0] < self.cycle
+            due = min(compile_due, self.time_of(float(pending['time'][0])) - self.latency) if ready else compile_due
+            if due > now:
+                self._stop.wait(due - now)
+                continue
+            n = np.searchsorted(pending['time'], pending['time'][0], side='right')
+            self.dispatch(pending[:n])
+            pending = pending[n:]
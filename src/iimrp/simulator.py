@@ -0,0 +1,254 @@
+'''
+Pure-NumPy audio simulator of the MRP, for auditioning recordings without a piano.
+
+The simulator keeps the same note and quality state as the MRP software and drives a
+bank of resonators, one per key and harmonic (88 x 32). The drive of each resonator
+comes from the compiled patch table (see `patch.py`), or from /mrp/quality/harmonics/raw
+when it is set. Resonator amplitudes follow their drive with an attack and a
+frequency-dependent ring time, and are synthesized per block with preallocated buffers.
+
+Events are applied at block boundaries, so timing is accurate to one block.
+
+Example
+    audio = render_log('iimrp-recording.log', sample_rate=44100)
+'''
+
+import time
+import numpy as np
+
+from .patch import load_patch_table, DEFAULT_PATCH_FILE, MAX_HARMONICS_RAW
+from .recording import iter_log_messages
+
+SIM_QUALITIES = ('brightness', 'intensity', 'pitch', 'pitch_vibrato', 'harmonic')
+
+class MRPSimulator:
+    """
+    A vectorized resonator bank over all keys and harmonics, driven by MRP OSC messages.
+
+    Example
+        sim = MRPSimulator()
+        sim.send('/mrp/midi', 159, 60, 127)
+        sim.send('/mrp/quality/intensity', 15, 60, 0.8)
+        audio = sim.process(44100)
+
+    Args
+        sample_rate (int): audio sample rate
+        block_size (int): samples per block, the timing resolution of events
+        patch_file (str): MRP XML patch table
+        program (int): program of the patch table to simulate
+        channel (int): real-time midi note channel (0-indexed)
+        start (int): MIDI number of the lowest key
+        keys (int): number of keys
+        H (int): number of harmonics per key
+        attack (float): time constant (s) of a resonator approaching its drive
+        ring (float): time constant (s) of the lowest key ringing out, higher keys ring shorter
+        gain (float): output gain
+    """
+    def __init__(self, sample_rate:int=44100, block_size:int=512, patch_file:str=DEFAULT_PATCH_FILE,
+                 program:int=0, channel:int=15, start:int=21, keys:int=88, H:int=MAX_HARMONICS_RAW,
+                 attack:float=0.05, ring:float=4.0, gain:float=1.0) -> None:
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.patch_table = load_patch_table(patch_file, H)
+        self.program = program
+        self.channel = channel
+        self.start = start
+        self.keys = keys
+        self.H = H
+        self.attack = attack
+        self.ring = ring
+        self.gain = gain
+        self.notes = np.arange(start, start + keys)
+        self.f0 = 440.0 * 2.0 ** ((self.notes - 69) / 12.0)
+        self.harmonic_numbers = np.arange(1, H + 1)
+        # release time constant per resonator: low strings and low partials ring longer
+        self.release = ring * (self.f0[0] / self.f0[:, np.newaxis]) ** 0.5 / self.harmonic_numbers ** 0.5
+        self.reset()
+        # preallocated work buffers and oscillator tables, one row per resonator
+        self.inc = np.full((keys, H), np.nan)
+        self._cos = np.empty((keys * H, block_size), dtype=np.float32)
+        self._sin = np.empty((keys * H, block_size), dtype=np.float32)
+        self._cos_buf = np.empty_like(self._cos)
+        self._sin_buf = np.empty_like(self._sin)
+        self._coef = np.empty((2, 2, keys * H), dtype=np.float32)
+        self._out = np.empty(block_size)
+        self._ramp = np.arange(block_size) / block_size
+        self._t0 = None
+        self._queue = []
+
+    def reset(self):
+        """Turn all notes off and silence all resonators."""
+        self.on = np.zeros(self.keys, dtype=bool)
+        self.qualities = {q: np.zeros(self.keys) for q in SIM_QUALITIES}
+        self.harmonics_raw = np.zeros((self.keys, self.H))
+        self.has_raw = np.zeros(self.keys, dtype=bool)
+        self.damper = 0.0
+        self.volume = 1.0
+        self.env = np.zeros((self.keys, self.H))
+        self.phase = np.zeros((self.keys, self.H))
+        self.time = 0.0
+        self._dirty = True
+
+    """
+    OSC message handling
+    """
+    def handle(self, path:str, *args):
+        """
+        Apply one MRP OSC message to the simulator state.
+        Unknown paths are ignored.
+        """
+        if path == '/mrp/midi':
+            status, note = int(args[0]), int(args[1])
+            velocity = int(args[2]) if len(args) > 2 else 0
+            k = note - self.start
+            if not 0 <= k < self.keys: return
+            if status & 0xF0 == 0x90 and velocity > 0:
+                self.on[k] = True
+            elif status & 0xF0 in (0x80, 0x90):
+                self.on[k] = False
+                self.has_raw[k] = False
+        elif path.startswith('/mrp/quality/'):
+            k = int(args[1]) - self.start
+            if not 0 <= k < self.keys: return
+            quality = path[len('/mrp/quality/'):].replace('/', '_')
+            if quality == 'harmonics_raw':
+                raw = np.asarray(args[2:self.H + 2], dtype=float)
+                self.harmonics_raw[k] = 0
+                self.harmonics_raw[k, :len(raw)] = raw
+                self.has_raw[k] = len(raw) > 0
+            elif quality in self.qualities:
+                self.qualities[quality][k] = float(args[2])
+        elif path == '/mrp/allnotesoff':
+            self.on[:] = False
+            self.has_raw[:] = False
+        elif path == '/mrp/pedal/damper':
+            self.damper = float(args[0])
+        elif path in ('/ui/volume/raw', '/mrp/volume'):
+            self.volume = float(args[0])
+        self._dirty = True
+
+    def send(self, path:str, *args, **kwargs):
+        """
+        Queue a message live, timestamped on arrival, for the next call to `flush`.
+        Has the same signature as `osc.send`, so the simulator can stand in for the MRP client.
+        """
+        if self._t0 is None:
+            self._t0 = time.monotonic() - self.time
+        self._queue.append((time.monotonic() - self._t0, path, args))
+
+    def flush(self) -> np.ndarray:
+        """
+        Render audio for all live messages queued by `send`, up to the present.
+        """
+        if self._t0 is None:
+            return np.zeros(0, dtype=np.float32)
+        queue, self._queue = self._queue, []
+        return self.render(queue, until=time.monotonic() - self._t0)
+
+    """
+    synthesis
+    """
+    def _update_drive(self):
+        qs = {q: self.qualities[q] for q in ('intensity', 'brightness', 'pitch', 'harmonic')}
+        amp, drive = self.patch_table.drive(self.notes, self.program, self.channel, **qs)
+        drive[self.has_raw] = amp[self.has_raw, np.newaxis] * self.harmonics_raw[self.has_raw]
+        drive[~self.on] = 0
+        rel_freq = self.patch_table.relative_frequency(self.notes, self.program, self.channel, pitch=self.qualities['pitch'])
+        self.freq = (self.f0 * rel_freq)[:, np.newaxis] * self.harmonic_numbers
+        inc = 2 * np.pi * self.freq / self.sample_rate
+        changed = np.flatnonzero((inc != self.inc).any(axis=1))
+        if len(changed):
+            # oscillator tables are only recomputed for keys whose frequency changed
+            rows = (changed[:, np.newaxis] * self.H + np.arange(self.H)).ravel()
+            t = inc.ravel()[rows, np.newaxis] * np.arange(self.block_size)
+            self._cos[rows], self._sin[rows] = np.cos(t), np.sin(t)
+            self.inc = inc
+        self.target = drive * (self.freq < self.sample_rate / 2)
+        self._dirty = False
+
+    def _block(self, n:int) -> np.ndarray:
+        """Synthesize n <= block_size samples."""
+        if self._dirty:
+            self._update_drive()
+        dt = n / self.sample_rate
+        release = self.release * (1 + 4 * self.damper)
+        tau = np.where(self.target > self.env, self.attack, release)
+        env0 = self.env
+        env1 = self.target + (env0 - self.target) * np.exp(-dt / tau)
+        env1[env1 < 1e-5] = 0
+        active = np.flatnonzero((env0 + env1).ravel())
+        k = len(active)
+        out = self._out[:n]
+        if k == 0:
+            out[:] = 0
+        else:
+            # sin(phase + inc*t) = sin(phase) cos(inc*t) + cos(phase) sin(inc*t),
+            # with the amplitude ramping linearly from env0 to env1 over the block
+            phase = self.phase.ravel()[active]
+            sin_p, cos_p = np.sin(phase), np.cos(phase)
+            a0 = env0.ravel()[active]
+            da = env1.ravel()[active] - a0
+            coef = self._coef[:, :, :k]
+            coef[0, 0], coef[1, 0] = a0 * sin_p, da * sin_p
+            coef[0, 1], coef[1, 1] = a0 * cos_p, da * cos_p
+            cos_t = np.take(self._cos, active, axis=0, out=self._cos_buf[:k])
+            sin_t = np.take(self._sin, active, axis=0, out=self._sin_buf[:k])
+            y = coef[:, 0] @ cos_t[:, :n] + coef[:, 1] @ sin_t[:, :n]
+            np.multiply(self._ramp[:n] * (self.block_size / n), y[1], out=out)
+            out += y[0]
+            self.phase.ravel()[active] = np.mod(phase + self.inc.ravel()[active] * n, 2 * np.pi)
+        self.env = env1
+        self.time += dt
+        return out * (self.gain * self.volume)
+
+    def process(self, n_samples:int) -> np.ndarray:
+        """
+        Render n_samples of audio with the current state.
+        """
+        audio = np.empty(n_samples, dtype=np.float32)
+        for i in range(0, n_samples, self.block_size):
+            n = min(self.block_size, n_samples - i)
+            audio[i:i+n] = self._block(n)
+        return audio
+
+    def render(self, messages, until:float=None, tail:float=0.0) -> np.ndarray:
+        """
+        Render a time-sorted stream of messages to audio.
+
+        Args
+            messages (iterable): (time, path, args) tuples, time in seconds from the start of the stream
+            until (float): render up to this time, defaults to the last message plus tail
+            tail (float): seconds to render after the last message
+
+        Returns
+            np.ndarray: float32 mono audio
+        """
+        blocks = []
+        sr, bs = self.sample_rate, self.block_size
+        sample = int(round(self.time * sr))
+        for t, path, args in messages:
+            target = int(t * sr)
+            if target >= sample + bs:
+                n = (target - sample) // bs * bs
+                blocks.append(self.process(n))
+                sample += n
+            self.handle(path, *args)
+        end = int(round(until * sr)) if until is not None else sample + int(tail * sr)
+        if end > sample:
+            blocks.append(self.process(end - sample))
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+def render_log(file:str, tail:float=2.0, **kwargs) -> np.ndarray:
+    """
+    Render an MRP recording (.log) to audio.
+
+    Args
+        file (str): path to the recording
+        tail (float): seconds to render after the last message
+        **kwargs: passed to MRPSimulator
+
+    Returns
+        np.ndarray: float32 mono audio at MRPSimulator.sample_rate
+    """
+    sim = MRPSimulator(**kwargs)
+    return sim.render(iter_log_messages(file), tail=tail)
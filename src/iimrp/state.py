@@ -0,0 +1,290 @@
+'''
+Compact, array-based MRP state, folded from OSC messages.
+
+MRPState mirrors what the MRP software holds: which notes are on, their qualities and
+raw harmonics, the pedals and the UI volume. It is indexed by MIDI note number (0-127),
+so it does not depend on the range of an `MRP` instance, and is cheap to copy, which
+makes it suitable for checkpoints of a recording.
+
+Example
+    state = MRPState()
+    for t, path, args in iter_log_messages('session.log'):
+        state.apply(path, *args)
+    state.messages() # messages that recreate the state from all notes off
+    state.diff(MRPState.from_mrp(mrp)) # fewest messages that bring state to the MRP's
+'''
+
+import numpy as np
+
+STATE_QUALITIES = ('brightness', 'intensity', 'pitch', 'pitch_vibrato', 'harmonic')
+STATE_H = 32 # values in /mrp/quality/harmonics/raw
+STATE_PEDALS = ('damper', 'sostenuto')
+STATE_UI = ('volume', 'volume_raw')
+NOTE_ON_STATUS = 0x9F
+NOTE_OFF_STATUS = 0x8F
+STATE_BUNDLE_BYTES = 1400 # bundle size that fits a 1500 byte MTU UDP datagram
+
+class MRPState:
+    """
+    Note, quality, pedal and UI state of the MRP.
+
+    Attributes
+        on (np.ndarray): (128,) bool, note is on
+        velocity (np.ndarray): (128,) int, last note on velocity
+        channel (np.ndarray): (128,) int, last MIDI channel of a note's messages
+        qualities (np.ndarray): (128, len(STATE_QUALITIES)) float
+        harmonics (np.ndarray): (128, STATE_H) float, raw harmonics
+        n_harmonics (np.ndarray): (128,) int, number of raw harmonics set, 0 if none
+        pedal (dict): damper and sostenuto values
+        ui (dict): volume and volume_raw values, None if never set
+        order (list): notes that are on, oldest first (the MRP voice order)
+    """
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        """Return to the state after /mrp/allnotesoff, keeping pedals and UI."""
+        self.on = np.zeros(128, dtype=bool)
+        self.velocity = np.zeros(128, dtype=np.int16)
+        self.channel = np.full(128, 15, dtype=np.int16)
+        self.qualities = np.zeros((128, len(STATE_QUALITIES)))
+        self.harmonics = np.zeros((128, STATE_H))
+        self.n_harmonics = np.zeros(128, dtype=np.int16)
+        self.order = []
+        if not hasattr(self, 'pedal'):
+            self.pedal = {p: 0.0 for p in STATE_PEDALS}
+            self.ui = {u: None for u in STATE_UI}
+
+    @classmethod
+    def from_mrp(cls, mrp) -> 'MRPState':
+        """Snapshot the note table, voices, pedals and UI of an `MRP` instance."""
+        state = cls()
+        for note in mrp.notes:
+            n = note['midi']['number']
+            if not 0 <= n < 128: continue
+            state.on[n] = note['status']
+            state.velocity[n] = note['midi']['velocity']
+            state.channel[n] = note['channel']
+            state.qualities[n] = [note['qualities'][q] for q in STATE_QUALITIES]
+            harmonics = note['qualities']['harmonics_raw'][:STATE_H]
+            state.harmonics[n, :len(harmonics)] = harmonics
+            state.n_harmonics[n] = len(harmonics)
+        state.order = [n for n in mrp.voices if state.on[n]]
+        state.pedal = {p: float(mrp.pedal[p]) for p in STATE_PEDALS}
+        state.ui = {u: (None if mrp.ui[u] is None else float(mrp.ui[u])) for u in STATE_UI}
+        return state
+
+    def copy(self) -> 'MRPState':
+        """Return an independent copy."""
+        state = MRPState.__new__(MRPState)
+        state.on = self.on.copy()
+        state.velocity = self.velocity.copy()
+        state.channel = self.channel.copy()
+        state.qualities = self.qualities.copy()
+        state.harmonics = self.harmonics.copy()
+        state.n_harmonics = self.n_harmonics.copy()
+        state.order = list(self.order)
+        state.pedal = dict(self.pedal)
+        state.ui = dict(self.ui)
+        return state
+
+    def pack(self) -> dict:
+        """
+        Return the state as a dict of fixed-size arrays, e.g. for stacking snapshots.
+        Unset UI values are NaN, the voice order is padded with -1.
+        """
+        order = np.full(128, -1, dtype=np.int16)
+        order[:len(self.order)] = self.order
+        return {
+            'on': self.on.copy(), 'velocity': self.velocity.copy(), 'channel': self.channel.copy(),
+            'qualities': self.qualities.copy(), 'harmonics': self.harmonics.copy(),
+            'n_harmonics': self.n_harmonics.copy(), 'order': order,
+            'pedal': np.array([self.pedal[p] for p in STATE_PEDALS]),
+            'ui': np.array([np.nan if self.ui[u] is None else self.ui[u] for u in STATE_UI]),
+        }
+
+    @classmethod
+    def unpack(cls, arrays:dict) -> 'MRPState':
+        """Rebuild a state from the arrays returned by `pack`."""
+        state = cls.__new__(cls)
+        state.on = np.array(arrays['on'], dtype=bool)
+        state.velocity = np.array(arrays['velocity'], dtype=np.int16)
+        state.channel = np.array(arrays['channel'], dtype=np.int16)
+        state.qualities = np.array(arrays['qualities'], dtype=float)
+        state.harmonics = np.array(arrays['harmonics'], dtype=float)
+        state.n_harmonics = np.array(arrays['n_harmonics'], dtype=np.int16)
+        state.order = [int(n) for n in arrays['order'] if n >= 0]
+        state.pedal = dict(zip(STATE_PEDALS, np.asarray(arrays['pedal'], dtype=float).tolist()))
+        state.ui = {u: (None if np.isnan(v) else float(v)) for u, v in zip(STATE_UI, arrays['ui'])}
+        return state
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MRPState): return NotImplemented
+        return (np.array_equal(self.on, other.on)
+            and np.array_equal(self.qualities, other.qualities)
+            and np.array_equal(self.n_harmonics, other.n_harmonics)
+            and np.array_equal(self.harmonics, other.harmonics)
+            and self.pedal == other.pedal and self.ui == other.ui)
+
+    def apply(self, path:str, *args):
+        """
+        Fold one MRP OSC message into the state. Unknown paths are ignored.
+        """
+        if path == '/mrp/midi':
+            status, note = int(args[0]), int(args[1])
+            velocity = int(args[2]) if len(args) > 2 else 0
+            if status & 0xF0 == 0x90 and velocity > 0:
+                if not self.on[note]:
+                    self.order.append(note)
+                self.on[note] = True
+                self.velocity[note] = velocity
+            elif status & 0xF0 in (0x80, 0x90):
+                if self.on[note]:
+                    self.order.remove(note)
+                self.on[note] = False
+            self.channel[note] = status & 0x0F
+        elif path.startswith('/mrp/quality/'):
+            channel, note = int(args[0]), int(args[1])
+            quality = path[len('/mrp/quality/'):].replace('/', '_')
+            if quality == 'harmonics_raw':
+                values = args[2:2 + STATE_H]
+                self.harmonics[note] = 0
+                self.harmonics[note, :len(values)] = values
+                self.n_harmonics[note] = len(values)
+            elif quality in STATE_QUALITIES:
+                self.qualities[note, STATE_QUALITIES.index(quality)] = float(args[2])
+            self.channel[note] = channel
+        elif path.startswith('/mrp/pedal/'):
+            pedal = path[len('/mrp/pedal/'):]
+            if pedal in self.pedal:
+                self.pedal[pedal] = float(args[0])
+        elif path.startswith('/ui/volume'):
+            self.ui[path[len('/ui/'):].replace('/', '_')] = float(args[0])
+        elif path == '/mrp/allnotesoff':
+            self.reset()
+
+    def apply_batch(self, batch, start:int=0, stop:int=None):
+        """
+        Fold records [start, stop) of a LogBatch (see `recording.py`) into the state.
+        """
+        for t, path, args in batch.select(slice(start, stop)).messages():
+            self.apply(path, *args)
+
+    def notes_on(self) -> list:
+        """Notes that are on, oldest first."""
+        return list(self.order)
+
+    def messages(self) -> list:
+        """
+        Return the (path, args) messages that recreate this state from all notes off:
+        pedals, UI, then each note on, oldest first, followed by its qualities.
+        """
+        msgs = [(f'/mrp/pedal/{p}', (v,)) for p, v in self.pedal.items() if v != 0]
+        msgs += [(f"/ui/{u.replace('_', '/')}", (v,)) for u, v in self.ui.items() if v is not None]
+        for note in self.order:
+            msgs += self.note_messages(note)
+        return msgs
+
+    def note_messages(self, note:int) -> list:
+        """Messages that turn a note on with its qualities and harmonics."""
+        channel = int(self.channel[note])
+        msgs = [('/mrp/midi', (NOTE_ON_STATUS & 0xF0 | channel, note, int(self.velocity[note])))]
+        for i, q in enumerate(STATE_QUALITIES):
+            if self.qualities[note, i] != 0:
+                msgs.append((f"/mrp/quality/{q.replace('_', '/')}", (channel, note, float(self.qualities[note, i]))))
+        if self.n_harmonics[note] > 0:
+            msgs.append(('/mrp/quality/harmonics/raw', (channel, note) + tuple(self.harmonics[note, :self.n_harmonics[note]].tolist())))
+        return msgs
+
+    def diff(self, target:'MRPState', allow_reset:bool=True) -> list:
+        """
+        Return the fewest (path, args) messages that bring this state to target.
+
+        Notes off in target are turned off first, freeing voices, then pedals and UI
+        are updated, then the notes of target are turned on (oldest first) and their
+        changed qualities sent. The voice order of notes on in both is not changed.
+
+        Args
+            target (MRPState): the state to reach
+            allow_reset (bool): start with /mrp/allnotesoff when that needs fewer messages
+        """
+        msgs = self._diff(target)
+        if allow_reset:
+            fresh = self.copy()
+            fresh.reset()
+            reset = [('/mrp/allnotesoff', ())] + fresh._diff(target)
+            if len(reset) < len(msgs):
+                return reset
+        return msgs
+
+    def _diff(self, target:'MRPState') -> list:
+        msgs = [('/mrp/midi', (NOTE_OFF_STATUS & 0xF0 | int(self.channel[note]), note, 0))
+                for note in self.order if not target.on[note]]
+        msgs += [(f'/mrp/pedal/{p}', (v,)) for p, v in target.pedal.items() if v != self.pedal[p]]
+        msgs += [(f"/ui/{u.replace('_', '/')}", (v,)) for u, v in target.ui.items()
+                 if v is not None and v != self.ui[u]]
+        for note in target.order:
+            channel = int(target.channel[note])
+            if not self.on[note]:
+                msgs.append(('/mrp/midi', (NOTE_ON_STATUS & 0xF0 | channel, note, int(target.velocity[note]))))
+            for i in np.flatnonzero(target.qualities[note] != self.qualities[note]):
+                q = STATE_QUALITIES[i]
+                msgs.append((f"/mrp/quality/{q.replace('_', '/')}", (channel, note, float(target.qualities[note, i]))))
+            n = target.n_harmonics[note]
+            if n != self.n_harmonics[note] or not np.array_equal(target.harmonics[note, :n], self.harmonics[note, :n]):
+                msgs.append(('/mrp/quality/harmonics/raw', (channel, note) + tuple(target.harmonics[note, :n].tolist())))
+        return msgs
+
+    def sync_mrp(self, mrp):
+        """
+        Overwrite the note table and voices of an `MRP` instance with this state,
+        without sending anything.
+        """
+        mrp.init_notes()
+        for note in mrp.notes:
+            n = note['midi']['number']
+            if not 0 <= n < 128: continue
+            note['status'] = bool(self.on[n])
+            note['midi']['velocity'] = int(self.velocity[n])
+            for i, q in enumerate(STATE_QUALITIES):
+                note['qualities'][q] = float(self.qualities[n, i])
+            note['qualities']['harmonics_raw'] = self.harmonics[n, :self.n_harmonics[n]].tolist()
+        mrp.voices = [n for n in self.order if mrp.note_is_in_range(n)]
+        mrp.pedal.update(self.pedal)
+
+def _padded(n:int) -> int:
+    return (n + 3) & ~3
+
+def osc_message_size(path:str, args:tuple) -> int:
+    """Size in bytes of an OSC message, with int and float arguments 32 bit."""
+    size = _padded(len(path.encode()) + 1) + _padded(len(args) + 2) # path, ',' and type tags
+    for a in args:
+        if isinstance(a, bool) or a is None:
+            continue
+        elif isinstance(a, str):
+            size += _padded(len(a.encode()) + 1)
+        elif isinstance(a, bytes):
+            size += 4 + _padded(len(a))
+        else:
+            size += 4
+    return size
+
+def bundle_messages(messages:list, max_bytes:int=STATE_BUNDLE_BYTES) -> list:
+    """
+    Split (path, args) messages, in order, into bundles of at most max_bytes each
+    (as encoded OSC bundles). A message larger than max_bytes gets a bundle of its own.
+
+    Returns
+        list of lists of (path, args)
+    """
+    bundles, bundle, size = [], [], 16 # '#bundle' and the time tag
+    for path, args in messages:
+        n = 4 + osc_message_size(path, args) # element size and message
+        if bundle and size + n > max_bytes:
+            bundles.append(bundle)
+            bundle, size = [], 16
+        bundle.append((path, args))
+        size += n
+    if bundle:
+        bundles.append(bundle)
+    return bundles
@@ -1,59 +1,156 @@
 """Utilities for working with MRP recording files and dataframes.
+
+pandas and tqdm are imported by the functions that use them, so importing this module is cheap.
 """
 
+from __future__ import annotations
+
 import os
 import pickle
-import pandas as pd
+import numpy as np
 from datetime import datetime
-from mido import MidiFile, MidiTrack, Message
-from tqdm.auto import tqdm
+from concurrent.futures import ProcessPoolExecutor
+
+from .midi import write_midi, DEFAULT_TEMPO
+from .recording import LogBatch, concat_batches, read_log, write_log, save_recording, load_recording
 
 dt = lambda: f"{datetime.now().strftime('%Y_%m_%d-%H%M%S')}"
 
 def mrp_to_df(file: str):
+    import pandas as pd
     return pd.read_csv(file,
         names=('time', 'osc', 'types', 'v0', 'v1', 'v2'), 
         converters={'time':float, 'osc':str, 'types':str, 'v0':float, 'v1':float, 'v2':float},
         sep='\s+')
 
+def format_mrp_rows(columns: list) -> list[str]:
+    """Format MRP columns (time, path, types, then one column per argument) as log lines.
+
+    Rows are grouped by (path, types) and each group is formatted with one format string,
+    'i' arguments as integers and 'f' arguments with 5 decimals. Arguments beyond the
+    length of a row's types are left out.
+
+    Args:
+        columns (list): Equal-length arrays, in the order of the MRP DataFrame columns.
+
+    Returns:
+        list[str]: One line per row, without newlines.
+    """
+    import pandas as pd
+    times, paths, types = (np.asarray(c) for c in columns[:3])
+    args = [np.asarray(c) for c in columns[3:]]
+    path_codes, path_names = pd.factorize(paths)
+    type_codes, type_names = pd.factorize(types)
+    type_names = [''] + list(type_names) # missing types (-1) have no arguments
+    codes, groups = pd.factorize(path_codes * len(type_names) + type_codes + 1)
+    rows = np.empty(len(times), dtype=object)
+    for k, group in enumerate(groups):
+        index = np.flatnonzero(codes == k)
+        path, tags = path_names[group // len(type_names)], type_names[group % len(type_names)]
+        fmt = ' '.join(['%.5f', path] + ([tags] if tags else []) + ['%d' if c == 'i' else '%.5f' for c in tags])
+        values = [times[index].astype(float).tolist()] + [args[a][index].astype(float).tolist() for a in range(len(tags))]
+        rows[index] = [fmt % row for row in zip(*values)]
+    return rows.tolist()
+
 def df_to_mrp(df: pd.DataFrame, file: str):
+    """Write an MRP DataFrame to a .log file in a single buffered write.
+
+    Args:
+        df (pd.DataFrame): MRP DataFrame (time, path, types, then arguments), e.g. from `gen_events_to_df`.
+        file (str): Output .log path.
+
+    Returns:
+        list[str]: The written lines.
+    """
     print(f"Writing to {file}")
     df['time'] = df['time'].round(5)
-    rows_str = df.astype(str).agg(' '.join, axis=1)
+    rows_list = format_mrp_rows([df[c].to_numpy() for c in df.columns])
     with open(file, 'w') as f:
-        for row in rows_str:
-            f.write(f"{row}\n")
-    rows_list = rows_str.tolist()
+        f.write('\n'.join(rows_list) + '\n' if rows_list else '')
     return rows_list
 
+def gen_events_to_arrays(gen_events: dict) -> dict:
+    """Convert a dictionary of generated events to MRP log columns.
+
+    Events are dicts keyed by time. Note events have 'pitch' and 'vel' (note off if vel is 0),
+    quality events have 'pitch', 'quality' (e.g. 'intensity' or 'pitch/vibrato') and 'value'.
+
+    Args:
+        gen_events (dict): Dictionary of generated events.
+
+    Returns:
+        dict: time, osc, types, v0, v1, v2 arrays, in the order of the events.
+    """
+    n = len(gen_events)
+    events = list(gen_events.values())
+    times = np.fromiter(gen_events.keys(), dtype=float, count=n).round(5)
+    pitch = np.fromiter((e['pitch'] for e in events), dtype=np.int64, count=n)
+    vel = np.fromiter((e.get('vel', 0) for e in events), dtype=float, count=n)
+    value = np.fromiter((e.get('value', 0) for e in events), dtype=float, count=n)
+    quality = np.array([e.get('quality', '') for e in events], dtype=object)
+    is_quality = quality != ''
+    note_on = ~is_quality & (vel > 0)
+    names, codes = np.unique(quality[is_quality].astype(str), return_inverse=True)
+    osc = np.full(n, '/mrp/midi', dtype=object)
+    osc[is_quality] = np.array([f"/mrp/quality/{q.replace('_', '/')}" for q in names], dtype=object)[codes]
+    return {
+        'time': times,
+        'osc': osc,
+        'types': np.where(is_quality, 'iif', 'iii').astype(object),
+        'v0': np.where(is_quality, 15, np.where(note_on, 159, 143)),
+        'v1': pitch,
+        'v2': np.where(is_quality, value.round(5), np.where(note_on, 127, 0)),
+    }
+
 def gen_events_to_df(gen_events: dict, columns: list):
-    note_on = lambda t, p, i: pd.Series([round(t,5), '/mrp/midi', 'iii', 159, p, 127], index=i)
-    note_off = lambda t, p, i: pd.Series([round(t,5), '/mrp/midi', 'iii', 143, p, 0], index=i)
-    quality = lambda t, n, p, q, v: pd.Series([round(t,5), f'/mrp/quality/{n}', 'iif', 15, p, round(v, 5)], index=q)
-    rows = []
-    for t, event in tqdm(gen_events.items(), total=len(gen_events)):
-        if event['vel'] > 0:
-            rows.append(note_on(t, event['pitch'], columns))
-        else:
-            rows.append(note_off(t, event['pitch'], columns))
-    return pd.DataFrame(rows, columns=columns)
+    """Convert a dictionary of generated events to an MRP DataFrame (see `gen_events_to_arrays`).
+
+    Args:
+        gen_events (dict): Dictionary of generated events.
+        columns (list): Names of the six DataFrame columns.
+
+    Returns:
+        pd.DataFrame: One row per event.
+    """
+    import pandas as pd
+    arrays = gen_events_to_arrays(gen_events)
+    return pd.DataFrame(dict(zip(columns, arrays.values())), columns=columns)
 
 def gen_events_to_midi(events: dict, file: str):
+    """Write a dictionary of generated events to a MIDI file (see `gen_events_to_midi_file`).
+
+    Args:
+        events (dict): Dictionary of generated events, written in key order.
+        file (str): File name prefix; a timestamp and .mid are appended.
+
+    Returns:
+        mido.MidiFile: The written MIDI file.
+    """
+    from mido import MidiFile
+    return MidiFile(gen_events_to_midi_file(events, file))
+
+def gen_events_to_midi_file(events: dict, file: str) -> str:
+    """Write a dictionary of generated events to a MIDI file, with each event's 'time' as its delta in seconds.
+
+    Args:
+        events (dict): Dictionary of generated events, written in key order.
+        file (str): File name prefix; a timestamp and .mid are appended.
+
+    Returns:
+        str: Path of the written MIDI file.
+    """
     file = f'{file}_{dt()}.mid'
     print(f"Writing to {file}")
-    mid = MidiFile()
-    track = MidiTrack()
-    mid.tracks.append(track)
-    ticks_per_second = mid.ticks_per_beat / (500000 / 1000000)
-    for k in tqdm(sorted(events)):
-        event = events[k]
-        delta_ticks = int(event['time'] * ticks_per_second)
-        if event['vel'] < 0.5: track.append(Message(
-                 'note_off', note=event['pitch'], velocity=100, time=delta_ticks))
-        else: track.append(Message(
-                 'note_on', note=event['pitch'], velocity=int(event['vel']+0.5), time=delta_ticks))
-    mid.save(file)
-    return mid
+    ticks_per_beat = 480
+    ticks_per_second = ticks_per_beat / (DEFAULT_TEMPO / 1000000)
+    ordered = [events[k] for k in sorted(events)]
+    delta = np.array([e['time'] for e in ordered], dtype=float)
+    vel = np.array([e['vel'] for e in ordered], dtype=float)
+    pitch = np.array([e['pitch'] for e in ordered], dtype=np.int64)
+    note_on = vel >= 0.5
+    write_midi(file, np.cumsum((delta * ticks_per_second).astype(np.int64)), np.where(note_on, 0x90, 0x80),
+        pitch, np.where(note_on, (vel + 0.5).astype(np.int64), 100), ticks_per_beat, DEFAULT_TEMPO)
+    return file
 
 def gen_events_to_mrp(events: dict, dfcols: list, file: str, pkl: bool=False, midi: bool=False) -> tuple[pd.DataFrame, list]:
     """Convert a dictionary of generated events to a DataFrame and MRP file.
@@ -72,7 +169,7 @@ def gen_events_to_mrp(events: dict, dfcols: list, file: str, pkl: bool=False, mi
     df = gen_events_to_df(events, dfcols)
     rows = df_to_mrp(df, f"{file}.log")
     if pkl: save_pkl(df, f"{file}.pkl")
-    if midi: gen_events_to_midi(events, file)
+    if midi: gen_events_to_midi_file(events, file)
     return df, rows
 
 def ext_files_in_dir(directory, ext=".txt"):
@@ -87,8 +184,44 @@ def save_pkl(data, file):
 def load_pkl(file):
     with open(file, 'rb') as f:
         return pickle.load(f)
+
+def log_to_recording(file: str, out_file: str=None, format: str='npy') -> str:
+    """Convert an MRP text log to the columnar binary recording format.
+
+    Args:
+        file (str): Path to the .log file.
+        out_file (str, optional): Output path. Defaults to file with the extension replaced (a directory for 'npy').
+        format (str, optional): 'npy', 'npz' or 'parquet' (see `recording.save_recording`). Defaults to 'npy'.
+
+    Returns:
+        str: Path of the saved recording.
+    """
+    if out_file is None:
+        out_file = os.path.splitext(file)[0] + ('' if format == 'npy' else f'.{format}')
+        if out_file == file: out_file += '.rec'
+    print(f"Writing to {out_file}")
+    save_recording(read_log(file), out_file, format)
+    return out_file
+
+def recording_to_log(file: str, out_file: str=None) -> str:
+    """Convert a binary recording back to the MRP text log format.
+
+    Args:
+        file (str): Path to the recording saved by `log_to_recording`.
+        out_file (str, optional): Output .log path. Defaults to file with a .log extension.
+
+    Returns:
+        str: Path of the saved log.
+    """
+    if out_file is None:
+        out_file = os.path.splitext(file.rstrip('/'))[0] + '.log'
+    print(f"Writing to {out_file}")
+    write_log(load_recording(file), out_file)
+    return out_file
     
 def concat_mrp_dfs(filepaths: list[str], save: bool=False, out_file: str=None) -> pd.DataFrame:
+    import pandas as pd
+    from tqdm.auto import tqdm
     dfs = []
     total_last_time = 0
     for i, file in enumerate(tqdm(filepaths, desc="Loading and adjusting MRP DFs")):
@@ -111,7 +244,59 @@ def concat_mrp_dfs(filepaths: list[str], save: bool=False, out_file: str=None) -
         df_to_mrp(df, out_file)
     return df
 
+def load_mrp_files(filepaths: list[str], workers: int=None, df: bool=False, concat: bool=True):
+    """Load many MRP recordings in parallel and concatenate them end to end.
+
+    Files are parsed concurrently in a process pool. Each file's times are then offset by the
+    summed durations (last event times) of the files before it, as in `concat_mrp_dfs`, and the
+    results are concatenated with a single copy.
+
+    Args:
+        filepaths (list[str]): Recordings, in playback order (.log, or binary with df=False).
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+        df (bool, optional): Load DataFrames with `mrp_to_df` instead of LogBatches. Defaults to False.
+        concat (bool, optional): Concatenate the files; otherwise return the list of loaded files. Defaults to True.
+
+    Returns:
+        LogBatch | pd.DataFrame | list: The concatenated recordings, or one per file.
+    """
+    loader = mrp_to_df if df else load_recording
+    workers = min(workers or os.cpu_count() or 1, len(filepaths))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            loaded = list(pool.map(loader, filepaths))
+    else:
+        loaded = [loader(f) for f in filepaths]
+    if not concat:
+        return loaded
+    lengths = [len(x) for x in loaded]
+    durations = [float(np.asarray(x['time'])[-1]) if n else 0.0 for x, n in zip(loaded, lengths)]
+    offsets = np.cumsum([0.0] + durations[:-1])
+    if not df:
+        return concat_batches(loaded, offsets)
+    import pandas as pd
+    result = pd.concat(loaded, ignore_index=True)
+    result['time'] = result['time'].to_numpy() + np.repeat(offsets, lengths)
+    return result
+
+def load_mrp_dir(directory: str, ext: str=".log", workers: int=None, df: bool=False):
+    """Load all recordings with extension ext in a directory, in name order (see `load_mrp_files`).
+
+    Args:
+        directory (str): Directory of recordings.
+        ext (str, optional): File extension. Defaults to ".log".
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+        df (bool, optional): Load DataFrames instead of LogBatches. Defaults to False.
+
+    Returns:
+        LogBatch | pd.DataFrame: The concatenated recordings.
+    """
+    files = [os.path.join(directory, f) for f in sorted(ext_files_in_dir(directory, ext))]
+    return load_mrp_files(files, workers, df)
+
 def concat_dfs(dfs: list[pd.DataFrame], save: bool=False, out_file: str=None) -> pd.DataFrame:
+    import pandas as pd
+    from tqdm.auto import tqdm
     dfs = [df.copy() for df in dfs]
     total_last_time = 0
     for i, df in enumerate(tqdm(dfs, total=len(dfs), desc="Loading and adjusting MRP DFs")):
@@ -131,15 +316,77 @@ def concat_dfs(dfs: list[pd.DataFrame], save: bool=False, out_file: str=None) ->
         df_to_mrp(df, out_file)
     return df
 
-def reduce_gap(df, max_gap=20, min_gap=10):
+GAP_POLICIES = ('fixed', 'cap', 'scale')
+
+def reduce_gap_times(times, max_gap: float=20, min_gap: float=10, policy: str='fixed', scale: float=0.5, prev_time: float=None) -> np.ndarray:
+    """Shorten the gaps between consecutive times that are longer than max_gap.
+
+    Args:
+        times (array-like): Event times, in order.
+        max_gap (float, optional): Gaps longer than this are shortened. Defaults to 20.
+        min_gap (float, optional): Length of a shortened gap with the 'fixed' policy. Defaults to 10.
+        policy (str, optional): 'fixed' sets long gaps to min_gap, 'cap' clips them to max_gap,
+            'scale' multiplies them by scale. Defaults to 'fixed'.
+        scale (float, optional): Factor for the 'scale' policy. Defaults to 0.5.
+        prev_time (float, optional): Original time of the event before times[0], to include the gap
+            before the first event (used for chunked logs). Defaults to None.
+
+    Returns:
+        np.ndarray: The time reduction to subtract from each time.
+    """
+    times = np.asarray(times, dtype=float)
+    gaps = np.diff(times, prepend=times[0] if prev_time is None else prev_time)
+    long = gaps > max_gap
+    if policy == 'fixed':
+        new_gaps = np.full_like(gaps, min_gap)
+    elif policy == 'cap':
+        new_gaps = np.full_like(gaps, max_gap)
+    elif policy == 'scale':
+        new_gaps = gaps * scale
+    else:
+        raise ValueError(f"reduce_gap(): unknown policy '{policy}', expected one of {GAP_POLICIES}")
+    return np.cumsum(np.where(long, gaps - new_gaps, 0))
+
+def reduce_gap(df, max_gap=20, min_gap=10, policy='fixed', scale=0.5):
+    """Shorten long silences in an MRP DataFrame, in one vectorized pass over the time column.
+
+    Args:
+        df (pd.DataFrame): MRP DataFrame with a 'time' column, in order.
+        max_gap (float, optional): Gaps longer than this are shortened. Defaults to 20.
+        min_gap (float, optional): Length of a shortened gap with the 'fixed' policy. Defaults to 10.
+        policy (str, optional): 'fixed', 'cap' or 'scale' (see `reduce_gap_times`). Defaults to 'fixed'.
+        scale (float, optional): Factor for the 'scale' policy. Defaults to 0.5.
+
+    Returns:
+        pd.DataFrame: A copy of df with adjusted times.
+    """
     df = df.copy()
     df.reset_index(drop=True, inplace=True)
-    g = max_gap
-    for i in range(len(df) - 1):
-        current_time = df.loc[i, 'time']
-        next_time = df.loc[i + 1, 'time']
-        if next_time - current_time > g:
-            gap_size = next_time - current_time 
-            df.loc[i + 1:, 'time'] -= gap_size - min_gap
+    if len(df):
+        df['time'] = df['time'].to_numpy() - reduce_gap_times(df['time'].to_numpy(), max_gap, min_gap, policy, scale)
     return df
 
+def reduce_gap_stream(chunks, max_gap=20, min_gap=10, policy='fixed', scale=0.5):
+    """Shorten long silences in a chunked log, carrying the reduction across chunk boundaries.
+
+    Args:
+        chunks (iterable): DataFrames (e.g. `pd.read_csv(..., chunksize=n)`) or LogBatches (e.g. `recording.iter_log`).
+        max_gap, min_gap, policy, scale: As in `reduce_gap`.
+
+    Yields:
+        pd.DataFrame | LogBatch: Each chunk with adjusted times.
+    """
+    prev_time, offset = None, 0.0
+    for chunk in chunks:
+        if len(chunk) == 0:
+            yield chunk
+            continue
+        original = np.asarray(chunk['time'], dtype=float)
+        times = original - (offset + reduce_gap_times(original, max_gap, min_gap, policy, scale, prev_time))
+        prev_time, offset = original[-1], original[-1] - times[-1]
+        if isinstance(chunk, LogBatch):
+            chunk = LogBatch({**chunk.columns, 'time': times}, chunk.vectors, chunk.paths)
+        else:
+            chunk = chunk.copy()
+            chunk['time'] = times
+        yield chunk
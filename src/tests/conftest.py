@@ -0,0 +1,53 @@
+import time
+import threading
+import pytest
+
+from pythonosc.udp_client import SimpleUDPClient
+
+from iimrp.iimrp import MRP
+
+class DummyOSC:
+    """
+    The part of the iipyper OSC interface used by MRP, recording instead of sending.
+
+    Attributes
+        sent (list): (path, *args) of each message
+        sent_to (list): client name of each message
+        sent_at (list): time.perf_counter() of each message
+        threads (set): idents of the threads that sent
+    """
+    def __init__(self):
+        self.clients = {}
+        self.sent, self.sent_to, self.sent_at = [], [], []
+        self.threads = set()
+    def get_client_by_name(self, name):
+        return self.clients.get(name)
+    def create_client(self, name, ip, port):
+        self.clients[name] = (ip, port)
+    def send(self, *args, client=None):
+        self.sent.append(args)
+        self.sent_to.append(client)
+        self.sent_at.append(time.perf_counter())
+        self.threads.add(threading.get_ident())
+    def clear(self):
+        for record in (self.sent, self.sent_to, self.sent_at):
+            record.clear()
+
+class UDPOSC(DummyOSC):
+    """The part of the iipyper OSC interface used by MRP, sending with python-osc clients."""
+    def create_client(self, name, ip, port):
+        self.clients[name] = SimpleUDPClient(ip, port)
+    def send(self, path, *args, client=None):
+        self.clients[client].send_message(path, list(args))
+
+@pytest.fixture
+def osc():
+    return DummyOSC()
+
+@pytest.fixture
+def udp_osc():
+    return UDPOSC()
+
+@pytest.fixture
+def mrp(osc):
+    return MRP(osc)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from iimrp.recording import parse_log_lines, write_log
+from iimrp.analytics import *
+
+LOG = """0.00000 /mrp/allnotesoff
+1.00000 /mrp/midi iii 159 21 1
+2.00000 /mrp/midi iii 159 22 1
+2.50000 /mrp/midi iii 159 22 1
+3.00000 /mrp/midi iii 143 21 0
+4.00000 /mrp/midi iii 159 60 1
+4.00000 /mrp/quality/intensity iif 15 60 0.50000
+4.50000 /mrp/quality/intensity iif 15 60 0.60000
+6.00000 /mrp/allnotesoff
+7.00000 /mrp/midi iii 159 40 1
+10.00000 /mrp/pedal/damper f 1.00000
+""".splitlines()
+
+def test_note_intervals():
+    notes, start, stop, velocity = note_intervals(parse_log_lines(LOG))
+    assert notes.tolist() == [21, 22, 60, 40]
+    assert start.tolist() == [1, 2, 4, 7]
+    assert stop.tolist() == [3, 6, 6, 10]
+
+def test_analyze():
+    stats = analyze(parse_log_lines(LOG), voices_max=1)
+    assert stats.duration == 10
+    assert stats.key_on_time[[21, 22, 60, 40]].tolist() == [2, 4, 2, 3]
+    assert stats.key_note_ons[22] == 1
+    # board 0 is notes 21-38, board 1 39-56, board 2 57-74
+    assert stats.board_on_time[:3].tolist() == [6, 3, 2]
+    assert stats.board_active_time[:3].tolist() == [5, 3, 2]
+    assert stats.board_duty[0] == pytest.approx(0.5)
+    assert stats.peak_polyphony == 2
+    assert stats.polyphony_time[:3].tolist() == [2, 5, 3]
+    assert stats.time_over_voices == 3
+    assert stats.messages['/mrp/midi'] == 6
+    assert stats.rate_hist['/mrp/midi'].sum() == 11
+    assert stats.rate_hist['/mrp/quality/intensity'][2] == 1
+
+def test_analyze_files(tmp_path):
+    files = []
+    for i in range(3):
+        files.append(str(tmp_path / f'{i}.log'))
+        write_log(parse_log_lines(LOG), files[-1])
+    stats = analyze_files(files, workers=2)
+    single = analyze(files[0])
+    assert stats.files == 3
+    assert stats.duration == 3 * single.duration
+    np.testing.assert_allclose(stats.key_on_time, 3 * single.key_on_time)
+    np.testing.assert_allclose(stats.board_duty, single.board_duty)
+    assert stats.messages['/mrp/midi'] == 18
+    assert stats.summary()['peak_polyphony'] == 2
+    with pytest.raises(ValueError):
+        analyze_files([])
@@ -0,0 +1,80 @@
+import pytest
+
+from iimrp.cluster import *
+
+def sent(osc):
+    return [(client, *args) for client, args in zip(osc.sent_to, osc.sent)]
+
+def cluster(osc, policy, **kwargs):
+    return MRPCluster(osc, [
+        {'name': 'a', 'address': {'port': 7771}, 'range': {'start': 21, 'end': 64}, 'voices': {'max': 2}},
+        {'name': 'b', 'address': {'port': 7772}, 'range': {'start': 60, 'end': 108}, 'voices': {'max': 2}},
+    ], policy=policy, **kwargs)
+
+def test_instruments(osc):
+    c = cluster(osc, 'split')
+    assert c.osc.clients == {'a': ('127.0.0.1', 7771), 'b': ('127.0.0.1', 7772)}
+    assert c['b'].settings['range'] == {'start': 60, 'end': 108}
+    assert c['b'].settings['voices'] == {'max': 2, 'rule': 'oldest'}
+    assert c.polyphony() == 4
+    with pytest.raises(ValueError):
+        cluster(osc, 'loudest')
+
+def test_split(osc):
+    c = cluster(osc, 'split')
+    c.note_on(48)
+    c.note_on(62) # in both ranges: the first wins
+    c.note_on(72)
+    c.note_on(10) # out of every range
+    assert c.voices() == {'a': [48, 62], 'b': [72]}
+    c.set_note_quality(72, 'brightness', 0.5)
+    c.note_off(48)
+    assert sent(c.osc) == [('a', '/mrp/midi', 159, 48, 1), ('a', '/mrp/midi', 159, 62, 1), ('b', '/mrp/midi', 159, 72, 1),
+                           ('b', '/mrp/quality/brightness', 15, 72, 0.5), ('a', '/mrp/midi', 143, 48, 0)]
+    assert c.note_off(48) is None and c.note_on(62) is None
+
+def test_round_robin(osc):
+    c = cluster(osc, 'round_robin')
+    for note in (60, 61, 62, 63):
+        c.note_on(note)
+    assert c.voices() == {'a': [60, 62], 'b': [61, 63]}
+    c.note_off(61)
+    c.note_on(64) # a is full: b has a free voice
+    assert c.voices() == {'a': [60, 62], 'b': [63, 64]}
+    c.note_on(50) # only a: steals a voice from its pool
+    assert c.voices() == {'a': [62, 50], 'b': [63, 64]}
+    assert c.instrument_of(60) is None and c.note_off(60) is None
+    assert c.get_notes_on() == [50, 62, 63, 64]
+
+def test_least_loaded(osc):
+    c = cluster(osc, 'least_loaded')
+    c['a'].settings['voices']['max'] = 4
+    for note in (60, 61, 62):
+        c.note_on(note)
+    assert c.voices() == {'a': [60, 62], 'b': [61]}
+
+def test_coolest(osc):
+    c = MRPCluster(osc, [{'name': 'a', 'heat_monitor': True}, {'name': 'b', 'heat_monitor': True}], policy='coolest')
+    c['a'].heat_monitor.notes[c['a'].note_index(60)].heat_score = 50
+    c.note_on(60)
+    c.note_on(62)
+    assert c.voices() == {'a': [62], 'b': [60]}
+
+def test_fan_out(osc):
+    c = cluster(osc, 'split')
+    for note in (48, 50, 72, 74):
+        c.note_on(note)
+    c.osc.clear()
+    assert c.set_notes_qualities({48: {'intensity': 0.5}, 74: {'brightness': 0.25, 'pitch': 0.1}, 90: {'intensity': 1.0}}) == 2
+    assert sorted(sent(c.osc)) == [('a', '/mrp/quality/intensity', 15, 48, 0.5),
+                                   ('b', '/mrp/quality/brightness', 15, 74, 0.25), ('b', '/mrp/quality/pitch', 15, 74, 0.1)]
+    c.osc.clear()
+    c.set_quality('brightness', 1.0)
+    assert sorted(m[:4] for m in sent(c.osc)) == [('a', '/mrp/quality/brightness', 15, 48), ('a', '/mrp/quality/brightness', 15, 50),
+                                                  ('b', '/mrp/quality/brightness', 15, 72), ('b', '/mrp/quality/brightness', 15, 74)]
+    assert len(c.pedal_damper(1.0)) == 2
+    assert len(c.osc.threads) > 1 # sent from the workers
+    c.all_notes_off()
+    assert c.get_notes_on() == [] and c.routes == {}
+    assert c.stats()['voices'] == 0
+    c.cleanup()
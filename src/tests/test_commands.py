@@ -0,0 +1,79 @@
+import threading
+import pytest
+
+from iimrp.commands import *
+
+def test_order(mrp):
+    queue = MRPCommandQueue(mrp)
+    queue.note_on(60)
+    queue.set_note_qualities(60, {'brightness': 0.5, 'harmonics_raw': [0.1, 0.2]})
+    queue.pedal_damper(1.0)
+    queue.note_off(60)
+    assert mrp.osc.sent == []
+    assert queue.dispatch() == 5
+    assert mrp.osc.sent == [('/mrp/midi', 159, 60, 1), ('/mrp/quality/brightness', 15, 60, 0.5),
+                            ('/mrp/quality/harmonics/raw', 15, 60, 0.1, 0.2), ('/mrp/pedal/damper', 1.0),
+                            ('/mrp/midi', 143, 60, 0)]
+
+def test_coalesce(mrp):
+    queue = MRPCommandQueue(mrp)
+    queue.note_on(60)
+    queue.note_on(62)
+    for v in (0.1, 0.2, 0.3):
+        queue.set_note_quality(60, 'brightness', v)
+        queue.set_note_quality(62, 'intensity', v / 10, relative=True)
+    queue.set_note_quality(60, 'intensity', 0.5)
+    queue.set_note_quality(60, 'intensity', 0.25, relative=True)
+    queue.set_note_quality(60, 'harmonics_raw', [0.5])
+    queue.set_note_quality(60, 'harmonics_raw', [1.0, 0.5])
+    queue.dispatch()
+    assert mrp.osc.sent[2:] == [('/mrp/quality/brightness', 15, 60, 0.3), ('/mrp/quality/intensity', 15, 62, pytest.approx(0.06)),
+                                ('/mrp/quality/intensity', 15, 60, 0.75), ('/mrp/quality/harmonics/raw', 15, 60, 1.0, 0.5)]
+    assert queue.stats()['coalesced'] == 6
+
+def test_barriers(mrp):
+    queue = MRPCommandQueue(mrp)
+    queue.note_on(60)
+    queue.set_note_quality(60, 'brightness', 0.1)
+    queue.note_off(60)
+    queue.set_note_quality(60, 'brightness', 0.2) # note is off: not sent
+    queue.note_on(60)
+    queue.set_note_quality(60, 'brightness', 0.3)
+    queue.all_notes_off()
+    queue.note_on(60)
+    queue.set_note_quality(60, 'brightness', 0.4)
+    queue.dispatch()
+    assert [a[-1] for a in mrp.osc.sent if a[0] == '/mrp/quality/brightness'] == [0.1, 0.3, 0.4]
+    assert queue.stats()['coalesced'] == 0
+
+def test_submit_and_errors(mrp):
+    with MRPCommandQueue(mrp, interval=0.001) as queue:
+        queue.note_on(60)
+        assert queue.submit('get_notes_on').result(timeout=1) == [60]
+        failed = queue.submit('note_on', 'not a note')
+        with pytest.raises(Exception):
+            failed.result(timeout=1)
+        queue.put('no_such_method')
+        assert queue.flush(timeout=1)
+    assert queue.stats()['errors'] == 2
+
+def test_producers(mrp):
+    queue = MRPCommandQueue(mrp, interval=0.0005).start()
+    def produce(notes):
+        for i in range(300):
+            note = notes[i % len(notes)]
+            queue.note_on(note)
+            queue.set_note_quality(note, 'intensity', i / 300)
+            queue.set_note_quality(note, 'brightness', 0.01, relative=True)
+            if i % 3:
+                queue.note_off(note)
+        queue.flush()
+    threads = [threading.Thread(target=produce, args=(list(range(36 + 8 * k, 44 + 8 * k)),)) for k in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    queue.stop()
+    s = queue.stats()
+    assert s['errors'] == 0 and s['pending'] == 0
+    assert s['enqueued'] == 4 * (300 * 3 + 200)
+    assert sorted(mrp.voices) == mrp.note_on_numbers() # voices_compare is order sensitive
+    assert len(mrp.voices) <= mrp.settings['voices']['max']
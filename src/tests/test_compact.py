@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from iimrp.recording import parse_log_lines, read_log, load_recording, save_recording
+from iimrp.compact import *
+
+LOG = """0.00000 /mrp/allnotesoff
+0.10000 /mrp/quality/intensity iif 15 48 0.20000
+0.20000 /mrp/quality/intensity iif 15 48 0.50000
+0.30000 /mrp/midi iii 159 48 1
+0.40000 /mrp/quality/intensity iif 15 48 0.50000
+0.50000 /mrp/quality/harmonics/raw iifff 15 48 0.10000 0.20000 0.30000
+0.60000 /mrp/quality/harmonics/raw iifff 15 48 0.10000 0.20000 0.30000
+0.70000 /mrp/pedal/damper f 1.00000
+0.80000 /mrp/pedal/damper f 1.00000
+0.90000 /mrp/midi iii 143 48 0
+1.00000 /mrp/quality/intensity iif 15 48 0.90000
+""".splitlines()
+
+def test_compact():
+    batch, report = compact_batch(parse_log_lines(LOG))
+    assert [round(t, 5) for t in batch['time']] == [0.0, 0.2, 0.3, 0.5, 0.7, 0.9]
+    assert report == {'messages': 11, 'kept': 6, 'noop': 3, 'dead': 2, 'downsampled': 0}
+    assert len(batch.vectors) == 1
+
+@pytest.fixture
+def session():
+    rng = np.random.default_rng(0)
+    lines, t = ['0.00000 /mrp/allnotesoff'], 0.0
+    for i in range(5000):
+        t += rng.random() * 0.01
+        note, r = rng.integers(40, 46), rng.random()
+        if r < 0.05: lines.append(f'{t:.5f} /mrp/midi iii 159 {note} 1')
+        elif r < 0.1: lines.append(f'{t:.5f} /mrp/midi iii 143 {note} 0')
+        elif r < 0.85: lines.append(f'{t:.5f} /mrp/quality/intensity iif 15 {note} {np.sin(t) + rng.random() * 0.1:.5f}')
+        elif r < 0.99: lines.append(f'{t:.5f} /mrp/quality/harmonics/raw iiff 15 {note} 0.10000 {rng.integers(2) / 2:.5f}')
+        else: lines.append(f'{t:.5f} /mrp/allnotesoff')
+    return parse_log_lines(lines)
+
+def test_downsample(session):
+    _, exact = compact_batch(session)
+    batch, report = compact_batch(session, rate=10, tolerance=0.2)
+    assert report['downsampled'] > 0
+    assert report['kept'] < exact['kept']
+    intensity = batch.path_id('/mrp/quality/intensity')
+    for n in np.unique(batch['note'][batch['path'] == intensity]):
+        times = batch['time'][(batch['path'] == intensity) & (batch['note'] == n)]
+        assert len(times) < len(session['time'][(session['path'] == intensity) & (session['note'] == n)])
+
+def test_verify(session):
+    keep = np.ones(len(session), dtype=bool)
+    assert verify_compaction(session, keep)
+    midi = np.flatnonzero(session['path'] == session.path_id('/mrp/midi'))
+    keep[midi[len(midi) // 2]] = False
+    assert not verify_compaction(session, keep)
+
+def test_compact_log(session, tmp_path):
+    from iimrp.recording import write_log
+    file = str(tmp_path / 'session.log')
+    write_log(session, file)
+    report = compact_log(file, str(tmp_path / 'session.npz'))
+    assert report['out_bytes'] < report['bytes']
+    compacted = load_recording(str(tmp_path / 'session.npz'))
+    assert list(compacted.messages()) == list(compact_batch(read_log(file))[0].messages())
+
+def test_vector_deltas(session, tmp_path):
+    save_recording(session, str(tmp_path / 'delta.npz'), delta=True)
+    assert list(load_recording(str(tmp_path / 'delta.npz')).messages()) == list(session.messages())
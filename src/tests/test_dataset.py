@@ -0,0 +1,67 @@
+import os
+import time
+import numpy as np
+import pytest
+
+from iimrp.recording import parse_log_lines, write_log
+from iimrp.state import MRPState
+from iimrp.dataset import *
+
+LOG = """0.00000 /mrp/allnotesoff
+0.10000 /mrp/midi iii 159 21 1
+0.10000 /mrp/quality/intensity iif 15 21 0.50000
+0.25000 /mrp/quality/harmonics/raw iiff 15 21 0.10000 0.20000
+0.30000 /mrp/midi iii 159 60 1
+0.31000 /mrp/quality/brightness iif 15 60 0.70000
+0.50000 /mrp/midi iii 143 21 0
+0.70000 /mrp/allnotesoff
+0.80000 /mrp/midi iii 159 108 1
+1.00000 /mrp/quality/pitch iif 15 108 -0.50000
+""".splitlines()
+
+def test_piano_roll():
+    batch = parse_log_lines(LOG)
+    roll = np.concatenate(list(piano_roll_chunks(batch, rate=10, harmonics=2, chunk_frames=3, mask_off=False)))
+    assert roll.shape == (11, 88, 8)
+    features = piano_roll_features(2)
+    # each frame equals the folded state at its time
+    for f in range(len(roll)):
+        state = MRPState()
+        for t, path, args in batch.messages():
+            if t <= f / 10 + 1e-9: state.apply(path, *args)
+        keys = slice(21, 109)
+        np.testing.assert_allclose(roll[f, :, 0], state.on[keys])
+        np.testing.assert_allclose(roll[f, :, 1:6], state.qualities[keys])
+        np.testing.assert_allclose(roll[f, :, 6:], state.harmonics[keys, :2], atol=1e-6)
+    masked = np.concatenate(list(piano_roll_chunks(batch, rate=10, harmonics=2)))
+    assert masked[6, 0, features.index('intensity')] == 0 and roll[6, 0, features.index('intensity')] == 0.5
+
+def test_build_dataset(tmp_path):
+    files = []
+    for i in range(2):
+        files.append(str(tmp_path / f'{i}.log'))
+        write_log(parse_log_lines(LOG), files[-1])
+    out = str(tmp_path / 'dataset')
+    index = build_dataset(files, out, rate=100, harmonics=2, shard_frames=40)
+    entry = index['recordings'][os.path.abspath(files[0])]
+    assert entry['frames'] == 101
+    assert [s['frames'] for s in entry['shards']] == [40, 40, 21]
+    data = PianoRollDataset(out, window=16, hop=8)
+    assert len(data) == 2 * (4 + 4 + 1)
+    window = data[2]
+    assert window.shape == (16, 88, 8)
+    assert isinstance(window, np.memmap)
+    assert window[0, 0, 0] == 1 # key 21 is on at frame 16
+    assert len(data.sample(4)) == 4
+
+    # only the changed recording is rebuilt
+    mtimes = {f: os.path.getmtime(os.path.join(out, f)) for f in os.listdir(out) if f.endswith('.npy')}
+    time.sleep(0.01)
+    write_log(parse_log_lines(LOG[:5]), files[1])
+    index = build_dataset(files, out, rate=100, harmonics=2, shard_frames=40)
+    assert index['recordings'][os.path.abspath(files[1])]['frames'] == 31
+    for shard in index['recordings'][os.path.abspath(files[0])]['shards']:
+        assert os.path.getmtime(os.path.join(out, shard['file'])) == mtimes[shard['file']]
+    index = build_dataset(files[:1], out, rate=100, harmonics=2, shard_frames=40)
+    assert len(index['recordings']) == 1
+    assert len([f for f in os.listdir(out) if f.endswith('.npy')]) == 3
@@ -0,0 +1,85 @@
+import time
+import threading
+import pytest
+
+from iimrp.iimrp import MRP
+from iimrp.emulator import MRPEmulator
+from iimrp.recording import read_log, iter_log_messages
+from iimrp.diagnostics import *
+
+def test_plan(mrp):
+    diagnostics = MRPDiagnostics(mrp, dwell=0.25)
+    lanes = diagnostics.lanes()
+    assert len(lanes) == 6 and all(len(lane) == 18 for lane in lanes)
+    assert [n for _, n in lanes[1][:3]] == [39, 41, 43] and lanes[1][9] == (1, 40)
+    assert diagnostics.duration() == pytest.approx(18 * 9 * 0.25) # 40.5 s for 108 keys
+    diagnostics = MRPDiagnostics(mrp, boards=[2], keys_per_board=2, harmonics=4)
+    assert [[n for _, n in lane] for lane in diagnostics.lanes()] == \
+           [[57, 59, 61, 63, 65, 58, 60, 62, 64], [66, 68, 70, 72, 74, 67, 69, 71, 73]]
+    assert MRPDiagnostics(mrp, boards=[0], keys=[21, 30]).lanes() == [[(0, 21), (0, 30)]]
+    with pytest.raises(ValueError):
+        MRPDiagnostics(mrp, boards=[6])
+    with pytest.raises(ValueError):
+        MRPDiagnostics(mrp, boards=[0], keys=[60])
+
+def test_sweep(mrp):
+    mrp.settings['voices']['max'] = 4
+    mrp.note_on(100) # a voice in use
+    probed = []
+    def probe(note, harmonic):
+        probed.append((note, harmonic))
+        return not (note == 39 and harmonic == 2)
+    diagnostics = MRPDiagnostics(mrp, boards=[0, 1, 2, 3], keys=[21, 22, 39, 57, 75], harmonics=3,
+                                 dwell=0.001, probe=probe)
+    report = diagnostics.run()
+    assert sorted(report) == [21, 22, 39, 57, 75]
+    assert diagnostics.failed() == [39]
+    assert report[39]['reason'] == 'probe' and report[39]['failed_harmonics'] == [2]
+    assert report[21] == {'board': 0, 'note': 21, 'name': 'a0', 'passed': True, 'reason': 'ok',
+                          'failed_harmonics': [], 'heat': pytest.approx(report[21]['heat'])}
+    assert len(probed) == 5 * 3
+    s = diagnostics.summary()
+    assert (s['keys'], s['passed'], s['failed']) == (5, 4, 1)
+    assert s['boards'] == {0: (2, 2), 1: (0, 1), 2: (1, 1), 3: (1, 1)}
+    assert mrp.voices == [100] # every key off again
+    # three voices free: board 3 waits for one of the first three boards
+    ons = [m[2] for m in mrp.osc.sent if m[0] == '/mrp/midi' and m[1] == mrp.note_on_hex]
+    assert ons == [100, 21, 39, 57, 22, 75]
+    raw = [m[3:] for m in mrp.osc.sent if m[0] == '/mrp/quality/harmonics/raw' and m[2] == 57]
+    assert raw == [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
+    assert 'FAIL probe (harmonics [2])' in diagnostics.format_report()
+
+def test_heat_and_rejected(mrp):
+    mrp.note_on(21)
+    diagnostics = MRPDiagnostics(mrp, boards=[0], keys=[21, 22], dwell=0.01, heat_limit=1e-4)
+    report = diagnostics.run()
+    assert report[21]['reason'] == 'rejected' # already on
+    assert report[22]['reason'] == 'heat' and report[22]['heat'] > 1e-4
+    assert len([m for m in mrp.osc.sent if m[0] == '/mrp/quality/harmonics/raw' and m[2] == 22]) == 1
+    assert mrp.voices == [21]
+
+def test_stop(mrp):
+    diagnostics = MRPDiagnostics(mrp, boards=[0, 1], dwell=0.01)
+    timer = threading.Timer(0.05, diagnostics.stop)
+    timer.start()
+    t0 = time.perf_counter()
+    diagnostics.run()
+    assert time.perf_counter() - t0 < 1
+    assert mrp.voices == []
+    assert len(diagnostics.report) == 2 and diagnostics.failed() == [21, 39]
+    assert {r['reason'] for r in diagnostics.report.values()} == {'stopped'}
+
+def test_emulator(tmp_path, udp_osc):
+    with MRPEmulator(port=0) as emulator:
+        mrp = MRP(udp_osc, settings={'address': {'ip': '127.0.0.1', 'port': emulator.port}})
+        diagnostics = MRPDiagnostics(mrp, keys=[21, 22, 40, 60, 100], harmonics=2, dwell=0.01)
+        log = str(tmp_path / 'diagnostics.log')
+        report = diagnostics.run(log=log)
+        assert all(r['passed'] for r in report.values()) and len(report) == 5
+        # note on, intensity, harmonics 1 and 2, intensity restored, note off per key
+        assert emulator.wait(5 * 6, timeout=2)
+        assert emulator.state.notes_on() == [] and emulator.stats()['errors'] == 0
+    results = [args for _, path, args in iter_log_messages(log) if path == DIAGNOSTICS_PATH]
+    assert sorted(results) == [(0, 21, 1), (0, 22, 1), (1, 40, 1), (2, 60, 1), (4, 100, 1)]
+    batch = read_log(log)
+    assert len(batch) == 5 * 6 + 5
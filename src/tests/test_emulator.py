@@ -0,0 +1,114 @@
+import time
+import socket
+import pytest
+
+from pythonosc.udp_client import SimpleUDPClient
+from pythonosc.osc_bundle_builder import OscBundleBuilder
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.parsing.osc_types import IMMEDIATELY
+
+from iimrp.iimrp import MRP
+from iimrp.state import MRPState
+from iimrp.emulator import *
+
+def bundle(timetag, *messages):
+    builder = OscBundleBuilder(timetag)
+    for path, args in messages:
+        m = OscMessageBuilder(path)
+        for a in args:
+            m.add_arg(a)
+        builder.add_content(m.build())
+    return builder.build().dgram
+
+def send_raw(port, dgram):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(dgram, ('127.0.0.1', port))
+
+@pytest.fixture
+def emulator():
+    with MRPEmulator(port=0) as emulator:
+        yield emulator
+
+@pytest.fixture
+def mrp(emulator, udp_osc):
+    return MRP(udp_osc, settings={'address': {'ip': '127.0.0.1', 'port': emulator.port}})
+
+def test_state(emulator, mrp):
+    sent = [mrp.note_on(48), mrp.note_on(60), mrp.set_note_quality(48, 'intensity', 0.5),
+            mrp.set_note_quality(60, 'harmonics_raw', [0.25, 0.5]), mrp.pedal_damper(1.0),
+            mrp.ui_volume(0.75), mrp.note_off(48)]
+    assert emulator.wait(len(sent))
+    expected = MRPState()
+    for path, *args in sent:
+        expected.apply(path, *args)
+    assert emulator.snapshot() == expected
+    assert emulator.state.notes_on() == mrp.voices == [60]
+    assert emulator.state.harmonics[60, :2].tolist() == [0.25, 0.5]
+    s = emulator.stats()
+    assert (s['packets'], s['messages'], s['errors'], s['unknown'], s['peak_voices']) == (7, 7, 0, 0, 2)
+
+def test_voice_overflow(emulator, mrp):
+    mrp.settings['voices']['max'] = 4
+    for note in range(48, 54):
+        mrp.note_on(note)
+    assert emulator.wait(6 + 2) # MRP steals two voices
+    assert emulator.state.notes_on() == mrp.voices == [50, 51, 52, 53]
+    assert emulator.stats()['voice_overflow'] == 0
+    emulator.voices_max = 2
+    mrp.note_on(60)
+    assert emulator.wait(10)
+    assert emulator.stats()['voice_overflow'] == 1
+
+def test_decode_datagram():
+    message = OscMessageBuilder('/mrp/midi')
+    for a in (159, 60, 1):
+        message.add_arg(a)
+    assert decode_datagram(message.build().dgram) == [(None, '/mrp/midi', (159, 60, 1))]
+    decoded = decode_datagram(bundle(1e9, ('/mrp/midi', (159, 60, 1)), ('/mrp/allnotesoff', ())))
+    assert [(path, args) for _, path, args in decoded] == [('/mrp/midi', (159, 60, 1)), ('/mrp/allnotesoff', ())]
+    assert decoded[0][0] == pytest.approx(1e9)
+    assert decode_datagram(bundle(IMMEDIATELY, ('/mrp/allnotesoff', ())))[0][0] is None
+
+def test_scheduled_bundle(emulator):
+    client = SimpleUDPClient('127.0.0.1', emulator.port)
+    due = time.time() + 0.1
+    send_raw(emulator.port, bundle(due, ('/mrp/midi', (159, 60, 100)), ('/mrp/quality/brightness', (15, 60, 0.5))))
+    client.send_message('/mrp/midi', [159, 48, 100])
+    time.sleep(0.03)
+    assert emulator.state.notes_on() == [48]
+    assert emulator.wait(3)
+    assert time.time() >= due
+    assert emulator.state.notes_on() == [48, 60]
+    assert emulator.state.qualities[60, 0] == 0.5
+    s = emulator.stats()
+    assert (s['bundles'], s['late'], s['lateness_max']) == (1, 0, 0.0)
+
+def test_loss_and_reorder(emulator):
+    client = SimpleUDPClient('127.0.0.1', emulator.port)
+    expected = [('/mrp/midi', (159, n, 1)) for n in range(48, 54)]
+    for i in (0, 2, 1, 3, 5):
+        client.send_message(expected[i][0], list(expected[i][1]))
+    client.send_message('/mrp/pedal/damper', [0.3])
+    send_raw(emulator.port, b'#bundle\x00garbage')
+    assert emulator.wait(6)
+    time.sleep(0.02)
+    s = emulator.stats(expected)
+    assert (s['expected'], s['lost'], s['unexpected'], s['reordered']) == (6, 1, 1, 1)
+    assert s['errors'] == 1
+    assert s['loss_rate'] == pytest.approx(1 / 6)
+
+def test_jitter(emulator):
+    client = SimpleUDPClient('127.0.0.1', emulator.port)
+    expected = [(0.01 * i, '/mrp/quality/intensity', (15, 60, i / 10)) for i in range(10)]
+    t0 = time.time()
+    for t, path, args in expected:
+        time.sleep(max(0, t0 + t - time.time()))
+        client.send_message(path, list(args))
+    assert emulator.wait(10)
+    s = emulator.stats([(t0 + t, path, args) for t, path, args in expected])
+    assert (s['lost'], s['reordered']) == (0, 0)
+    assert 0 <= s['jitter'] < 0.005
+    assert s['latency_mean'] < 0.005
+    assert s['interval_mean'] == pytest.approx(0.01, abs=0.003)
+    batch = emulator.batch()
+    assert len(batch) == 10 and batch.paths[batch['path'][0]] == '/mrp/quality/intensity'
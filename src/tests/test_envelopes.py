@@ -0,0 +1,145 @@
+import time
+import threading
+import pytest
+
+from iimrp.envelopes import *
+
+def test_envelope():
+    e = MRPEnvelope.adsr(0.1, 0.2, 0.5, 1.0)
+    assert [e.value(t) for t in (0, 0.05, 0.1, 0.2, 0.3, 10)] == pytest.approx([0, 0.5, 1, 0.75, 0.5, 0.5])
+    assert e.value(0.6, released=0.1) == pytest.approx(0.5)
+    assert e.value(2.0, released=0.05) == 0
+    assert (e.duration, e.release_time) == (pytest.approx(0.3), 1.0)
+    assert MRPEnvelope([(0, 0), (1, 1)], curve=2).value(0.5) == 0.25
+    assert MRPEnvelope.adsr(0, 0, 0.5, 0.1).value(0) == 1.0
+    with pytest.raises(ValueError):
+        MRPEnvelope([(0.1, 0)])
+    with pytest.raises(ValueError):
+        MRPEnvelope([(0, 0), (1, 1), (0.5, 0)])
+
+def test_runner(mrp):
+    envelopes = MRPEnvelopes(mrp)
+    envelopes.attach('intensity', MRPEnvelope.adsr(0.1, 0.1, 0.5, 0.2))
+    with pytest.raises(ValueError):
+        envelopes.attach('harmonics_raw', MRPEnvelope([(0, 0)]))
+    envelopes.note_on(60, now=0.0)
+    envelopes.note_on(62, envelopes={'brightness': MRPEnvelope([(0, 0.25)], release=[])}, now=0.05)
+    assert envelopes.live() == 3
+    assert envelopes.tick(0.1) == 3
+    assert mrp.get_note_quality(60, 'intensity') == pytest.approx(1.0)
+    assert mrp.get_note_quality(62, 'intensity') == pytest.approx(0.5)
+    assert mrp.get_note_quality(62, 'brightness') == 0.25
+    assert envelopes.tick(0.3) == 1 # 62 is at 0.5 both in its attack and its sustain
+    mrp.osc.sent.clear()
+    assert envelopes.tick(1.0) == 0 # sustaining: nothing sent
+    assert mrp.osc.sent == []
+    envelopes.note_off(60, now=1.0)
+    envelopes.note_off(62, now=1.0)
+    assert envelopes.tick(1.1) == 2 and envelopes.live() == 2 # 62's brightness ends at note off
+    assert mrp.get_note_quality(60, 'intensity') == pytest.approx(0.25)
+    assert mrp.voices == [60, 62]
+    assert envelopes.tick(1.25) == 2
+    assert mrp.voices == [] and envelopes.live() == 0
+    assert mrp.get_note_quality(60, 'intensity') == 0
+    assert mrp.osc.sent[-2:] == [('/mrp/midi', 143, 60, 0), ('/mrp/midi', 143, 62, 0)]
+
+def test_retrigger(mrp):
+    envelopes = MRPEnvelopes(mrp)
+    envelopes.attach('intensity', MRPEnvelope([(0, 0), (1, 1)], release=[(1, 0)]))
+    envelopes.note_on(60, now=0)
+    envelopes.note_off(60, now=1)
+    envelopes.note_on(60, now=1.5)
+    envelopes.tick(2.0)
+    assert mrp.get_note_quality(60, 'intensity') == pytest.approx(0.5)
+    assert mrp.stats()['voices'] == 1 and len([m for m in mrp.osc.sent if m[0] == '/mrp/midi']) == 1
+    envelopes.note_off(61) # no envelopes: passed through
+    envelopes.detach('intensity')
+    envelopes.note_on(64)
+    envelopes.note_off(64)
+    assert mrp.voices == [60]
+
+def test_vectorized(mrp):
+    envelopes = MRPEnvelopes(mrp)
+    envelopes.attach('intensity', MRPEnvelope.adsr(1.0, 1.0, 0.5, 1.0))
+    envelopes.attach('brightness', MRPEnvelope([(0, 0), (0.5, 1), (1, 0), (3, 1)]))
+    envelopes.attach('pitch', MRPEnvelope([(0, -1), (2, 1)], curve=0.5))
+    mrp.settings['voices']['max'] = 128
+    for note in range(21, 121):
+        envelopes.note_on(note, now=(note - 21) * 0.01)
+    assert envelopes.live() == 300
+    t0 = time.perf_counter()
+    for i in range(100):
+        envelopes.tick(i * 0.03)
+    assert (time.perf_counter() - t0) < 5
+    assert 0 < envelopes.sent <= 300 * 100
+    for note in range(21, 121, 7):
+        envelopes.note_off(note, now=2.0)
+    values, ended = envelopes.values(2.05)
+    assert not ended.any()
+    for i in range(300):
+        e = envelopes._templates[envelopes._template[i]]
+        start = envelopes._start[i]
+        released = None if envelopes._note[i] % 7 else 2.0 - start
+        assert values[i] == pytest.approx(e.value(2.05 - start, released))
+
+def test_templates(mrp):
+    envelopes = MRPEnvelopes(mrp)
+    for i in range(10): # equal envelopes share a template
+        envelopes.note_on(60 + i, envelopes={'intensity': MRPEnvelope([(0, 0.5)])}, now=0)
+    assert len(envelopes._templates) == 1
+    envelopes.attach('brightness', MRPEnvelope.adsr(0.1, 0.1, 0.5, 0.2))
+    for i in range(50): # templates no live envelope uses are dropped
+        note = 21 + i
+        envelopes.note_on(note, envelopes={'pitch': MRPEnvelope([(0, i / 50)], release=[])}, now=i)
+        envelopes.note_off(note, now=i)
+        envelopes.tick(i + 1)
+    assert len(envelopes._templates) <= 4
+    assert mrp.get_note_quality(60, 'intensity') == 0.5
+    values, _ = envelopes.values(100)
+    for i in range(envelopes.live()):
+        e = envelopes._templates[envelopes._template[i]]
+        assert values[i] == pytest.approx(e.value(100 - envelopes._start[i]))
+
+def test_batched_send(mrp):
+    bundles = []
+    class Client:
+        def send(self, content):
+            assert envelopes._lock.locked() # sent before the lock is released
+            bundles.append(content)
+    mrp.osc.clients[mrp.client] = Client()
+    envelopes = MRPEnvelopes(mrp)
+    envelopes.attach('intensity', MRPEnvelope([(0, 0), (1, 1)], release=[]))
+    envelopes.attach('brightness', MRPEnvelope([(0, 1), (1, 0)], release=[]))
+    for note in (60, 62, 64):
+        envelopes.note_on(note, now=0)
+    assert envelopes.tick(0.5) == 6
+    assert len(bundles) == 1 and bundles[0].num_contents == 6
+    envelopes.note_off(60, now=0.6)
+    envelopes.tick(0.7)
+    last = bundles[1].content(bundles[1].num_contents - 1) # after the qualities of the tick
+    assert len(bundles) == 2 and (last.address, last.params) == ('/mrp/midi', [143, 60, 0])
+    assert mrp.voices == [62, 64]
+
+def test_note_on_during_tick(mrp):
+    envelopes = MRPEnvelopes(mrp)
+    envelopes.attach('intensity', MRPEnvelope([(0, 1)], release=[(0.1, 0)]))
+    envelopes.note_on(60, now=0)
+    envelopes.note_off(60, now=0)
+    mrp.osc.clear()
+    threads = []
+    note_off = mrp.note_off
+    def release_ended(note):
+        note_off(note)
+        # another thread turns the note on again as its release ends
+        threads.append(threading.Thread(target=envelopes.note_on, args=(note,), kwargs={'now': 0.2}))
+        threads[0].start()
+    send_messages = mrp.send_messages
+    def slow_send(*args, **kwargs):
+        time.sleep(0.05)
+        return send_messages(*args, **kwargs)
+    mrp.note_off, mrp.send_messages = release_ended, slow_send
+    envelopes.tick(0.2)
+    threads[0].join()
+    midi = [m[1:] for m in mrp.osc.sent if m[0] == '/mrp/midi']
+    assert midi == [(143, 60, 0), (159, 60, 1)]
+    assert mrp.voices == [60]
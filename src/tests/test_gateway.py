@@ -0,0 +1,109 @@
+import time
+import socket
+import pytest
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from iimrp.emulator import MRPEmulator
+from iimrp.gateway import *
+
+class Client:
+    """An OSC front end with its own source port."""
+    def __init__(self, port):
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def send(self, path, *args):
+        m = OscMessageBuilder(path)
+        for a in args:
+            m.add_arg(a)
+        self.sock.sendto(m.build().dgram, ('127.0.0.1', self.port))
+    def note_on(self, note):
+        self.send('/mrp/midi', 159, note, 100)
+    def note_off(self, note):
+        self.send('/mrp/midi', 143, note, 0)
+
+def until(condition, timeout=2.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+@pytest.fixture
+def emulator():
+    with MRPEmulator(port=0) as emulator:
+        yield emulator
+
+@pytest.fixture
+def gateway(emulator):
+    gateway = MRPGateway('127.0.0.1', 0, '127.0.0.1', emulator.port, settings={'voices': {'max': 4}})
+    with gateway:
+        yield gateway
+
+def test_arbitration(emulator, gateway):
+    a, b = Client(gateway.port), Client(gateway.port)
+    a.note_on(48)
+    a.note_on(50)
+    assert until(lambda: gateway.stats()['voices'] == 2)
+    b.note_on(48) # a's note
+    b.note_off(50) # a's note
+    b.send('/mrp/quality/intensity', 15, 48, 0.5) # a's note
+    b.note_on(60)
+    b.send('/mrp/quality/intensity', 15, 60, 0.5)
+    b.send('/mrp/allnotesoff') # only b's notes
+    a.send('/mrp/quality/harmonics/raw', 15, 48, 0.25, 0.5)
+    assert until(lambda: gateway.received == 9)
+    assert until(lambda: emulator.state.harmonics[48, 1] == 0.5)
+    assert emulator.state.notes_on() == [48, 50]
+    assert emulator.state.qualities[60, 1] == 0.5
+    assert gateway.stats()['rejected'] == {'conflict': 1, 'not_owner': 2}
+    assert gateway.stats()['clients'] == 2
+
+def test_voice_stealing(emulator, gateway):
+    gateway.voices_per_client = 3
+    a, b = Client(gateway.port), Client(gateway.port)
+    for note in (40, 41, 42, 43): # a over its share: steals its own oldest
+        a.note_on(note)
+    assert until(lambda: gateway.received == 4)
+    b.note_on(60)
+    b.note_on(61) # MRP full: steals from a, which holds the most
+    assert until(lambda: emulator.state.notes_on() == [42, 43, 60, 61])
+    assert gateway.steals == 2 and gateway.mrp.voices == [42, 43, 60, 61]
+    assert emulator.stats()['voice_overflow'] == 0
+
+def test_coalesce_and_bundle(emulator, gateway):
+    a = Client(gateway.port)
+    a.note_on(60)
+    for i in range(1, 501):
+        a.send('/mrp/quality/brightness', 15, 60, i / 500)
+    assert until(lambda: emulator.state.qualities[60, 0] == 1.0)
+    assert until(lambda: gateway.stats()['forwarded'] == 501 - gateway.stats()['coalesced'])
+    s = gateway.stats()
+    assert s['received'] == 501 and s['coalesced'] > 0
+    assert s['forwarded_datagrams'] <= s['forwarded']
+    assert s['tick_max'] < 0.05
+
+def test_throughput(emulator, gateway):
+    clients = [Client(gateway.port) for _ in range(4)]
+    for k, c in enumerate(clients):
+        c.note_on(48 + k)
+    t0 = time.perf_counter()
+    for i in range(5000):
+        k = i % 4
+        clients[k].send('/mrp/quality/intensity', 15, 48 + k, i / 5000)
+    assert until(lambda: gateway.received == 5004, timeout=5)
+    assert until(lambda: emulator.state.qualities[51, 1] == pytest.approx(4999 / 5000))
+    assert gateway.received / (time.perf_counter() - t0) > 1000
+    assert gateway.errors == 0 and gateway.rejected == {}
+
+def test_idle_and_stop(emulator):
+    gateway = MRPGateway('127.0.0.1', 0, '127.0.0.1', emulator.port, idle_timeout=0.05).start()
+    a = Client(gateway.port)
+    a.note_on(60)
+    assert until(lambda: emulator.state.notes_on() == [60])
+    assert until(lambda: emulator.state.notes_on() == [] and gateway.stats()['clients'] == 0)
+    a.note_on(62)
+    assert until(lambda: emulator.state.notes_on() == [62])
+    gateway.stop()
+    assert until(lambda: emulator.state.notes_on() == [])
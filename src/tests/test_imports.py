@@ -0,0 +1,49 @@
+import re
+import os
+import sys
+import importlib
+import subprocess
+import pytest
+
+import iimrp
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIONAL = ('numpy', 'pandas', 'tqdm', 'mido', 'bokeh')
+
+def loaded_after(code:str) -> set:
+    """Run code in a fresh interpreter and return the optional dependencies it imported."""
+    out = subprocess.run([sys.executable, '-c', f"{code}\nimport sys\nprint(*sys.modules)"],
+        cwd=SRC, capture_output=True, text=True, check=True).stdout.split()
+    return {m for m in OPTIONAL if m in out}
+
+def test_import_is_lazy():
+    assert loaded_after("import iimrp") == set()
+    assert loaded_after("import iimrp.recording") == {'numpy'}
+    assert loaded_after("import iimrp.utils") == {'numpy'}
+    assert loaded_after("import iimrp\niimrp.MRP") == {'numpy'}
+
+def test_exports_resolve():
+    for name in iimrp.__all__:
+        assert getattr(iimrp, name) is getattr(importlib.import_module(f'iimrp.{iimrp._LAZY[name]}'), name)
+    assert iimrp.iimrp.MRP is iimrp.MRP
+    assert callable(iimrp.compact_batch)
+    assert set(iimrp._LAZY).isdisjoint(iimrp._SUBMODULES) # no export shadows a submodule
+    assert set(iimrp.__all__) <= set(dir(iimrp))
+    with pytest.raises(AttributeError):
+        iimrp.not_an_attribute
+
+def test_submodules_are_modules():
+    import iimrp.compact as c
+    assert c is sys.modules['iimrp.compact'] and iimrp.compact is c
+    assert c.compact_batch is iimrp.compact_batch
+
+@pytest.mark.parametrize('module', list(iimrp._EXPORTS))
+def test_exports_complete(module):
+    """Every public top-level definition of a submodule is exported by the package (but CLI entry points)."""
+    with open(os.path.join(SRC, 'iimrp', f'{module}.py')) as f:
+        source = f.read()
+    defined = set(re.findall(r'^(?:def|class) ([A-Za-z]\w*)', source, re.M))
+    defined |= set(re.findall(r'^([A-Z][A-Z0-9_]*|[a-z]\w*) = ', source, re.M))
+    defined.discard('main')
+    assert set(iimrp._EXPORTS[module]) <= defined
+    assert {n for n in defined if n not in iimrp._LAZY} == set()
@@ -0,0 +1,69 @@
+import os
+import time
+import pytest
+import numpy as np
+
+from iimrp.recording import read_log, save_recording, iter_log_messages
+from iimrp.state import MRPState
+from iimrp.index import *
+
+@pytest.fixture
+def log_file(tmp_path):
+    rng = np.random.default_rng(0)
+    lines, t = [], 0.0
+    for _ in range(2000):
+        t += rng.random() * 0.05
+        note, r = rng.integers(30, 100), rng.random()
+        if r < 0.3: lines.append(f'{t:.5f} /mrp/midi iii 159 {note} 1')
+        elif r < 0.6: lines.append(f'{t:.5f} /mrp/midi iii 143 {note} 0')
+        elif r < 0.9: lines.append(f'{t:.5f} /mrp/quality/intensity iif 15 {note} {rng.random():.5f}')
+        else: lines.append(f'{t:.5f} /mrp/quality/harmonics/raw iifff 15 {note} 0.10000 {rng.random():.5f} 0.30000')
+    file = str(tmp_path / 'session.log')
+    with open(file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return file
+
+def fold(file, t):
+    state = MRPState()
+    for rt, path, args in iter_log_messages(file):
+        if rt >= t: break
+        state.apply(path, *args)
+    return state
+
+def test_build(log_file):
+    index = load_index(log_file, interval=5.0)
+    assert os.path.exists(index_file(log_file))
+    assert index.n_records == 2000
+    assert len(index) > 5
+    assert np.all(np.diff(index.times) > 0)
+
+def test_state_at(log_file):
+    index = load_index(log_file, interval=5.0)
+    for t in (0.0, 3.3, 17.2, index.duration + 1):
+        state = index.state_at(t)
+        ref = fold(log_file, t)
+        assert state == ref and state.order == ref.order
+
+def test_read_range(log_file):
+    index = load_index(log_file, interval=5.0)
+    batch, log = index.read_range(12.0, 21.0), read_log(log_file)
+    expected = (log['time'] >= 12.0) & (log['time'] < 21.0)
+    assert len(batch) == expected.sum()
+    assert np.array_equal(batch['note'], log['note'][expected])
+
+def test_binary(log_file, tmp_path):
+    file = str(tmp_path / 'session.npz')
+    save_recording(read_log(log_file), file)
+    index = load_index(file, interval=5.0)
+    assert index.state_at(17.2) == fold(log_file, 17.2)
+    assert len(index.read_range(12.0, 21.0)) == len(load_index(log_file).read_range(12.0, 21.0))
+
+def test_stale(log_file):
+    load_index(log_file, interval=5.0)
+    assert MRPLogIndex.load(log_file).n_records == 2000
+    time.sleep(0.01)
+    with open(log_file, 'a') as f:
+        f.write('1000.00000 /mrp/allnotesoff\n')
+    with pytest.raises(FileNotFoundError):
+        load_index(log_file, build=False)
+    assert load_index(log_file).n_records == 2001
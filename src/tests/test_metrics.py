@@ -0,0 +1,92 @@
+import time
+import threading
+import pytest
+
+from iimrp.iimrp import MRP
+from iimrp.metrics import *
+
+@pytest.fixture
+def mrp(osc):
+    return MRP(osc, metrics=True)
+
+def test_disabled(osc):
+    mrp = MRP(osc)
+    mrp.note_on(60)
+    assert mrp.stats() == {'enabled': False, 'voices': 1}
+    assert 'note_on' not in vars(mrp)
+    mrp.metrics_on()
+    assert 'note_on' in vars(mrp)
+    mrp.metrics_off()
+    assert 'note_on' not in vars(mrp) and mrp.metrics is None
+
+def test_counters(mrp):
+    mrp.note_on(48)
+    mrp.note_on(60)
+    mrp.set_note_quality(60, 'brightness', 0.5)
+    mrp.note_off(48)
+    mrp.note_on(60) # already on
+    mrp.note_on(10) # out of range
+    mrp.note_off(48) # already off
+    mrp.set_note_quality(48, 'intensity', 0.5) # note is off
+    s = mrp.stats()
+    assert s['enabled'] and s['voices'] == 1
+    assert s['messages'] == {'/mrp/midi': 3, '/mrp/quality/brightness': 1}
+    assert s['messages_total'] == len(mrp.osc.sent) == 4
+    assert s['send']['/mrp/midi']['count'] == 3
+    assert s['methods']['note_on']['count'] == 4
+    assert s['methods']['voices_add']['count'] == 2
+    assert s['invalid'] == {'note_on/already_on': 1, 'note_on/out_of_range': 1,
+                            'note_off/already_off': 1, 'quality/note_off': 1}
+    assert s['invalid_total'] == 4
+
+def test_voice_steals(mrp):
+    mrp.settings['voices']['max'] = 2
+    for note in (48, 50, 52, 54):
+        mrp.note_on(note)
+    assert mrp.voices == [52, 54]
+    assert mrp.stats()['voice_steals'] == 2
+    mrp.settings['voices']['rule'] = 'lowest'
+    mrp.note_on(56)
+    assert mrp.stats()['voices_dropped'] == 1
+
+def test_histogram():
+    h = LatencyHistogram()
+    for us in (1, 2, 3, 4, 5, 6, 7, 8, 9, 2000):
+        h.observe(us * 1000)
+    s = h.snapshot()
+    assert s['count'] == 10 and s['max'] == pytest.approx(2e-3)
+    assert s['sum'] == pytest.approx(2.045e-3)
+    assert s['p50'] == 5e-6 and s['p90'] == 1e-5 and s['p99'] == pytest.approx(2e-3)
+    assert sum(s['buckets'].values()) == 10 and s['buckets'][2.5e-3] == 1
+
+def test_prometheus(mrp, tmp_path):
+    mrp.note_on(48)
+    mrp.note_on(48)
+    text = mrp.metrics.prometheus({'voices': 1})
+    assert 'iimrp_messages_total{path="/mrp/midi"} 1' in text
+    assert 'iimrp_send_seconds_bucket{path="/mrp/midi",le="+Inf"} 1' in text
+    assert 'iimrp_send_seconds_count{path="/mrp/midi"} 1' in text
+    assert 'iimrp_method_seconds_count{method="note_on"} 2' in text
+    assert 'iimrp_invalid_messages_total{kind="note_on",reason="already_on"} 1' in text
+    assert 'iimrp_voices 1' in text
+    file = tmp_path / 'mrp.prom'
+    mrp.metrics_on(export=str(file), interval=0.01)
+    time.sleep(0.05)
+    assert 'iimrp_voices 1' in file.read_text()
+    mrp.note_on(50)
+    mrp.metrics_off()
+    assert 'iimrp_messages_total{path="/mrp/midi"} 2' in file.read_text()
+
+def test_threads():
+    metrics = MRPMetrics()
+    def send():
+        for i in range(5000):
+            metrics.sent(f'/mrp/{i}', 1000)
+            metrics.timed(f'method{i}', 1000)
+            metrics.count_invalid('quality', f'reason{i}')
+    thread = threading.Thread(target=send)
+    thread.start()
+    while thread.is_alive():
+        metrics.snapshot() # no 'dictionary changed size during iteration'
+    thread.join()
+    assert metrics.snapshot()['messages_total'] == 5000
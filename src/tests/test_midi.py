@@ -0,0 +1,93 @@
+import struct
+import numpy as np
+import pytest
+import mido
+
+from iimrp.recording import read_log, parse_log_lines
+from iimrp.midi import *
+
+@pytest.fixture
+def midi_file(tmp_path):
+    # two tracks, running status, a tempo change and a sysex, written with mido
+    mid = mido.MidiFile(ticks_per_beat=96)
+    meta = mido.MidiTrack([mido.MetaMessage('set_tempo', tempo=500000, time=0),
+        mido.MetaMessage('set_tempo', tempo=250000, time=192)])
+    notes = mido.MidiTrack([
+        mido.Message('control_change', channel=2, control=1, value=127, time=0),
+        mido.Message('note_on', channel=2, note=60, velocity=100, time=0),
+        mido.Message('sysex', data=[1, 2, 3], time=48),
+        mido.Message('note_on', channel=2, note=64, velocity=90, time=48),
+        mido.Message('control_change', channel=2, control=64, value=127, time=48),
+        mido.Message('polytouch', channel=2, note=60, value=64, time=0),
+        mido.Message('note_on', channel=2, note=60, velocity=0, time=48),
+        mido.Message('control_change', channel=2, control=74, value=0, time=96),
+        mido.Message('note_off', channel=2, note=64, velocity=0, time=0),
+    ])
+    mid.tracks += [meta, notes]
+    file = str(tmp_path / 'test.mid')
+    mid.save(file)
+    return file
+
+def test_read_midi(midi_file):
+    events, division = read_midi(midi_file)
+    assert division == 96
+    times, expected = [], []
+    for m in mido.MidiFile(midi_file):
+        times.append((times or [0])[-1] + m.time)
+        if not m.is_meta and m.type != 'sysex':
+            expected.append((times[-1], *m.bytes()))
+    np.testing.assert_allclose(events['time'], [e[0] for e in expected])
+    assert [tuple(e)[3:] for e in events] == [e[1:] for e in expected]
+
+def test_smpte_division(midi_file):
+    division = struct.unpack('>h', bytes([0xE7, 0x28]))[0] # 25 fps, 40 ticks per frame
+    np.testing.assert_allclose(ticks_to_seconds([0, 40, 1000], division), [0, 0.04, 1.0])
+    for fps, expected in ((24, 24), (30, 30), (29, 29.97)):
+        division = -(fps << 8) | 80
+        np.testing.assert_allclose(ticks_to_seconds([80 * 100], division), [100 / expected])
+    with open(midi_file, 'rb') as f:
+        data = bytearray(f.read())
+    data[12:14] = bytes([0xE7, 0x28])
+    with open(midi_file, 'wb') as f:
+        f.write(data)
+    events, division = read_midi(midi_file)
+    assert division == -6360
+    assert events['time'][:3].tolist() == pytest.approx([0, 0, 96 / 1000]) # tempo changes do not apply
+
+def test_midi_to_mrp(midi_file):
+    batch = midi_to_mrp(midi_file)
+    messages = [(round(t, 5), path, args) for t, path, args in batch.messages()]
+    assert messages == [
+        (0.0, '/mrp/midi', (159, 60, 100)),
+        (0.0, '/mrp/quality/intensity', (15, 60, 1.0)),
+        (0.5, '/mrp/midi', (159, 64, 90)),
+        (0.5, '/mrp/quality/intensity', (15, 64, 1.0)),
+        (0.75, '/mrp/pedal/damper', (1.0,)),
+        (0.75, '/mrp/quality/intensity', (15, 60, pytest.approx(64 / 127))),
+        (1.0, '/mrp/midi', (143, 60, 0)),
+        (1.25, '/mrp/quality/brightness', (15, 64, 0.0)),
+        (1.25, '/mrp/midi', (143, 64, 0)),
+    ]
+
+def test_mrp_to_midi(tmp_path):
+    batch = parse_log_lines([
+        '0.00000 /mrp/allnotesoff',
+        '0.50000 /mrp/midi iii 159 48 100',
+        '0.75000 /mrp/quality/intensity iif 15 48 0.50000',
+        '0.75000 /mrp/quality/brightness iif 15 48 1.00000',
+        '100.00000 /mrp/pedal/damper f 1.00000',
+        '200.00000 /mrp/midi iii 143 48 0',
+    ])
+    file = mrp_to_midi(batch, str(tmp_path / 'out.mid'))
+    messages = [m for m in mido.MidiFile(file) if not m.is_meta]
+    assert [m.type for m in messages] == ['control_change', 'note_on', 'polytouch', 'control_change', 'control_change', 'note_off']
+    assert np.cumsum([m.time for m in messages]) == pytest.approx([0, 0.5, 0.75, 0.75, 100, 200])
+    assert messages[2].value == 64 and messages[3].control == 74 and messages[3].value == 127
+    back = midi_to_mrp(file)
+    assert [p for _, p, _ in back.messages()][:2] == ['/mrp/midi', '/mrp/quality/intensity']
+
+def test_encode_vlq():
+    values = np.array([0, 0x40, 0x7F, 0x80, 0x2000, 0x3FFF, 0x4000, 0x100000, 0x1FFFFF, 0x200000, 0xFFFFFFF])
+    encoded, lengths = encode_vlq(values)
+    expected = ['00', '40', '7f', '8100', 'c000', 'ff7f', '818000', 'c08000', 'ffff7f', '81808000', 'ffffff7f']
+    assert [bytes(e[:n]).hex() for e, n in zip(encoded, lengths)] == expected
@@ -0,0 +1,43 @@
+import pytest
+import numpy as np
+
+from iimrp.patch import *
+
+@pytest.fixture
+def setup():
+    table = load_patch_table()
+    return table
+
+def test_load_patch_table_cached(setup):
+    table = setup
+    assert load_patch_table() is table
+    assert table.programs[0][15] == [('mrp-standard', (30, 108))]
+
+def test_parse_range_value():
+    assert parse_range_value("-25dB/-20dB") == (-25.0, -20.0, True)
+    assert parse_range_value("1/1.059") == (1.0, 1.059, False)
+    assert parse_range_value(".5") == (0.5, 0.5, False)
+
+def test_drive_intensity(setup):
+    table = setup
+    notes = np.arange(30, 109)
+    amp, drive = table.drive(notes, intensity=np.linspace(0, 1, len(notes)))
+    assert drive.shape == (len(notes), MAX_HARMONICS_RAW)
+    assert np.all(np.diff(amp) > 0), f"amplitude should rise with intensity: {amp}"
+    assert np.isclose(amp[-1], db_to_amp(-20)), f"amp: {amp[-1]}"
+    assert np.allclose(drive[:, 0], amp)
+
+def test_drive_out_of_range(setup):
+    table = setup
+    amp, drive = table.drive([21, 29, 109], intensity=1)
+    assert np.all(amp == 0) and np.all(drive == 0)
+
+def test_drive_harmonics_raw(setup):
+    table = setup
+    amp, drive = table.drive([60, 61], harmonics_raw=[[1, 0.5], [0, 1]], intensity=1)
+    assert np.allclose(drive[:, :2] / amp[:, np.newaxis], [[1, 0.5], [0, 1]])
+
+def test_relative_frequency(setup):
+    patch = setup.patch('mrp-standard')
+    f = patch.relative_frequency(pitch=np.array([-1, 0, 1]))
+    assert np.allclose(f, [1/1.059, 1, 1.059])
@@ -0,0 +1,73 @@
+import io
+import pytest
+import numpy as np
+
+from iimrp.recording import *
+
+LOG = """0.00336 /mrp/allnotesoff
+0.50414 /mrp/midi iii 159 48 1
+1.30600 /mrp/quality/harmonics/raw iifff 15 48 0.03 0.0 0.5
+2.81722 /mrp/quality/intensity iif 15 48 0.25
+2.90000 /mrp/pedal/damper f 0.5
+3.00336 /mrp/midi iii 143 48 0
+"""
+
+@pytest.fixture
+def setup():
+    return io.StringIO(LOG)
+
+def test_parse_log_line():
+    assert parse_log_line("0.00336 /mrp/allnotesoff") == (0.00336, '/mrp/allnotesoff', ())
+    assert parse_log_line("2.81722 /mrp/quality/intensity iif 15 70 0") == (2.81722, '/mrp/quality/intensity', (15, 70, 0.0))
+
+def test_format_numpy_scalars():
+    line = format_log_line(1.0, '/mrp/quality/intensity', (np.int32(15), np.int64(60), np.float64(0.5)))
+    assert line == '1.00000 /mrp/quality/intensity iif 15 60 0.50000\n'
+    assert parse_log_line(format_log_line(0.0, '/x', (np.float32(0.25), True, np.bool_(False), 'a'))) == \
+           (0.0, '/x', (0.25, 1, 0, 'a'))
+
+def test_iter_log_chunks(setup):
+    batches = list(iter_log(setup, chunk_size=4))
+    assert [len(b) for b in batches] == [4, 2]
+    records = batches[0].records
+    assert records.dtype == LOG_DTYPE
+    assert records['path'][1] == MRP_PATHS.index('/mrp/midi')
+    assert records['channel'][1] == 159 and records['note'][1] == 48 and records['value'][1] == 1
+    assert np.isnan(records['value'][0]) and records['vector'][0] == -1
+
+def test_read_log_vectors(setup):
+    batch = read_log(setup, chunk_size=2)
+    v = batch.vectors[batch['vector'][2]]
+    assert np.allclose(v[:3], [0.03, 0.0, 0.5]) and np.all(np.isnan(v[3:]))
+    damper = batch.select(batch['path'] == batch.path_id('/mrp/pedal/damper'))
+    assert damper['channel'][0] == -1 and damper['value'][0] == 0.5
+
+def test_messages_round_trip(setup):
+    lines = LOG.splitlines()
+    messages = list(read_log(setup).messages())
+    assert messages == [parse_log_line(l) for l in lines]
+
+@pytest.mark.parametrize("name", ["rec", "rec.npz"])
+def test_save_load_recording(setup, tmp_path, name):
+    batch = read_log(setup)
+    file = str(tmp_path / name)
+    save_recording(batch, file)
+    loaded = load_recording(file)
+    assert list(loaded.messages()) == list(batch.messages())
+
+def test_write_log(setup, tmp_path):
+    file = str(tmp_path / "out.log")
+    write_log(read_log(setup), file)
+    assert list(read_log(file).messages()) == [parse_log_line(l) for l in LOG.splitlines()]
+
+def test_recorder_rotation(tmp_path):
+    file = str(tmp_path / "rec.log")
+    recorder = MRPRecorder(file, flush_interval=0.01, max_seconds=1.0, compression='gzip')
+    recorder.start()
+    for i in range(30):
+        recorder.push(i * 0.1, ('/mrp/quality/intensity', 15, 60, i / 30))
+    recorder.stop()
+    assert recorder.files == [file + '.gz', str(tmp_path / "rec_001.log.gz"), str(tmp_path / "rec_002.log.gz")]
+    messages = [m for f in recorder.files for m in iter_log_messages(f)]
+    assert len(messages) == 30
+    assert messages[-1][2] == (15, 60, round(29 / 30, 5))
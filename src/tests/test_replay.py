@@ -0,0 +1,77 @@
+import io
+import os
+import time
+import pytest
+import numpy as np
+
+from iimrp.iimrp import MRP
+from iimrp.recording import read_log
+from iimrp.index import index_file
+from iimrp.replay import *
+
+LOG = """0.00000 /mrp/allnotesoff
+0.01000 /mrp/midi iii 159 48 1
+0.01000 /mrp/quality/intensity iif 15 48 0.50000
+0.02000 /mrp/midi iii 159 60 1
+0.03000 /mrp/quality/harmonics/raw iifff 15 60 0.10000 0.20000 0.30000
+0.04000 /mrp/midi iii 143 48 0
+0.05000 /mrp/pedal/damper f 1.00000
+"""
+
+@pytest.fixture
+def replay(mrp):
+    return MRPReplay(mrp, read_log(io.StringIO(LOG)), checkpoint_interval=0.015)
+
+def test_play(osc, mrp, replay):
+    replay.play(block=True)
+    assert [a[0] for a in osc.sent] == [l.split()[1] for l in LOG.splitlines()]
+    assert mrp.voices == [60]
+    assert mrp.get_note_quality(60, 'harmonics_raw') == [0.1, 0.2, 0.3]
+
+def test_bundles(osc, mrp, replay):
+    bundles = []
+    class Client:
+        def send(self, content):
+            bundles.append(content)
+    osc.clients[mrp.client] = Client()
+    replay.play(block=True)
+    assert len(bundles) == 1 and bundles[0].num_contents == 2 # the events at 0.01
+    assert [m.address for m in bundles[0]] == ['/mrp/midi', '/mrp/quality/intensity']
+    assert len(osc.sent) == 5
+    assert mrp.voices == [60]
+
+def test_speed(osc, replay):
+    replay.speed = 0.5
+    replay.play(block=True)
+    elapsed = osc.sent_at[-1] - osc.sent_at[0]
+    assert elapsed == pytest.approx(0.1, abs=0.01)
+
+def test_seek(osc, mrp, replay):
+    replay.seek(0.035)
+    sent = osc.sent
+    assert sent[0] == ('/mrp/allnotesoff',)
+    assert ('/mrp/midi', 159, 48, 1) in sent and ('/mrp/midi', 159, 60, 1) in sent
+    assert ('/mrp/quality/intensity', 15, 48, 0.5) in sent
+    assert mrp.voices == [48, 60]
+    assert replay.position == 5
+
+def test_client(osc):
+    mrp = MRP(osc, client='piano2')
+    MRPReplay(mrp, read_log(io.StringIO(LOG))).seek(0.035)
+    assert osc.sent_to and set(osc.sent_to) == {'piano2'}
+
+def test_index(osc, mrp, tmp_path):
+    file = str(tmp_path / 'session.log')
+    with open(file, 'w') as f:
+        f.write(LOG)
+    replay = MRPReplay(mrp, file, checkpoint_interval=0.015)
+    assert not os.path.exists(index_file(file)) # built in memory
+    records = [i for i, _ in replay.checkpoints]
+    assert len(records) > 1
+    MRPReplay(mrp, file, checkpoint_interval=0.015, save_index=True)
+    assert os.path.exists(index_file(file))
+    assert len(MRPReplay(mrp, file).checkpoints) == 1 # the index of another interval is not used
+    replay = MRPReplay(mrp, file, checkpoint_interval=0.015)
+    assert [i for i, _ in replay.checkpoints] == records
+    replay.seek(0.035)
+    assert mrp.voices == [48, 60]
@@ -0,0 +1,89 @@
+import time
+import threading
+import pytest
+from fractions import Fraction as F
+
+from iimrp.iimrp import MRP
+from iimrp.emulator import MRPEmulator
+from iimrp.sequencer import *
+
+def test_pattern():
+    assert MRPPattern("48 72").events(0) == [(0, F(1, 2), 48), (F(1, 2), 1, 72)]
+    assert [v for _, _, v in MRPPattern("[1 0 -1] 0").events(0)] == [1, 0, -1, 0]
+    assert MRPPattern("[1 0 -1] 0").events(0)[2][:2] == (F(1, 3), F(1, 2))
+    assert MRPPattern("48 ~ 50").events(0) == [(0, F(1, 3), 48), (F(2, 3), 1, 50)]
+    assert [v for _, _, v in MRPPattern("48*2 50").events(0)] == [48, 48, 50]
+    assert [[v for _, _, v in MRPPattern("<48 50 52> 60").events(c)] for c in range(4)] == \
+           [[48, 60], [50, 60], [52, 60], [48, 60]]
+    assert [v for _, _, v in MRPPattern("<48 50>*2").events(1)] == [48, 50]
+    assert sorted(MRPPattern("[48, 52] 55").events(0)) == [(0, F(1, 2), 48), (0, F(1, 2), 52), (F(1, 2), 1, 55)]
+    assert MRPPattern(60).events(3) == [(0, 1, 60)]
+    starts, ends, values = MRPPattern([48, 50]).query(0)
+    assert starts.tolist() == [0, 0.5] and values.tolist() == [48, 50]
+    for bad in ("", "[48 50", "48 ]", "48*x", "a b", "<>"):
+        with pytest.raises(ValueError):
+            MRPPattern(bad)
+
+def test_compile(mrp):
+    seq = MRPSequencer(mrp)
+    seq.set('p1', "48 72", intensity="1 0.5", pitch="[1 0 -1] 0")
+    seq.set('p2', "60", legato=0.5, brightness="0.25")
+    events = seq.compile(2)
+    assert events.dtype == SEQUENCER_EVENT_DTYPE
+    assert np.all(np.diff(events['time']) >= 0)
+    rows = [(t, k, n) for t, k, n in zip(events['time'].tolist(), events['kind'].tolist(), events['note'].tolist())]
+    assert rows[:4] == [(2.0, EVENT_NOTE_ON, 48), (2.0, EVENT_NOTE_ON, 60)] + rows[2:4]
+    assert (2.5, EVENT_NOTE_OFF, 48) in rows and (2.5, EVENT_NOTE_OFF, 60) in rows
+    assert rows.index((2.5, EVENT_NOTE_OFF, 48)) < rows.index((2.5, EVENT_NOTE_ON, 72)) # offs first
+    q = events[events['kind'] == EVENT_QUALITY]
+    values = {(int(n), STATE_QUALITIES[i]): v for n, i, v in zip(q['note'], q['quality'], q['value'])}
+    assert values == {(48, 'intensity'): 1, (48, 'pitch'): 1, (60, 'brightness'): 0.25,
+                      (72, 'intensity'): 0.5, (72, 'pitch'): 0}
+    with pytest.raises(ValueError):
+        seq.set('p3', "48", loudness="1")
+
+def test_dispatch(mrp):
+    seq = MRPSequencer(mrp)
+    seq.set('p1', "48 50", intensity="0.5")
+    events = seq.compile(0)
+    seq.dispatch(events[events['time'] == 0])
+    assert mrp.osc.sent == [('/mrp/midi', 159, 48, 1), ('/mrp/quality/intensity', 15, 48, 0.5)]
+    seq.dispatch(events[events['time'] == 0.5])
+    assert mrp.voices == [50]
+
+def test_bundle_is_per_thread(mrp):
+    inside, done = threading.Event(), threading.Event()
+    def performer():
+        inside.wait()
+        mrp.note_on(60)
+        done.set()
+    thread = threading.Thread(target=performer)
+    thread.start()
+    with mrp.bundle() as messages:
+        mrp.note_on(48)
+        inside.set()
+        assert done.wait(1)
+        assert mrp.osc.sent == [('/mrp/midi', 159, 60, 1)] # sent at once, not collected
+        assert messages == [('/mrp/midi', (159, 48, 1))]
+    thread.join()
+    assert mrp.osc.sent[-1] == ('/mrp/midi', 159, 48, 1)
+
+def test_play(udp_osc):
+    with MRPEmulator(port=0) as emulator:
+        mrp = MRP(udp_osc, settings={'address': {'ip': '127.0.0.1', 'port': emulator.port}})
+        seq = MRPSequencer(mrp, cps=10, latency=0.05) # 100 ms cycles
+        seq.set('p1', "48 [50 52]", intensity="1 0.5")
+        seq.start(cycle=0)
+        time.sleep(0.33)
+        seq.stop()
+        assert emulator.wait(3 * 8 + 2, timeout=2)
+        time.sleep(0.1)
+        s = emulator.stats()
+        assert s['bundles'] >= 9 and s['late'] == 0
+        assert seq.dispatched >= 3 * 3 * 2
+        assert emulator.state.notes_on() == [] # all notes off after the last events
+        assert ('/mrp/quality/intensity', (15, 52, 0.5)) in emulator.messages
+        # notes play on their cycle positions
+        times = [t for t, (path, args) in zip(emulator.arrivals, emulator.messages) if path == '/mrp/midi' and args[0] == 159 and args[1] == 48]
+        assert len(times) >= 3
+        assert np.diff(times) == pytest.approx([0.1] * (len(times) - 1), abs=0.02)
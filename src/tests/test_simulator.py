@@ -0,0 +1,41 @@
+import pytest
+import numpy as np
+
+from iimrp.simulator import *
+
+@pytest.fixture
+def setup():
+    sim = MRPSimulator(sample_rate=22050, block_size=256)
+    return sim
+
+def test_silence(setup):
+    sim = setup
+    audio = sim.process(4096)
+    assert audio.dtype == np.float32 and len(audio) == 4096
+    assert np.all(audio == 0)
+
+def test_note_on_off(setup):
+    sim = setup
+    sim.handle('/mrp/midi', 159, 60, 127)
+    sim.handle('/mrp/quality/intensity', 15, 60, 1.0)
+    on = sim.process(22050)
+    assert np.abs(on[-2048:]).max() > 0, "note should sound"
+    sim.handle('/mrp/midi', 143, 60, 0)
+    off = sim.process(22050 * 20)
+    assert np.abs(off[-2048:]).max() < np.abs(on[-2048:]).max() * 1e-2, "note should ring out"
+
+def test_harmonics_raw_frequency(setup):
+    sim = setup
+    sim.handle('/mrp/midi', 159, 69, 127)
+    sim.handle('/mrp/quality/intensity', 15, 69, 1.0)
+    sim.handle('/mrp/quality/harmonics/raw', 15, 69, 0.0, 1.0)
+    audio = sim.process(22050)[-8192:]
+    spectrum = np.abs(np.fft.rfft(audio * np.hanning(len(audio))))
+    peak = np.argmax(spectrum) * 22050 / len(audio)
+    assert abs(peak - 880) < 10, f"peak at {peak} Hz, should be the 2nd harmonic of A4"
+
+def test_render(setup):
+    sim = setup
+    messages = [(0.0, '/mrp/midi', (159, 60, 127)), (0.0, '/mrp/quality/intensity', (15, 60, 1.0)), (0.5, '/mrp/midi', (143, 60, 0))]
+    audio = sim.render(messages, tail=0.5)
+    assert len(audio) == pytest.approx(22050, abs=256)
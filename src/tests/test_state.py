@@ -0,0 +1,76 @@
+import pytest
+
+from iimrp.iimrp import MRP
+from iimrp.emulator import MRPEmulator
+from iimrp.state import *
+
+def play(mrp):
+    for note in (48, 52, 55, 60):
+        mrp.note_on(note)
+    mrp.set_note_qualities(48, {'brightness': 0.5, 'intensity': 0.75, 'harmonics_raw': [0.25, 0.5]})
+    mrp.set_note_quality(60, 'pitch', 0.125)
+    mrp.note_off(52)
+    mrp.pedal_damper(1.0)
+    mrp.ui_volume(0.5)
+
+def replayed(messages, state=None):
+    state = MRPState() if state is None else state.copy()
+    for path, args in messages:
+        state.apply(path, *args)
+    return state
+
+def test_from_mrp(mrp):
+    play(mrp)
+    state = MRPState.from_mrp(mrp)
+    assert state == replayed((path, args) for path, *args in mrp.osc.sent)
+    assert state.notes_on() == mrp.voices == [48, 55, 60]
+    assert state.ui == {'volume': 0.5, 'volume_raw': None}
+
+def test_diff(mrp):
+    play(mrp)
+    target = mrp.snapshot()
+    assert MRPState().diff(target) == target.messages()
+    assert target.diff(target) == []
+    # one quality and one note away
+    current = target.copy()
+    current.apply('/mrp/quality/intensity', 15, 48, 0.0)
+    current.apply('/mrp/midi', 143, 55, 0)
+    current.apply('/mrp/midi', 159, 72, 1)
+    msgs = current.diff(target)
+    assert msgs == [('/mrp/midi', (143, 72, 0)), ('/mrp/quality/intensity', (15, 48, 0.75)), ('/mrp/midi', (159, 55, 1))]
+    assert replayed(msgs, current) == target
+    # far away: a reset is shorter
+    current = MRPState()
+    for note in range(30, 50):
+        current.apply('/mrp/midi', 159, note, 1)
+    msgs = current.diff(target)
+    assert msgs[0] == ('/mrp/allnotesoff', ())
+    assert len(msgs) < len(current.diff(target, allow_reset=False))
+    assert replayed(msgs, current) == replayed(current.diff(target, allow_reset=False), current) == target
+
+def test_bundle_messages():
+    from pythonosc.osc_message_builder import OscMessageBuilder
+    messages = [('/mrp/quality/harmonics/raw', (15, n) + (0.5,) * 16) for n in range(40)]
+    m = OscMessageBuilder(messages[0][0])
+    for a in messages[0][1]:
+        m.add_arg(a)
+    assert osc_message_size(*messages[0]) == m.build().size
+    bundles = bundle_messages(messages, 512)
+    assert sum(bundles, []) == messages
+    assert all(16 + sum(4 + osc_message_size(*m) for m in b) <= 512 for b in bundles)
+    assert len(bundles) == len(messages) // (512 // (4 + osc_message_size(*messages[0])))
+    assert bundle_messages(messages[:1], 16) == [messages[:1]]
+
+def test_resync(udp_osc):
+    with MRPEmulator(port=0) as emulator:
+        mrp = MRP(udp_osc, settings={'address': {'ip': '127.0.0.1', 'port': emulator.port}})
+        play(mrp)
+        assert emulator.wait(11)
+        emulator.reset() # the MRP software restarts
+        bundles = mrp.resync(max_bytes=256)
+        n = sum(len(b) for b in bundles)
+        assert emulator.wait(n)
+        assert emulator.snapshot() == mrp.snapshot()
+        assert emulator.stats()['bundles'] == len(bundles) < n
+        # already in sync
+        assert mrp.resync(emulator.snapshot()) == []
@@ -0,0 +1,103 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+
+from iimrp.recording import iter_log, concat_batches
+from iimrp.utils import *
+
+def reduce_gap_loop(df, max_gap=20, min_gap=10):
+    # the original row-by-row implementation
+    df = df.copy()
+    df.reset_index(drop=True, inplace=True)
+    for i in range(len(df) - 1):
+        if df.loc[i + 1, 'time'] - df.loc[i, 'time'] > max_gap:
+            df.loc[i + 1:, 'time'] -= df.loc[i + 1, 'time'] - df.loc[i, 'time'] - min_gap
+    return df
+
+@pytest.fixture
+def times():
+    rng = np.random.default_rng(0)
+    gaps = np.where(rng.random(500) < 0.05, rng.random(500) * 100, rng.random(500))
+    return np.cumsum(gaps)
+
+def test_reduce_gap(times):
+    df = pd.DataFrame({'time': times, 'osc': '/mrp/midi'})
+    np.testing.assert_allclose(reduce_gap(df)['time'], reduce_gap_loop(df)['time'])
+
+def test_policies(times):
+    df = pd.DataFrame({'time': times})
+    gaps = np.diff(times)
+    long = gaps > 20
+    for policy, expected in (('fixed', 10), ('cap', 20), ('scale', gaps[long] * 0.5)):
+        new_gaps = np.diff(reduce_gap(df, policy=policy)['time'])
+        np.testing.assert_allclose(new_gaps[long], expected)
+        np.testing.assert_allclose(new_gaps[~long], gaps[~long])
+    with pytest.raises(ValueError):
+        reduce_gap(df, policy='squash')
+
+def test_reduce_gap_stream(times):
+    df = pd.DataFrame({'time': times})
+    chunks = [df.iloc[i:i + 64] for i in range(0, len(df), 64)]
+    streamed = pd.concat(reduce_gap_stream(chunks, policy='cap'))
+    np.testing.assert_allclose(streamed['time'], reduce_gap(df, policy='cap')['time'])
+
+def test_reduce_gap_stream_batches(times):
+    log = ''.join(f'{t:.5f} /mrp/midi iii 159 60 1\n' for t in times)
+    batches = list(reduce_gap_stream(iter_log(io.StringIO(log), chunk_size=64)))
+    assert len(batches) > 1
+    expected = reduce_gap(pd.DataFrame({'time': np.round(times, 5)}))['time']
+    np.testing.assert_allclose(concat_batches(batches)['time'], expected)
+
+def test_gen_events_to_mrp(tmp_path):
+    events = {
+        0.1: {'pitch': 60, 'vel': 90, 'time': 0.1},
+        0.2: {'pitch': 60, 'quality': 'intensity', 'value': 0.123456},
+        0.3: {'pitch': 60, 'quality': 'pitch_vibrato', 'value': 0.5},
+        0.4: {'pitch': 60, 'vel': 0, 'time': 0.2},
+    }
+    df = gen_events_to_df(events, ['time', 'osc', 'types', 'v0', 'v1', 'v2'])
+    assert list(df['osc']) == ['/mrp/midi', '/mrp/quality/intensity', '/mrp/quality/pitch/vibrato', '/mrp/midi']
+    rows = df_to_mrp(df, str(tmp_path / 'gen.log'))
+    assert rows == [
+        '0.10000 /mrp/midi iii 159 60 127',
+        '0.20000 /mrp/quality/intensity iif 15 60 0.12346',
+        '0.30000 /mrp/quality/pitch/vibrato iif 15 60 0.50000',
+        '0.40000 /mrp/midi iii 143 60 0',
+    ]
+    assert (tmp_path / 'gen.log').read_text() == '\n'.join(rows) + '\n'
+
+def test_df_to_mrp_roundtrip(tmp_path):
+    log = '0.50414 /mrp/midi iii 159 48 1\n0.60000 /mrp/quality/brightness iif 15 48 0.25000\n'
+    (tmp_path / 'in.log').write_text(log)
+    df_to_mrp(mrp_to_df(str(tmp_path / 'in.log')), str(tmp_path / 'out.log'))
+    assert (tmp_path / 'out.log').read_text() == log
+
+def test_format_mrp_rows_no_args():
+    rows = format_mrp_rows([np.array([0.5, 1.0]), np.array(['/mrp/allnotesoff', '/mrp/pedal/damper'], dtype=object),
+        np.array([np.nan, 'f'], dtype=object), np.array([np.nan, 1.0])])
+    assert rows == ['0.50000 /mrp/allnotesoff', '1.00000 /mrp/pedal/damper f 1.00000']
+
+def test_load_mrp_files(tmp_path):
+    logs = ['0.00000 /mrp/midi iii 159 48 1\n1.50000 /mrp/custom f 2.00000\n',
+            '0.50000 /mrp/quality/harmonics/raw iiff 15 48 0.10000 0.20000\n2.00000 /mrp/midi iii 143 48 0\n']
+    for i, log in enumerate(logs):
+        (tmp_path / f'{i}.log').write_text(log)
+    batch = load_mrp_dir(str(tmp_path), workers=2)
+    np.testing.assert_allclose(batch['time'], [0.0, 1.5, 2.0, 3.5])
+    assert [path for _, path, _ in batch.messages()] == ['/mrp/midi', '/mrp/custom', '/mrp/quality/harmonics/raw', '/mrp/midi']
+    assert list(batch.messages())[2][2] == (15, 48, 0.1, 0.2)
+    (tmp_path / 'notes.txt').write_text('0.50000 /mrp/midi iii 159 48 1\n2.00000 /mrp/midi iii 143 48 0\n')
+    df = load_mrp_files([str(tmp_path / 'notes.txt')] * 2, workers=2, df=True)
+    np.testing.assert_allclose(df['time'], [0.5, 2.0, 2.5, 4.0])
+
+def test_gen_events_to_midi(tmp_path):
+    import mido
+    events = {0.0: {'pitch': 60, 'vel': 90.2, 'time': 0.0}, 0.5: {'pitch': 60, 'vel': 0, 'time': 0.5}}
+    file = gen_events_to_midi_file(events, str(tmp_path / 'gen'))
+    messages = [m for m in mido.MidiFile(file) if not m.is_meta]
+    assert [(m.type, m.note, m.velocity) for m in messages] == [('note_on', 60, 90), ('note_off', 60, 100)]
+    assert messages[1].time == pytest.approx(0.5)
+    mid = gen_events_to_midi(events, str(tmp_path / 'gen'))
+    assert isinstance(mid, mido.MidiFile) and mid.filename.endswith('.mid')
+    assert [m for m in mid if not m.is_meta] == messages